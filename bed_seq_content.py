@@ -0,0 +1,191 @@
+"""
+bed_seq_content.py
+
+Computes the base composition of each entry of a .bed file from a genome FASTA file, in the
+same format as bedtools nuc: the original columns of each entry followed by the proportion of
+A/T and G/C bases, the number of A, C, G, T, N and other bases (counted case-insensitively),
+and the length of the entry. Entries on chromosomes that aren't in the FASTA file, or that run
+past the end of their chromosome, are skipped with a warning like bedtools does.
+
+The FASTA file is read through chipseq.FastaFile, which memory-maps it and only reads the bases
+of each entry, so the genome is never loaded into memory. The entries are read in chunks and the
+bases of a whole chunk are counted in one numpy call. With --workers, the chunks are counted in
+parallel and written in input order.
+
+Requires Python >= 2.7
+"""
+
+import argparse, sys, struct, multiprocessing
+import chipseq
+from itertools import groupby, islice
+
+## numpy is only needed to count a chunk's bases at once; without it each entry's bases are
+## counted with str.count
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+## the columns bedtools nuc adds after the original ones, in order
+NUC_COLUMNS = ['pct_at', 'pct_gc', 'num_A', 'num_C', 'num_G', 'num_T', 'num_N', 'num_oth', 'seq_len']
+
+## the class each byte is counted in: 0-3 for ACGT, 4 for N and 5 for anything else
+BASE_CLASSES = [5] * 256
+for i, bases in enumerate(['Aa', 'Cc', 'Gg', 'Tt', 'Nn']):
+    for base in bases:
+        BASE_CLASSES[ord(base)] = i
+if numpy is not None:
+    BASE_CLASS_TABLE = numpy.array(BASE_CLASSES, dtype=numpy.int64)
+
+# define a convenience dictionary to make subsetting clearer
+bed_coords = {"chrom": 0, "start": 1, "end": 2}
+
+def is_header(line):
+    """
+    checks whether a line of the .bed file is a header, comment or blank line
+    """
+    return not line.strip() or line.startswith('#') or line.startswith('track') or line.startswith('browser')
+
+def nuc_header(num_columns):
+    """
+    makes the header line that bedtools nuc writes for a .bed file with this many columns
+    """
+    names = ['%d_usercol' % (i+1) for i in range(num_columns)]
+    names += ['%d_%s' % (num_columns+i+1, name) for i, name in enumerate(NUC_COLUMNS)]
+    return '#' + '\t'.join(names) + '\n'
+
+def count_bases(seqs):
+    """
+    counts the bases of each sequence in each class of BASE_CLASSES. returns one list of 6
+    counts per sequence. with numpy, the sequences are joined and every base is counted in a
+    single bincount, keyed by the sequence it came from and its class
+    """
+    if numpy is None:
+        counts = []
+        for seq in seqs:
+            this_counts = [seq.count(bases[0]) + seq.count(bases[1]) for bases in ['Aa', 'Cc', 'Gg', 'Tt', 'Nn']]
+            counts.append(this_counts + [len(seq) - sum(this_counts)])
+        return counts
+    lengths = numpy.array([len(seq) for seq in seqs], dtype=numpy.int64)
+    codes = BASE_CLASS_TABLE[numpy.frombuffer(''.join(seqs), dtype=numpy.uint8)]
+    keys = numpy.repeat(numpy.arange(len(seqs), dtype=numpy.int64) * 6, lengths) + codes
+    return numpy.bincount(keys, minlength=len(seqs) * 6).reshape(-1, 6).tolist()
+
+def as_float32(value):
+    """
+    rounds a number to single precision, since bedtools nuc computes the proportions as floats
+    """
+    return struct.unpack('f', struct.pack('f', value))[0]
+
+def nuc_row(fields, counts):
+    """
+    formats the output line of one entry given its split .bed line and its base counts
+    """
+    num_a, num_c, num_g, num_t, num_n, num_other = counts
+    seq_len = sum(counts)
+    if seq_len:
+        pct_at = '%f' % as_float32(as_float32(num_a + num_t) / seq_len)
+        pct_gc = '%f' % as_float32(as_float32(num_c + num_g) / seq_len)
+    else:
+        pct_at = pct_gc = 'nan'
+    return '\t'.join(fields + [pct_at, pct_gc] + [str(c) for c in counts] + [str(seq_len)]) + '\n'
+
+## the FASTA file of each worker process, opened when the pool starts
+worker_fasta = None
+def init_worker(fasta_f):
+    global worker_fasta
+    worker_fasta = chipseq.FastaFile(fasta_f)
+
+def chunk_content(job):
+    """
+    computes the output lines of a chunk of entries on one chromosome. returns the output text
+    and the warnings for the entries that were skipped
+    """
+    chrom, lines = job
+    fasta = worker_fasta
+    if chrom not in fasta:
+        return '', ['WARNING. chromosome (%s) was not found in the FASTA file. Skipping.\n' % chrom]
+    chrom_length = fasta.length(chrom)
+    entries = []
+    seqs = []
+    warnings = []
+    for line in lines:
+        fields = line.rstrip('\r\n').split('\t')
+        start = int(fields[bed_coords['start']])
+        end = int(fields[bed_coords['end']])
+        if start > chrom_length or end > chrom_length:
+            warnings.append('Feature (%s:%d-%d) beyond the length of %s size (%d bp).  Skipping.\n' % (chrom, start, end, chrom, chrom_length))
+            continue
+        entries.append(fields)
+        seqs.append(fasta.fetch(chrom, start, end))
+    out_text = ''.join([nuc_row(fields, counts) for fields, counts in zip(entries, count_bases(seqs))])
+    return out_text, warnings
+
+def chunk_jobs(bed_lines, chunk_size):
+    """
+    splits the data lines of a .bed file into chunks of at most chunk_size entries, each on a
+    single chromosome. yields (chromosome, lines) jobs in the order of the file
+    """
+    for chrom, chrom_lines in groupby(bed_lines, lambda l: l.split('\t', 1)[bed_coords['chrom']]):
+        while True:
+            lines = list(islice(chrom_lines, chunk_size))
+            if not lines:
+                break
+            yield chrom, lines
+
+def compute_seq_content(fasta_f, bed_lines, out, workers=1, chunk_size=10000):
+    """
+    the main function: writes the bedtools nuc output for the lines of a .bed file to out. the
+    header is based on the number of columns of the first entry. if workers is more than 1, the
+    chunks are computed in a pool of worker processes, which gives the same output
+    """
+    bed_lines = (line for line in bed_lines if not is_header(line))
+    first_line = next(bed_lines, None)
+    if first_line is None:
+        return
+    out.write(nuc_header(len(first_line.rstrip('\r\n').split('\t'))))
+
+    def all_lines():
+        yield first_line
+        for line in bed_lines:
+            yield line
+    jobs = chunk_jobs(all_lines(), chunk_size)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, init_worker, (fasta_f,))
+        results = pool.imap(chunk_content, jobs)
+    else:
+        pool = None
+        init_worker(fasta_f)
+        results = (chunk_content(job) for job in jobs)
+    missing = set()
+    try:
+        for out_text, warnings in results:
+            for warning in warnings:
+                ## bedtools only warns once about each missing chromosome
+                if warning not in missing:
+                    sys.stderr.write(warning)
+                if warning.startswith('WARNING. chromosome'):
+                    missing.add(warning)
+            out.write(out_text)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Compute the base composition of each entry of a .bed file, in the same format as bedtools nuc")
+    parser.add_argument("fasta", help="The genome FASTA file. It must be uncompressed; a .fai index is built next to it if there isn't one")
+    parser.add_argument("input_bed", help="The .bed file to compute the base composition of, or - (or stdin) to read it from standard input. It can be gzip or zstd compressed")
+    parser.add_argument("output", nargs='?', help="The output file. The output is written to standard output if this isn't given", default=None)
+    parser.add_argument("--workers", type=int, help="The number of processes to use. The entries are split into chunks on each chromosome, and the output is the same as a serial run", default=1)
+    parser.add_argument("--chunk_size", type=int, help="The number of entries counted at once", default=10000)
+    pargs = parser.parse_args()
+
+    if pargs.input_bed in ['-', 'stdin']:
+        bed_in = sys.stdin
+    else:
+        bed_in = chipseq.openFile(pargs.input_bed)
+    out = open(pargs.output, 'w') if pargs.output else sys.stdout
+    compute_seq_content(pargs.fasta, bed_in, out, pargs.workers, pargs.chunk_size)
+    if pargs.output:
+        out.close()
+    bed_in.close()
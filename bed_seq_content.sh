@@ -3,7 +3,8 @@
 ## bed_seq_content.sh
 ## alex amlie-Wolf
 ## april/may 2015
-## takes a bed file, computes various sequence statistics. basically a wrapper for bedtools nuc
+## takes a bed file, computes various sequence statistics. same output as bedtools nuc, computed
+## by bed_seq_content.py
 ## two arguments: input and output
 
 FA_FILE=/home/alexaml/data/refgenomes/hg19/hg19.fa
@@ -13,7 +14,7 @@ if [ $# == 2 ];
 then
     INFILE=$1
     OUTFILE=$2
-    bedtools nuc -fi $FA_FILE -bed $INFILE > $OUTFILE
+    python ~/code/bed_statistics/bed_seq_content.py $FA_FILE $INFILE $OUTFILE
 else
     echo "Usage: $0 <input bed file> <output file>"
 fi
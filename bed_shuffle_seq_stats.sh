@@ -12,7 +12,7 @@ if [ $# == 2 ];
 then
     INFILE=$1
     OUTFILE=$2
-    bedtools shuffle -chrom -i $INFILE -g $GENOME_SIZES | bedtools nuc -fi $GENOME_FA -bed stdin > $2
+    bedtools shuffle -chrom -i $INFILE -g $GENOME_SIZES | python ~/code/bed_statistics/bed_seq_content.py $GENOME_FA - > $2
 else
     echo "Usage: $0 INPUT_BED OUTPUT_FILE"
 fi
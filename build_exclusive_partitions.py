@@ -0,0 +1,24 @@
+#!/usr/bin/python
+
+## build_exclusive_partitions.py
+## takes merged bed files in priority order (like promoters > exons > introns > repeats) and
+## writes the exclusive partition of each one: the parts of it not covered by any of the files
+## before it. this replaces the bedtools complement / intersect cascades of the
+## generate_*_elements.sh scripts, and the outputs are sorted the same way (sort -k1,1V -k2,2n)
+## should be in the same directory as the chipseq.py file
+
+import chipseq, sys, argparse
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Split merged bed files into exclusive partitions, where each file loses the loci covered by the files before it")
+    parser.add_argument("chrom_sizes", help="The chromosome sizes file. The partitions after the first one only keep loci on these chromosomes, within their sizes, like bedtools complement")
+    parser.add_argument("--level", nargs=2, action="append", required=True, help="An input bed file and the output file for its exclusive partition. Give one for each file, from the highest priority to the lowest; the first one is written as it is", metavar=('INPUT', 'OUTPUT'))
+    pargs = parser.parse_args()
+
+    try:
+        chipseq.exclusivePartitions([l[0] for l in pargs.level], [l[1] for l in pargs.level], pargs.chrom_sizes)
+    except (IOError, ValueError), e:
+        sys.stderr.write(str(e)+"\n")
+        sys.exit(1)
+    for bed_f, out_f in pargs.level:
+        print "Partitioned %s into %s" % (bed_f, out_f)
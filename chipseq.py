@@ -1,359 +1,1281 @@
-#!/usr/bin/python
-# Contains useful functions for manipulating chIPseq data
-# Greg Donahue, 06-16-2010
-# ------------------------------------------------------------------------------
-import sys
-# ------------------------------------------------------------------------------
-# GLOBALS
-# Genome sizes
-genome_sizes = { "hg18":3107677273, "hg19":3137161264,
-                 "mm8":2664455088, "mm9":2725765481,
-                 "sacCer1":12156302, "sacCer2":12156677 }
-
-# ------------------------------------------------------------------------------
-# CLASSES
-# The BedReader class lets us easily spool through BED files
-class BedReader:
-    
-    # Instance variables
-    # handle is the file being read
-    # delimiter is the record delimiter character
-    # header is any header information collected from this file
-    # spool holds the current line
-    
-    # Initialize new BedReaders
-    def __init__(self, filename):
-        self.handle = open(filename)
-        self.delimiter = "\t" if self.usesTabs(filename) else " "
-        self.header = dict()
-        if self.hasHeader(filename): self.getHeader(self.handle.readline())
-        self.spool = self.handle.readline()
-
-    # Determine whether a BED file has a header
-    def hasHeader(self, filename):
-        f = open(filename); line = f.readline(); f.close()
-        return line[0:5] == "track"
-
-    # Determine whether a BED file uses tab or space delimiters
-    def usesTabs(self, filename):
-        f = open(filename); line = f.readline(); line = f.readline(); f.close()
-        return line.count("\t") > 0
-
-    # Get header information from the header string
-    def getHeader(self, hstring):
-        key, value, adding_to_key, in_quotes = "", "", True, False
-        for i in range(6, len(hstring)-1):
-            if hstring[i] == " ":
-                if in_quotes: value += hstring[i]
-                else:
-                    self.header[key] = value
-                    key, value, adding_to_key = "", "", True
-            elif hstring[i] == "\"":
-                if in_quotes:
-                    self.header[key] = value+hstring[i]
-                    key, value, adding_to_key, in_quotes = "", "", True, False
-                else: value, in_quotes = value+hstring[i], True
-            elif hstring[i] == "=": adding_to_key = False
-            else:
-                if adding_to_key: key += hstring[i]
-                else: value += hstring[i]
-        self.header[key] = value
-        if "" in self.header.keys(): del self.header[""]
-
-    # Return the next line
-    def read(self):
-        ret = self.format(self.spool)
-        self.spool = self.handle.readline()
-        return ret
-
-    # Format a record string into a list of fields
-    def format(self, line):
-        ret, tokens = list(), line[0:-1].split(self.delimiter)
-        try:
-            ret.append(tokens[0])
-            ret.append(int(tokens[1]))
-            ret.append(int(tokens[2]))
-            ret.append(tokens[3])
-            ret.append(float(tokens[4]))
-            ret.append(tokens[5])
-            ret.append(int(tokens[6]))
-            ret.append(int(tokens[7]))
-            ret.append(tokens[8])
-            ret.append(int(tokens[9]))
-            ret.append([ int(bsize) for bsize in tokens[10].split(",") ])
-            ret.append([ int(btart) for bstart in tokens[11].split(",") ])
-        except Exception, e:
-            try: ret.append(tokens[4])
-            except Exception, e: ret.append(".")
-        return ret
-
-    # Does the file have any more data?
-    def hasMoreData(self): return self.spool != ""
-        
-    # Close the file handle
-    def close(self): self.handle.close()
-
-    # Make a header string from the header dictionary
-    def getHeaderString(self):
-        ret = "track"
-        for k in sorted(self.header.keys()): ret += " "+k+"="+self.header[k]
-        return ret+"\n"
-
-    # Make a record string from a record
-    def getRecordString(self, record):
-        ret = ""
-        try:
-            ret += record[0]
-            ret += "\t"+str(record[1])
-            ret += "\t"+str(record[2])
-            ret += "\t"+record[3]
-            ret += "\t"+str(record[4])
-            ret += "\t"+record[5]
-            ret += "\t"+str(record[6])
-            ret += "\t"+str(record[7])
-            ret += "\t"+record[8]
-            ret += "\t"+str(record[9])
-            ret += "\t"+str(record[10][0])
-            for bsize in record[10][1:]: ret += ","+str(bsize)
-            ret += "\t"+str(record[11][0])
-            for bstart in record[11][1:]: ret += ","+str(bstart)
-        except Exception, e: pass
-        return ret+"\n"
-
-# ------------------------------------------------------------------------------
-# FUNCTIONS
-# Convert a FASTA file downloaded from UCSC GB to one PWMSCAN can parse
-def convertFasta(filename):
-    fasta = getFasta(filename)
-    f = open(filename[0:-3]+".converted.fa", 'w')
-    for k in sorted(fasta.keys()):
-        f.write(">"+k.split(" ")[1]+"\n"+fasta[k]+"\n")
-    f.close()
-
-# Get a FASTA object (dictionary) from a FASTA file
-def getFasta(filename):
-    ret = dict()
-    f = open(filename)
-    line = f.readline()
-    while line != "":
-        if line[0] == ">":
-            header = line[1:-1]
-            ret[header] = ""
-        else: ret[header] += line[0:-1]
-        line = f.readline()
-    f.close()
-    return ret
-
-# Turn a GFF file generated by PWMSCAN into a BED file
-def gffToBed(filename):
-    gff = dict()
-    f = open(filename); line = f.readline()
-    while line != "":
-        t = line[0:-1].split("\t")
-        chromosome = t[0].split("=")[1].split(":")[0]
-        start = int(t[0].split("=")[1].split(":")[1].split("-")[0])
-        stop = start+int(t[4])
-        start += int(t[3])
-        try: gff[chromosome].append((start,stop))
-        except Exception, e: gff[chromosome] = [ (start,stop) ]
-        line = f.readline()
-    f.close()
-    f = open(filename[0:-3]+"bed", 'w')
-    for chromosome in gff.keys():
-        for record in gff[chromosome]:
-            f.write(chromosome+"\t"+str(record[0])+"\t"+str(record[1])+"\n")
-    f.close()
-
-# Rewrite bowtie output as a BED file
-def bowtieToBed(filename, name="ChIPseq", description="ChIPseq Raw Reads",
-                color="10,10,10"):
-    f = open(filename); line = f.readline()
-    g = open(filename[0:-3]+"bed", 'w')
-    #g.write("track name=\""+name+"\" description=\""+
-    #        description+"\" color="+color+" visibility=full\n")
-    while line != "":
-        t = line[0:-1].split("\t")
-        g.write(t[2]+"\t"+t[3]+"\t"+str(int(t[3])+len(t[4]))+"\t"+t[0]+
-                "\t0\t"+t[1]+"\n")
-        line = f.readline()
-    f.close()
-    g.close()
-
-# Get global statistics on a chIPseq file
-def getGlobalStatistics(filename, genome_size):
-    br = BedReader(filename)
-    count, average = 0.0, 0.0
-    while br.hasMoreData():
-        record = br.read()
-        count += 1
-        average += record[2]-record[1]
-    br.close()
-    average /= count
-    return { "Count":count,
-             "Average Tag Size":average,
-             "RPKM Coefficient":(1000*1000000)/(average*count),
-             "Coverage":count*average/genome_size }
-
-# Clean a BED file for preprocessing by BEDtools, etc
-def cleanBed(filename):
-    br = BedReader(filename); g = open(filename[0:-3]+"clean.bed", 'w')
-    while br.hasMoreData(): g.write(br.getRecordString(br.read()))
-    br.close(); g.close()
-
-# Get overlaps between two BED files
-def getOverlaps(bedfile_a, bedfile_b):
-    ret = dict()
-    primary_loci = loadLocusDictionary(bedfile_a)
-    secondary_loci = loadLocusDictionary(bedfile_b)
-    for chromosome in primary_loci.keys():
-        if not chromosome in secondary_loci.keys(): continue
-        for primary in primary_loci[chromosome]:
-            for secondary in secondary_loci[chromosome]:
-                if areOverlapping(primary, secondary): ret[tuple(primary)] = 0
-    return sorted(ret.keys())
-
-# Determine whether two loci (BED records) are overlapping
-def areOverlapping(a, b, symmetric_overlap=False):
-    if a[1] >= b[1] and a[1] <= b[2]: return True
-    if a[2] >= b[1] and a[2] <= b[2]: return True
-    if b[1] >= a[1] and b[1] <= a[2]: return True
-    if b[2] >= a[1] and b[2] <= a[2]: return True
-    return False
-
-# Load a locus dictionary of the form CHROMOSOME->[ RECORD_1, ..., RECORD_N ]
-def loadLocusDictionary(filename):
-    ret = dict()
-    br = BedReader(filename)
-    while br.hasMoreData():
-        record = br.read()
-        try: ret[record[0]].append(record)
-        except Exception, e: ret[record[0]] = [ record ]
-    br.close()
-    return ret
-
-# Count the number of entries in a locus dictionary
-def countLocusDictionary(ldict):
-    ret = 0
-    for chromosome in ldict.keys(): ret += len(ldict[chromosome])
-    return ret
-
-# Load an empty bin dictionary from a BED file
-def loadEmptyBinDictionary(filename, bin_size):
-    br = BedReader(filename)
-    ret = dict()
-    while br.hasMoreData():
-        record = br.read()
-        i = int(record[1]/bin_size)*bin_size
-        while i < int(record[2]/bin_size)*bin_size:
-            try: ret[record[0]][i] = 0
-            except Exception, e: ret[record[0]] = { i:0 }
-            i += bin_size
-    br.close()
-    return ret
-
-# Add reads from a BED file to a bin dictionary
-def loadBinDictionary(filename, bins, bin_size):
-    br = BedReader(filename)
-    while br.hasMoreData():
-        record = br.read()
-        if len(record) > 5: start = record[1] if record[5] == "+" else record[2]
-        else: start = record[1]
-        try: bins[record[0]][int(start/bin_size)*bin_size] += 1
-        except Exception, e: pass
-    br.close()
-
-# Normalize a bin dictionary by its RPKM
-def normalizeBinDictionary(bins, rpkm):
-    for chromosome in bins.keys():
-        for bin in bins[chromosome].keys():
-            bins[chromosome][bin] *= rpkm
-
-# Subtract one bin dictionary from another
-def subtractBinDictionaries(bins, background):
-    for chromosome in background.keys():
-        if not chromosome in bins.keys(): continue
-        for bin in background[chromosome].keys():
-            try: bins[chromosome][bin] -= background[chromosome][bin]
-            except Exception, e:
-                bins[chromosome][bin] = -1*background[chromosome][bin]
-
-# Merge overlapping regions in a BED file and write another BED
-def mergeBed(filename):
-    regions = dict()
-    br = BedReader(filename)
-    while br.hasMoreData():
-        r = br.read()
-        try: regions[r[0]].append((r[0],r[1],r[2]))
-        except Exception, e: regions[r[0]] = [ (r[0],r[1],r[2]) ]
-    br.close()
-    merged = dict()
-    for chromosome in regions.keys():
-        merged[chromosome] = list()
-        loci = sorted(regions[chromosome])
-        previous = loci[0]
-        for locus in loci[1:]:
-            if areOverlapping(previous, locus):
-                previous = (previous[0],previous[1],locus[2])
-            else:
-                merged[chromosome].append(previous)
-                previous = locus
-        merged[chromosome].append(locus)
-    f = open(filename[:-3]+"merged.bed", 'w')
-    for chromosome in sorted(merged.keys()):
-        for locus in merged[chromosome]:
-            f.write(chromosome+"\t"+str(locus[1])+"\t"+str(locus[2])+"\n")
-    f.close()
-
-# Prune a BED file to remove all entries with out-of-bounds errors
-def pruneBED(filename, size_file):
-    sizes = loadSizes(size_file)
-    br = BedReader(filename)
-    f = open(filename[:-3]+"pruned.bed", 'w')
-    while br.hasMoreData():
-        r = br.read()
-        if r[1] >= 0 and r[2] <= sizes[r[0]]: f.write(br.getRecordString(r))
-    br.close()
-    f.close()
-
-# Prune a BedGraph file to remove all entries with out-of-bounds errors
-def pruneBGR(filename, size_file):
-    sizes = loadSizes(size_file)
-    f = open(filename); line = f.readline()
-    g = open(filename[:-3]+"pruned.bgr", 'w')
-    while line != "":
-        if len(line) > 0 and not line[0] in [ "b", "t", "#" ]:
-            t = line[:-1].split("\t")
-            if int(t[1]) >= 0 and int(t[2]) <= sizes[t[0]]: g.write(line)
-        else: g.write(line)
-        line = f.readline()
-    f.close()
-    g.close()
-
-# Load a size file from UCSC Genome Browser
-def loadSizes(filename):
-    ret = dict()
-    f = open(filename); lines = f.readlines(); f.close()
-    for line in lines:
-        t = line[:-1].split("\t")
-        ret[t[0]] = int(t[1])
-    return ret
-
-# Load a dictionary of the form (chromosome,start,stop)->score from a bedGraph
-def loadBedGraph(filename):
-    f = open(filename); lines = f.readlines(); f.close()
-    i = 0
-    while i < len(lines):
-        if lines[i][0] in [ "t", "b", "#" ]: i += 1
-        else: break
-    ret = dict()
-    for line in lines[i:]:
-        t = line[:-1].split("\t")
-        ret[(t[0],int(t[1]),int(t[2]))] = float(t[3])
-    return ret
-
-# ------------------------------------------------------------------------------
-# The following code is executed upon command-line invocation
-if __name__ == "__main__": main(sys.argv)
-
-# ------------------------------------------------------------------------------
-# EOF
+#!/usr/bin/python
+# Contains useful functions for manipulating chIPseq data
+# Greg Donahue, 06-16-2010
+# ------------------------------------------------------------------------------
+import sys, os, re, json, struct, heapq, tempfile, time, resource, multiprocessing, gzip, zlib, mmap
+from array import array
+from bisect import bisect_right
+# numpy is only needed by the array-backed functions
+try: import numpy
+except ImportError, e: numpy = None
+# ------------------------------------------------------------------------------
+# GLOBALS
+# Genome sizes
+genome_sizes = { "hg18":3107677273, "hg19":3137161264,
+                 "mm8":2664455088, "mm9":2725765481,
+                 "sacCer1":12156302, "sacCer2":12156677 }
+
+# First line of the binary files written by saveArrayStore
+array_store_magic = "BEDSTATS_ARRAYS 1\n"
+
+# First line of the chromosome offset caches written by loadChromOffsets
+chrom_offsets_magic = "#chrom_offsets"
+
+# Magic numbers of the compressed formats openFile understands
+gzip_magic = "\x1f\x8b"
+zstd_magic = "\x28\xb5\x2f\xfd"
+
+# ------------------------------------------------------------------------------
+# CLASSES
+# The BedReader class lets us easily spool through BED files
+class BedReader:
+    
+    # Instance variables
+    # handle is the file being read
+    # delimiter is the record delimiter character
+    # header is any header information collected from this file
+    # spool holds the current line
+    
+    # Initialize new BedReaders. The header and delimiter are sniffed from the first
+    # lines of the open file, which then become the spool
+    def __init__(self, filename):
+        self.handle = openFile(filename)
+        self.header = dict()
+        self.spool = self.handle.readline()
+        if self.spool[0:5] == "track":
+            self.getHeader(self.spool)
+            self.spool = self.handle.readline()
+        self.delimiter = "\t" if self.spool.count("\t") > 0 else " "
+
+    # Get header information from the header string
+    def getHeader(self, hstring):
+        key, value, adding_to_key, in_quotes = "", "", True, False
+        for i in range(6, len(hstring)-1):
+            if hstring[i] == " ":
+                if in_quotes: value += hstring[i]
+                else:
+                    self.header[key] = value
+                    key, value, adding_to_key = "", "", True
+            elif hstring[i] == "\"":
+                if in_quotes:
+                    self.header[key] = value+hstring[i]
+                    key, value, adding_to_key, in_quotes = "", "", True, False
+                else: value, in_quotes = value+hstring[i], True
+            elif hstring[i] == "=": adding_to_key = False
+            else:
+                if adding_to_key: key += hstring[i]
+                else: value += hstring[i]
+        self.header[key] = value
+        if "" in self.header.keys(): del self.header[""]
+
+    # Return the next line
+    def read(self):
+        ret = self.format(self.spool)
+        self.spool = self.handle.readline()
+        return ret
+
+    # Format a record string into a list of fields
+    def format(self, line):
+        ret, tokens = list(), line[0:-1].split(self.delimiter)
+        try:
+            ret.append(tokens[0])
+            ret.append(int(tokens[1]))
+            ret.append(int(tokens[2]))
+            ret.append(tokens[3])
+            ret.append(float(tokens[4]))
+            ret.append(tokens[5])
+            ret.append(int(tokens[6]))
+            ret.append(int(tokens[7]))
+            ret.append(tokens[8])
+            ret.append(int(tokens[9]))
+            ret.append([ int(bsize) for bsize in tokens[10].split(",") ])
+            ret.append([ int(btart) for bstart in tokens[11].split(",") ])
+        except Exception, e:
+            try: ret.append(tokens[4])
+            except Exception, e: ret.append(".")
+        return ret
+
+    # Does the file have any more data?
+    def hasMoreData(self): return self.spool != ""
+        
+    # Close the file handle
+    def close(self): self.handle.close()
+
+    # Make a header string from the header dictionary
+    def getHeaderString(self):
+        ret = "track"
+        for k in sorted(self.header.keys()): ret += " "+k+"="+self.header[k]
+        return ret+"\n"
+
+    # Make a record string from a record
+    def getRecordString(self, record):
+        ret = ""
+        try:
+            ret += record[0]
+            ret += "\t"+str(record[1])
+            ret += "\t"+str(record[2])
+            ret += "\t"+record[3]
+            ret += "\t"+str(record[4])
+            ret += "\t"+record[5]
+            ret += "\t"+str(record[6])
+            ret += "\t"+str(record[7])
+            ret += "\t"+record[8]
+            ret += "\t"+str(record[9])
+            ret += "\t"+str(record[10][0])
+            for bsize in record[10][1:]: ret += ","+str(bsize)
+            ret += "\t"+str(record[11][0])
+            for bstart in record[11][1:]: ret += ","+str(bstart)
+        except Exception, e: pass
+        return ret+"\n"
+
+# The BinTrack class holds read counts in fixed-size bins over a whole genome, with one
+# numpy array per chromosome. It does the same work as the bin dictionary functions, but
+# without a dictionary entry per bin
+class BinTrack:
+
+    # Instance variables
+    # bin_size is the size of each bin
+    # bins is a dictionary CHROMOSOME->array of bin values
+
+    # Initialize an empty track from a dictionary or file of chromosome sizes (loadSizes)
+    def __init__(self, sizes, bin_size, dtype="float64"):
+        requireNumpy("BinTrack")
+        if isinstance(sizes, str): sizes = loadSizes(sizes)
+        self.bin_size = bin_size
+        self.bins = dict()
+        for chromosome, size in sizes.items():
+            self.bins[chromosome] = numpy.zeros((size+bin_size-1)//bin_size, dtype=dtype)
+
+    # Add the reads in a BED file, binning each one by its 5' end like loadBinDictionary
+    # (reads without a strand column are binned by their start, and any strand but + is
+    # binned by its end). Reads on chromosomes that aren't in the track or past their ends
+    # are skipped
+    def addReads(self, filename):
+        for chunk in iterBedColumns(filename):
+            chrom = numpy.frombuffer(chunk["chrom"], dtype="l")
+            start = numpy.frombuffer(chunk["start"], dtype="l")
+            end = numpy.frombuffer(chunk["end"], dtype="l")
+            strand = numpy.frombuffer(chunk["strand"], dtype="S1")
+            columns = numpy.frombuffer(chunk["columns"], dtype=numpy.uint8)
+            # Like loadBinDictionary, reads with a strand column are binned by their end
+            # unless they're on the + strand
+            positions = numpy.where((columns > 5) & (strand != "+"), end, start)
+            for code, chromosome in enumerate(chunk["chromosomes"]):
+                if not chromosome in self.bins: continue
+                bins = self.bins[chromosome]
+                indices = positions[chrom == code]//self.bin_size
+                indices = indices[(indices >= 0) & (indices < len(bins))]
+                if len(indices) == 0: continue
+                bins += numpy.bincount(indices, minlength=len(bins)).astype(bins.dtype)
+
+    # Scale every bin by an RPKM coefficient (see getGlobalStatistics)
+    def normalize(self, rpkm):
+        for chromosome in self.bins.keys(): self.bins[chromosome] *= rpkm
+
+    # Subtract a background track with the same bins
+    def subtract(self, background):
+        if background.bin_size != self.bin_size:
+            raise ValueError("Can't subtract tracks with different bin sizes")
+        for chromosome in background.bins.keys():
+            if not chromosome in self.bins: continue
+            self.bins[chromosome] -= background.bins[chromosome]
+
+    # Get the (start of each bin, bin values) of one chromosome
+    def getChromosome(self, chromosome):
+        bins = self.bins[chromosome]
+        return numpy.arange(len(bins), dtype=numpy.int64)*self.bin_size, bins
+
+    # Save the track to a numpy .npz file (numpy adds the extension if it's missing)
+    def save(self, filename):
+        arrays = dict(("chrom_"+chromosome, bins) for chromosome, bins in self.bins.items())
+        numpy.savez(filename, bin_size=numpy.array([self.bin_size]), **arrays)
+
+# The BedGraphTrack class holds a bedGraph as sorted arrays per chromosome, with prefix sums
+# of the signal so the sum, mean and max over any interval can be found without going through
+# every entry. It takes about 40 bytes per entry, and can be saved to an array store that
+# loadBedGraphTrack memory-maps
+class BedGraphTrack:
+
+    # Instance variables
+    # tracks is a dictionary CHROMOSOME->(STARTS, ENDS, VALUES, SIGNAL, COVERED), where
+    # the entries are sorted by start, SIGNAL[i] is the sum of value*length of the first i
+    # entries, and COVERED[i] is the number of bases they cover
+
+    # Stream a bedGraph into the track, if one is given. The entries of a chromosome can't
+    # overlap each other, but don't have to be sorted
+    def __init__(self, filename=None):
+        requireNumpy("BedGraphTrack")
+        self.tracks = dict()
+        if filename is None: return
+        columns = dict()
+        for chunk in iterBedColumns(filename, names=True):
+            chrom = numpy.asarray(chunk["chrom"])
+            chunk["value"] = numpy.array(chunk["name"], dtype=numpy.float64)
+            for code, chromosome in enumerate(chunk["chromosomes"]):
+                rows = chrom == code
+                if not rows.any(): continue
+                c = columns.setdefault(chromosome, (array('l'), array('l'), array('d')))
+                for a, k in zip(c, [ "start", "end", "value" ]):
+                    a.fromstring(numpy.asarray(chunk[k])[rows].tostring())
+        for chromosome, (starts, ends, values) in columns.items():
+            self.setChromosome(chromosome, starts, ends, values)
+
+    # Set the entries of a chromosome, sorting them and computing their prefix sums
+    def setChromosome(self, chromosome, starts, ends, values):
+        order = numpy.argsort(starts, kind="mergesort")
+        starts = numpy.asarray(starts, dtype=numpy.int64)[order]
+        ends = numpy.asarray(ends, dtype=numpy.int64)[order]
+        values = numpy.asarray(values, dtype=numpy.float64)[order]
+        if (ends[:-1] > starts[1:]).any():
+            raise ValueError("The bedGraph entries on "+chromosome+" overlap")
+        signal = numpy.concatenate(([0.0], numpy.cumsum(values*(ends-starts))))
+        covered = numpy.concatenate(([0], numpy.cumsum(ends-starts)))
+        self.tracks[chromosome] = (starts, ends, values, signal, covered)
+
+    # Get the (starts, ends, values) of the entries on a chromosome
+    def getChromosome(self, chromosome): return self.tracks[chromosome][0:3]
+
+    # Get the signal (or, if covered is True, the number of covered bases) before each
+    # position of an array, on a chromosome
+    def cumulative(self, chromosome, positions, covered=False):
+        starts, ends, values, signal, covered_bases = self.tracks[chromosome]
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        if not len(starts): return numpy.zeros(positions.shape)
+        before = numpy.searchsorted(ends, positions, side="right")
+        inside = numpy.minimum(before, len(starts)-1)
+        partial = numpy.where((before < len(starts)) & (starts[inside] < positions), positions-starts[inside], 0)
+        if covered: return covered_bases[before]+partial
+        return signal[before]+values[inside]*partial
+
+    # Get the summed signal of each [start, end) interval on a chromosome. starts and ends
+    # can be numbers or arrays. Chromosomes that aren't in the track have no signal
+    def sum(self, chromosome, starts, ends):
+        if not chromosome in self.tracks: return numpy.zeros(numpy.shape(starts))
+        return self.cumulative(chromosome, ends)-self.cumulative(chromosome, starts)
+
+    # Get the mean signal of each [start, end) interval on a chromosome, counting the bases
+    # that aren't in the bedGraph as 0, or leaving them out if covered_only is True (nan if
+    # no bases are covered)
+    def mean(self, chromosome, starts, ends, covered_only=False):
+        total = self.sum(chromosome, starts, ends)
+        if not covered_only:
+            length = numpy.asarray(ends, dtype=numpy.float64)-numpy.asarray(starts, dtype=numpy.float64)
+        elif not chromosome in self.tracks: length = numpy.zeros(numpy.shape(starts))
+        else: length = (self.cumulative(chromosome, ends, True)-self.cumulative(chromosome, starts, True)).astype(numpy.float64)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return numpy.where(length > 0, total/numpy.where(length > 0, length, 1), numpy.nan)
+
+    # Get the highest value of the entries overlapping [start, end) on a chromosome, or nan
+    # if there aren't any
+    def max(self, chromosome, start, end):
+        if not chromosome in self.tracks: return numpy.nan
+        starts, ends, values = self.tracks[chromosome][0:3]
+        first = numpy.searchsorted(ends, start, side="right")
+        last = numpy.searchsorted(starts, end, side="left")
+        return values[first:last].max() if last > first else numpy.nan
+
+    # Save the track to an array store (see saveArrayStore)
+    def save(self, filename):
+        arrays = dict()
+        for chromosome, track in self.tracks.items():
+            for name, a in zip([ "starts", "ends", "values", "signal", "covered" ], track):
+                arrays[chromosome+"\t"+name] = a
+        saveArrayStore(filename, arrays, { "type":"bedgraph", "chromosomes":sorted(self.tracks.keys()) })
+
+# The LineReader class gives the line-reading methods of a file to anything with a
+# read(size) method, like a zstd stream
+class LineReader:
+
+    # Instance variables
+    # source is the object being read
+    # buffer holds data that has been read but not returned yet
+
+    def __init__(self, source, block_size=1<<20):
+        self.source, self.block_size, self.buffer = source, block_size, ""
+
+    # Return the next line, or "" at the end
+    def readline(self):
+        i = self.buffer.find("\n")
+        while i < 0:
+            data = self.source.read(self.block_size)
+            if not data:
+                ret, self.buffer = self.buffer, ""
+                return ret
+            searched = len(self.buffer)
+            self.buffer += data
+            i = self.buffer.find("\n", searched)
+        ret, self.buffer = self.buffer[:i+1], self.buffer[i+1:]
+        return ret
+
+    # Return lines totalling about hint bytes (or all of them)
+    def readlines(self, hint=-1):
+        ret, size = list(), 0
+        while hint < 0 or size < hint:
+            line = self.readline()
+            if line == "": break
+            ret.append(line); size += len(line)
+        return ret
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            data = self.source.read(self.block_size)
+            if not data: break
+            self.buffer += data
+        if size < 0: size = len(self.buffer)
+        ret, self.buffer = self.buffer[:size], self.buffer[size:]
+        return ret
+
+    def __iter__(self):
+        line = self.readline()
+        while line != "":
+            yield line
+            line = self.readline()
+
+    def close(self):
+        try: self.source.close()
+        except AttributeError, e: pass
+
+# The BgzfReader class reads a bgzip-compressed file by virtual offset, the way tabix and
+# CSI indexes point into them: the offset of a BGZF block in the file shifted up 16 bits,
+# plus an offset in that block's uncompressed data
+class BgzfReader:
+
+    # Instance variables
+    # handle is the compressed file
+    # block_start is the file offset of the current block, and block_next of the one after
+    # data is the uncompressed current block, and position is where we are in it
+
+    def __init__(self, filename):
+        self.handle = open(filename, 'rb')
+        self.block_start, self.block_next, self.data, self.position = 0, 0, "", 0
+        self.loadBlock(0)
+
+    # Read and decompress the block starting at a file offset
+    def loadBlock(self, offset):
+        self.handle.seek(offset)
+        header = self.handle.read(18)
+        self.block_start, self.data, self.position = offset, "", 0
+        if len(header) < 18:
+            self.block_next = offset
+            return
+        if header[0:4] != gzip_magic+"\x08\x04":
+            raise ValueError("Not a BGZF block at offset "+str(offset))
+        extra_length = struct.unpack("<H", header[10:12])[0]
+        extra = header[12:18]+self.handle.read(extra_length-6)
+        block_size, i = None, 0
+        while i < extra_length:
+            slen = struct.unpack("<H", extra[i+2:i+4])[0]
+            if extra[i:i+2] == "BC": block_size = struct.unpack("<H", extra[i+4:i+6])[0]+1
+            i += 4+slen
+        if block_size is None:
+            raise ValueError("Not a BGZF block at offset "+str(offset))
+        compressed = self.handle.read(block_size-12-extra_length-8)
+        self.data = zlib.decompress(compressed, -15)
+        self.block_next = offset+block_size
+
+    # Go to a virtual offset
+    def seek(self, virtual_offset):
+        offset, position = virtual_offset >> 16, virtual_offset & 0xFFFF
+        if offset != self.block_start or not self.data: self.loadBlock(offset)
+        self.position = position
+
+    # Get the virtual offset of the next byte to be read
+    def tell(self):
+        if self.position >= len(self.data) and self.block_next != self.block_start:
+            self.loadBlock(self.block_next)
+        return (self.block_start << 16) | self.position
+
+    # Return the next line, or "" at the end of the file
+    def readline(self):
+        pieces = list()
+        while True:
+            if self.position >= len(self.data):
+                if self.block_next == self.block_start: break
+                self.loadBlock(self.block_next)
+                continue
+            i = self.data.find("\n", self.position)
+            if i >= 0:
+                pieces.append(self.data[self.position:i+1])
+                self.position = i+1
+                break
+            pieces.append(self.data[self.position:])
+            self.position = len(self.data)
+        return "".join(pieces)
+
+    def close(self): self.handle.close()
+
+# The RegionIndex class reads a tabix (.tbi) or CSI (.csi) index of a bgzip-compressed file,
+# and finds the parts of the file that can hold records in a region
+class RegionIndex:
+
+    # Instance variables
+    # min_shift and depth describe the binning scheme (14 and 5 for tabix)
+    # col_seq, col_beg and col_end are the 0-based columns of the chromosome, start and end
+    # zero_based is True for BED-like files, which use 0-based, half-open coordinates
+    # meta is the character that starts header lines
+    # bins is a dictionary CHROMOSOME->{ BIN:[ (CHUNK_START, CHUNK_END), ... ] }
+    # linear is a dictionary CHROMOSOME->[ smallest virtual offset in each 16kb window ]
+
+    def __init__(self, filename):
+        index = gzip.open(filename, 'rb'); data = index.read(); index.close()
+        self.bins, self.linear = dict(), dict()
+        if data[0:4] == "TBI\x01":
+            self.min_shift, self.depth = 14, 5
+            n_ref = struct.unpack("<i", data[4:8])[0]
+            i = self.readHeader(data, 8)
+        elif data[0:4] == "CSI\x01":
+            self.min_shift, self.depth, l_aux = struct.unpack("<iii", data[4:16])
+            # without the tabix header in its aux data, a CSI has no sequence names, so we
+            # couldn't tell which chromosome is which
+            if l_aux < 28: raise ValueError(filename+" has no sequence names")
+            self.readHeader(data, 16)
+            i = 16+l_aux
+            n_ref = struct.unpack("<i", data[i:i+4])[0]; i += 4
+        else: raise ValueError(filename+" is not a tabix or CSI index")
+        if len(self.names) < n_ref: raise ValueError(filename+" has no sequence names")
+        for ref in range(n_ref):
+            name = self.names[ref]
+            n_bin = struct.unpack("<i", data[i:i+4])[0]; i += 4
+            bins = dict()
+            for b in range(n_bin):
+                bin = struct.unpack("<I", data[i:i+4])[0]; i += 4
+                if data[0:4] == "CSI\x01": i += 8 # skip the bin's loffset
+                n_chunk = struct.unpack("<i", data[i:i+4])[0]; i += 4
+                bins[bin] = [ struct.unpack("<QQ", data[i+16*c:i+16*c+16]) for c in range(n_chunk) ]
+                i += 16*n_chunk
+            self.bins[name] = bins
+            if data[0:4] == "TBI\x01":
+                n_intv = struct.unpack("<i", data[i:i+4])[0]; i += 4
+                self.linear[name] = struct.unpack("<"+str(n_intv)+"Q", data[i:i+8*n_intv])
+                i += 8*n_intv
+
+    # Read the tabix header fields (also found in the aux data of a CSI made by tabix),
+    # returning the offset after them
+    def readHeader(self, data, i):
+        fmt, col_seq, col_beg, col_end, meta, skip, l_nm = struct.unpack("<7i", data[i:i+28])
+        self.col_seq, self.col_beg, self.col_end = col_seq-1, col_beg-1, col_end-1
+        self.zero_based, self.meta = bool(fmt & 0x10000), chr(meta)
+        self.names = data[i+28:i+28+l_nm].split("\0")[:-1]
+        return i+28+l_nm
+
+    # Get the bins that can hold a record overlapping [start, end)
+    def regionBins(self, start, end):
+        ret, s, t = list(), self.min_shift+self.depth*3, 0
+        end = min(end, 1 << s)-1
+        for level in range(self.depth+1):
+            ret.extend(range(t+(start >> s), t+(end >> s)+1))
+            t += 1 << (level*3); s -= 3
+        return ret
+
+    # Get the sorted, merged (start, end) virtual offset ranges that can hold records on a
+    # chromosome overlapping [start, end)
+    def chunks(self, chromosome, start, end):
+        if not chromosome in self.bins or start >= end: return list()
+        bins, linear = self.bins[chromosome], self.linear.get(chromosome, ())
+        min_offset = linear[min(start >> 14, len(linear)-1)] if linear else 0
+        ret = sorted(c for b in self.regionBins(start, end) for c in bins.get(b, [])
+                     if c[1] > min_offset)
+        merged = list()
+        for chunk_start, chunk_end in ret:
+            if merged and chunk_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], chunk_end))
+            else: merged.append((chunk_start, chunk_end))
+        return merged
+
+# The FastaFile class reads pieces of an uncompressed FASTA file through a samtools-style
+# .fai index (built next to the file the first time if there isn't a current one) and a
+# memory map of the file, so only the bases asked for are ever copied into strings
+class FastaFile:
+
+    # Instance variables
+    # names is the list of sequence names (the first word of each header), in file order
+    # index is a dictionary NAME->(LENGTH, OFFSET, LINE_BASES, LINE_WIDTH), as in a .fai file
+    # data is the memory map of the file
+
+    def __init__(self, filename):
+        if isCompressed(filename):
+            raise ValueError("Can't memory-map the compressed FASTA file "+filename)
+        self.filename, self.names, self.index = filename, list(), dict()
+        index_f = filename+".fai"
+        if os.path.exists(index_f) and os.path.getmtime(index_f) >= os.path.getmtime(filename):
+            f = open(index_f); lines = f.readlines(); f.close()
+        else:
+            lines = self.buildIndex()
+            try:
+                f = open(index_f, 'w'); f.writelines(lines); f.close()
+            except (IOError, OSError), e: pass
+        for line in lines:
+            t = line[:-1].split("\t")
+            self.names.append(t[0])
+            self.index[t[0]] = tuple(int(x) for x in t[1:5])
+        self.handle = open(filename, 'rb')
+        self.data = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(filename) else ""
+
+    # Scan the FASTA file for the lines of its .fai index. Every line of a sequence but the
+    # last must have the same length, or the offsets of its bases couldn't be computed
+    def buildIndex(self):
+        records, offset, record, last_line = list(), 0, None, False
+        f = open(self.filename, 'rb')
+        for line in f:
+            if line[0] == ">":
+                record, last_line = [ (line[1:].split() or [""])[0], 0, offset+len(line), 0, 0 ], False
+                records.append(record)
+            elif record is not None:
+                bases = len(line.rstrip("\r\n"))
+                if bases and last_line:
+                    raise ValueError("Lines of different lengths in "+record[0]+" of "+self.filename)
+                if not record[3]: record[3], record[4] = bases, len(line)
+                elif bases != record[3] or len(line) != record[4]: last_line = True
+                record[1] += bases
+            offset += len(line)
+        f.close()
+        return [ "\t".join(str(x) for x in r)+"\n" for r in records ]
+
+    def __contains__(self, name): return name in self.index
+
+    # Get the length of a sequence
+    def length(self, name): return self.index[name][0]
+
+    # Get the full header line of a sequence, without the ">"
+    def header(self, name):
+        offset = self.index[name][1]
+        start = self.data.rfind(">", 0, offset)
+        return self.data[start+1:offset].rstrip("\r\n")
+
+    # Get the bases of a sequence in [start, end) (0-based, half-open, like BED). The range is
+    # clipped to the sequence, and the end of the sequence is used if end is None
+    def fetch(self, name, start=0, end=None):
+        length, offset, line_bases, line_width = self.index[name]
+        start, end = max(start, 0), length if end is None else min(end, length)
+        if start >= end: return ""
+        first = offset+(start/line_bases)*line_width+start%line_bases
+        last = offset+((end-1)/line_bases)*line_width+(end-1)%line_bases+1
+        piece = self.data[first:last]
+        if line_width > line_bases: piece = piece.replace("\r", "").replace("\n", "")
+        return piece
+
+    def close(self):
+        if hasattr(self.data, "close"): self.data.close()
+        self.handle.close()
+
+# Raised by checkSortedLoci when a BED file isn't sorted by chromosome and start
+class UnsortedBedError(ValueError): pass
+
+# ------------------------------------------------------------------------------
+# FUNCTIONS
+# Convert a FASTA file downloaded from UCSC GB to one PWMSCAN can parse. The sequences are
+# copied from the memory-mapped file in pieces rather than loaded whole
+def convertFasta(filename, chunk_size=1<<22):
+    fasta = FastaFile(filename)
+    f = open(filename[0:-3]+".converted.fa", 'w')
+    for header, name in sorted((fasta.header(n), n) for n in fasta.names):
+        f.write(">"+header.split(" ")[1]+"\n")
+        for start in xrange(0, fasta.length(name), chunk_size):
+            f.write(fasta.fetch(name, start, start+chunk_size))
+        f.write("\n")
+    f.close()
+    fasta.close()
+
+# Get a FASTA object (dictionary HEADER->SEQUENCE) from a FASTA file. This holds every
+# sequence in memory; use a FastaFile to read pieces of a large one
+def getFasta(filename):
+    ret, header, pieces = dict(), None, list()
+    f = openFile(filename)
+    for line in f:
+        if line[0] == ">":
+            if header is not None: ret[header] = "".join(pieces)
+            header, pieces = line[1:-1], list()
+        else: pieces.append(line[0:-1])
+    if header is not None: ret[header] = "".join(pieces)
+    f.close()
+    return ret
+
+# Turn a GFF file generated by PWMSCAN into a BED file
+def gffToBed(filename):
+    gff = dict()
+    f = open(filename); line = f.readline()
+    while line != "":
+        t = line[0:-1].split("\t")
+        chromosome = t[0].split("=")[1].split(":")[0]
+        start = int(t[0].split("=")[1].split(":")[1].split("-")[0])
+        stop = start+int(t[4])
+        start += int(t[3])
+        try: gff[chromosome].append((start,stop))
+        except Exception, e: gff[chromosome] = [ (start,stop) ]
+        line = f.readline()
+    f.close()
+    f = open(filename[0:-3]+"bed", 'w')
+    for chromosome in gff.keys():
+        for record in gff[chromosome]:
+            f.write(chromosome+"\t"+str(record[0])+"\t"+str(record[1])+"\n")
+    f.close()
+
+# Rewrite bowtie output as a BED file
+def bowtieToBed(filename, name="ChIPseq", description="ChIPseq Raw Reads",
+                color="10,10,10"):
+    f = open(filename); line = f.readline()
+    g = open(filename[0:-3]+"bed", 'w')
+    #g.write("track name=\""+name+"\" description=\""+
+    #        description+"\" color="+color+" visibility=full\n")
+    while line != "":
+        t = line[0:-1].split("\t")
+        g.write(t[2]+"\t"+t[3]+"\t"+str(int(t[3])+len(t[4]))+"\t"+t[0]+
+                "\t0\t"+t[1]+"\n")
+        line = f.readline()
+    f.close()
+    g.close()
+
+# Parse the score column of a BED line. "." and anything else that isn't a number (some
+# files put text there) count as 0, like a missing score
+def parseScore(score):
+    try: return float(score)
+    except ValueError, e: return 0.0
+
+# Read the columns of a BED file in chunks of about chunk_size bytes, without building a
+# record for each line. The header (any leading track, browser or # lines) and delimiter
+# are sniffed from the same open file. Each chunk is a dictionary of
+#   header - the header lines
+#   chromosomes - the chromosome names seen so far (the same list for every chunk)
+#   chrom - array of indices into chromosomes
+#   start, end - arrays of coordinates
+#   strand - array of strand characters ("." if missing)
+#   columns - array of the number of fields on each line (up to 255)
+#   score - array of scores (0 if missing or not a number, like ".")
+#   name - list of names ("." if missing), if names is True
+#   lines - list of the lines themselves, if lines is True
+def iterBedColumns(filename, names=False, lines=False, chunk_size=1<<22):
+    f = openFile(filename)
+    header, line = list(), f.readline()
+    while line[0:5] in [ "track", "brows" ] or line[0:1] == "#":
+        header.append(line)
+        line = f.readline()
+    delimiter = "\t" if line.count("\t") > 0 else None
+    codes, chromosomes = dict(), list()
+    block = [ line ] if line else list()
+    while True:
+        block += f.readlines(chunk_size)
+        if not block: break
+        chunk = { "header":header, "chromosomes":chromosomes, "chrom":array('l'),
+                  "start":array('l'), "end":array('l'), "strand":array('c'),
+                  "columns":array('B'), "score":array('d') }
+        if names: chunk["name"] = list()
+        if lines: chunk["lines"] = list()
+        for line in block:
+            t = line.rstrip("\r\n").split(delimiter)
+            if len(t) < 3: continue
+            try: code = codes[t[0]]
+            except KeyError, e:
+                code = codes[t[0]] = len(chromosomes)
+                chromosomes.append(t[0])
+            chunk["chrom"].append(code)
+            chunk["start"].append(int(t[1]))
+            chunk["end"].append(int(t[2]))
+            chunk["strand"].append(t[5][0:1] or "." if len(t) > 5 else ".")
+            chunk["columns"].append(min(len(t), 255))
+            chunk["score"].append(parseScore(t[4]) if len(t) > 4 else 0.0)
+            if names: chunk["name"].append(t[3] if len(t) > 3 else ".")
+            if lines: chunk["lines"].append(line)
+        yield chunk
+        block = list()
+    f.close()
+
+# Load all the columns of a BED file at once (see iterBedColumns)
+def loadBedColumns(filename, names=False, lines=False):
+    ret = None
+    for chunk in iterBedColumns(filename, names, lines):
+        if ret is None: ret = chunk
+        else:
+            for k in chunk.keys():
+                if not k in [ "header", "chromosomes" ]: ret[k].extend(chunk[k])
+    if ret is None:
+        ret = { "header":list(), "chromosomes":list(), "chrom":array('l'),
+                "start":array('l'), "end":array('l'), "strand":array('c'),
+                "columns":array('B'), "score":array('d') }
+        if names: ret["name"] = list()
+        if lines: ret["lines"] = list()
+    return ret
+
+# Get global statistics on a chIPseq file
+def getGlobalStatistics(filename, genome_size):
+    count, average = 0.0, 0.0
+    for chunk in iterBedColumns(filename):
+        count += len(chunk["start"])
+        average += sum(chunk["end"])-sum(chunk["start"])
+    average /= count
+    return { "Count":count,
+             "Average Tag Size":average,
+             "RPKM Coefficient":(1000*1000000)/(average*count),
+             "Coverage":count*average/genome_size }
+
+# Clean a BED file for preprocessing by BEDtools, etc
+def cleanBed(filename):
+    br = BedReader(filename); g = open(filename[0:-3]+"clean.bed", 'w')
+    while br.hasMoreData(): g.write(br.getRecordString(br.read()))
+    br.close(); g.close()
+
+# Get overlaps between two BED files. See iterOverlaps for the modes
+def getOverlaps(bedfile_a, bedfile_b, mode="records", min_fraction=0.0):
+    return list(iterOverlaps(bedfile_a, bedfile_b, mode, min_fraction))
+
+# Stream the overlaps between two BED files with a sort-merge join: each chromosome's
+# records are sorted by start, and the records of b that have started are kept in a heap
+# by end, so the ones that ended before the current record of a are dropped. Like
+# areOverlapping, records that only touch overlap. The modes are:
+#   records - each distinct record of a that overlaps b, sorted
+#   pairs   - (record of a, record of b) for every overlapping pair
+#   counts  - (record of a, number of overlapping records of b) for every record of a
+# With min_fraction, an overlap must cover at least that fraction of the record of a
+def iterOverlaps(bedfile_a, bedfile_b, mode="records", min_fraction=0.0):
+    if not mode in [ "records", "pairs", "counts" ]:
+        raise ValueError("Unknown overlap mode "+mode)
+    primary_loci = loadLocusDictionary(bedfile_a)
+    secondary_loci = loadLocusDictionary(bedfile_b)
+    for chromosome in sorted(primary_loci.keys()):
+        secondaries = sorted(secondary_loci.get(chromosome, []), key=lambda r: r[1])
+        active, j, previous = list(), 0, None
+        for primary in sorted(tuple(r) for r in primary_loci[chromosome]):
+            while j < len(secondaries) and secondaries[j][1] <= primary[2]:
+                heapq.heappush(active, (secondaries[j][2], j)); j += 1
+            while active and active[0][0] < primary[1]: heapq.heappop(active)
+            min_overlap = min_fraction*(primary[2]-primary[1])
+            hits = sorted(k for end, k in active if secondaries[k][1] <= primary[2] and
+                          min(end, primary[2])-max(secondaries[k][1], primary[1]) >= min_overlap)
+            if mode == "counts": yield (primary, len(hits))
+            elif mode == "pairs":
+                for k in hits: yield (primary, tuple(secondaries[k]))
+            elif hits and primary != previous:
+                yield primary
+                previous = primary
+
+# Determine whether two loci (BED records) are overlapping
+def areOverlapping(a, b, symmetric_overlap=False):
+    if a[1] >= b[1] and a[1] <= b[2]: return True
+    if a[2] >= b[1] and a[2] <= b[2]: return True
+    if b[1] >= a[1] and b[1] <= a[2]: return True
+    if b[2] >= a[1] and b[2] <= a[2]: return True
+    return False
+
+# Load a locus dictionary of the form CHROMOSOME->[ RECORD_1, ..., RECORD_N ], where each
+# record is [ chromosome, start, stop, name, score, strand ]
+def loadLocusDictionary(filename):
+    ret = dict()
+    for chunk in iterBedColumns(filename, names=True):
+        chromosomes = chunk["chromosomes"]
+        for code, start, end, name, score, strand in zip(chunk["chrom"], chunk["start"],
+                                                          chunk["end"], chunk["name"],
+                                                          chunk["score"], chunk["strand"]):
+            record = [ chromosomes[code], start, end, name, score, strand ]
+            try: ret[record[0]].append(record)
+            except Exception, e: ret[record[0]] = [ record ]
+    return ret
+
+# Count the number of entries in a locus dictionary
+def countLocusDictionary(ldict):
+    ret = 0
+    for chromosome in ldict.keys(): ret += len(ldict[chromosome])
+    return ret
+
+# Load an empty bin dictionary from a BED file
+def loadEmptyBinDictionary(filename, bin_size):
+    br = BedReader(filename)
+    ret = dict()
+    while br.hasMoreData():
+        record = br.read()
+        i = int(record[1]/bin_size)*bin_size
+        while i < int(record[2]/bin_size)*bin_size:
+            try: ret[record[0]][i] = 0
+            except Exception, e: ret[record[0]] = { i:0 }
+            i += bin_size
+    br.close()
+    return ret
+
+# Add reads from a BED file to a bin dictionary
+def loadBinDictionary(filename, bins, bin_size):
+    br = BedReader(filename)
+    while br.hasMoreData():
+        record = br.read()
+        if len(record) > 5: start = record[1] if record[5] == "+" else record[2]
+        else: start = record[1]
+        try: bins[record[0]][int(start/bin_size)*bin_size] += 1
+        except Exception, e: pass
+    br.close()
+
+# Normalize a bin dictionary by its RPKM
+def normalizeBinDictionary(bins, rpkm):
+    for chromosome in bins.keys():
+        for bin in bins[chromosome].keys():
+            bins[chromosome][bin] *= rpkm
+
+# Subtract one bin dictionary from another
+def subtractBinDictionaries(bins, background):
+    for chromosome in background.keys():
+        if not chromosome in bins.keys(): continue
+        for bin in background[chromosome].keys():
+            try: bins[chromosome][bin] -= background[chromosome][bin]
+            except Exception, e:
+                bins[chromosome][bin] = -1*background[chromosome][bin]
+
+# Load a BinTrack saved with BinTrack.save
+def loadBinTrack(filename):
+    requireNumpy("loadBinTrack")
+    npz = numpy.load(filename)
+    ret = BinTrack(dict(), int(npz["bin_size"][0]))
+    for name in npz.files:
+        if name[0:6] == "chrom_": ret.bins[name[6:]] = npz[name]
+    npz.close()
+    return ret
+
+# Load a BedGraphTrack saved with BedGraphTrack.save. The arrays are memory-mapped rather
+# than read
+def loadBedGraphTrack(filename):
+    arrays, meta = loadArrayStore(filename)
+    if meta.get("type") != "bedgraph": raise ValueError(filename+" is not a saved bedGraph track")
+    ret = BedGraphTrack()
+    for chromosome in meta["chromosomes"]:
+        chromosome = str(chromosome)
+        ret.tracks[chromosome] = tuple(arrays[chromosome+"\t"+name] for name in
+                                       [ "starts", "ends", "values", "signal", "covered" ])
+    return ret
+
+# Merge overlapping regions in a BED file and write another BED. Sorted input (each
+# chromosome in one block, sorted by start) is merged as it streams through, keeping the
+# chromosomes in the order of the input. If the input turns out to be unsorted, it is sorted
+# on disk in runs of run_size loci instead, and the chromosomes are written in sorted order
+def mergeBed(filename, run_size=1000000):
+    output = mergedName(filename)
+    # Write to a temporary file next to the output, so a failed merge leaves nothing behind
+    temp = output+".tmp"
+    f = open(temp, 'w')
+    try:
+        try: writeLoci(f, mergeSortedLoci(checkSortedLoci(readLoci(filename))))
+        except UnsortedBedError, e:
+            f.seek(0); f.truncate()
+            writeLoci(f, mergeSortedLoci(externalSortLoci(readLoci(filename), run_size)))
+        f.close()
+        os.rename(temp, output)
+    except:
+        f.close(); os.unlink(temp)
+        raise
+
+# Get the name of the file mergeBed writes for a BED file: x.bed (or x.bed.gz) -> x.merged.bed
+def mergedName(filename):
+    return re.sub(r"\.(gz|bgz|zst)$", "", filename)[:-3]+"merged.bed"
+
+# Merge each of several BED files with mergeBed, using a pool of jobs processes. Each
+# file gets its own process, even with one job, so the peak memory reported for it is its
+# own rather than the running peak of the files before it. Yields (filename, seconds, peak
+# memory in KB) as each merge finishes, and raises an exception naming the file if one of
+# them fails. The merges still running then are stopped, and their temporary outputs removed
+def mergeBedFiles(filenames, jobs=1):
+    pool = multiprocessing.Pool(max(jobs, 1), maxtasksperchild=1)
+    filenames = list(filenames); unfinished = set(filenames)
+    try:
+        for filename, seconds, maxrss, error in pool.imap_unordered(mergeBedJob, filenames):
+            unfinished.discard(filename)
+            if error: raise RuntimeError("merging "+filename+" failed: "+error)
+            yield filename, seconds, maxrss
+    finally:
+        pool.terminate(); pool.join()
+        for filename in unfinished:
+            try: os.unlink(mergedName(filename)+".tmp")
+            except OSError, e: pass
+
+# Run mergeBed on one file, returning (filename, seconds, peak memory in KB, error)
+def mergeBedJob(filename):
+    start, error = time.time(), None
+    try: mergeBed(filename)
+    except Exception, e: error = e.__class__.__name__+": "+str(e)
+    return (filename, time.time()-start,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, error)
+
+# Yield the (chromosome,start,stop) of each record in a BED file
+def readLoci(filename):
+    br = BedReader(filename)
+    while br.hasMoreData():
+        r = br.read()
+        yield (r[0],r[1],r[2])
+    br.close()
+
+# Write (chromosome,start,stop) loci to an open file as a three-column BED
+def writeLoci(f, loci):
+    for locus in loci:
+        f.write(locus[0]+"\t"+str(locus[1])+"\t"+str(locus[2])+"\n")
+
+# Pass loci through, raising UnsortedBedError as soon as a chromosome comes back after
+# another one or a start is lower than the one before it
+def checkSortedLoci(loci):
+    seen, previous = set(), None
+    for locus in loci:
+        if previous is None or locus[0] != previous[0]:
+            if locus[0] in seen:
+                raise UnsortedBedError(locus[0]+" is not in one block")
+            seen.add(locus[0])
+        elif locus[1] < previous[1]:
+            raise UnsortedBedError(locus[0]+" is not sorted by start")
+        previous = locus
+        yield locus
+
+# Merge an iterator of loci sorted by chromosome and start, yielding each merged region.
+# Like areOverlapping, loci that only touch are merged
+def mergeSortedLoci(loci):
+    previous = None
+    for locus in loci:
+        if previous is not None and locus[0] == previous[0] and locus[1] <= previous[2]:
+            if locus[2] > previous[2]: previous = (previous[0],previous[1],locus[2])
+        else:
+            if previous is not None: yield previous
+            previous = locus
+    if previous is not None: yield previous
+
+# Sort an iterator of loci without holding more than run_size of them in memory: sorted
+# runs are spilled to temporary files and then merged
+def externalSortLoci(loci, run_size=1000000):
+    runs, run = list(), list()
+    for locus in loci:
+        run.append(locus)
+        if len(run) >= run_size:
+            runs.append(spillLoci(sorted(run)))
+            run = list()
+    run.sort()
+    if not runs:
+        for locus in run: yield locus
+        return
+    runs.append(spillLoci(run))
+    try:
+        for locus in heapq.merge(*[readSpilledLoci(r) for r in runs]): yield locus
+    finally:
+        for r in runs: r.close()
+
+# Write a sorted run of loci to a temporary file (deleted when it is closed)
+def spillLoci(run):
+    f = tempfile.TemporaryFile()
+    writeLoci(f, run)
+    f.seek(0)
+    return f
+
+# Read back the loci written by spillLoci
+def readSpilledLoci(f):
+    for line in f:
+        t = line[:-1].split("\t")
+        yield (t[0],int(t[1]),int(t[2]))
+
+# Get a key that sorts chromosome names (or other strings) the way sort -V does: runs of
+# digits compare as numbers, letters come before other characters, and ~ before anything
+def versionSortKey(name):
+    key = list()
+    for text, digits in re.findall(r"(\D*)(\d*)", name):
+        key.append(tuple(ord(c) if c.isalpha() else (-1 if c == "~" else 256+ord(c)) for c in text)+(0,))
+        key.append(int(digits or 0))
+    return key
+
+# Get the set of chromosomes in a BED-like file
+def listChromosomes(filename):
+    if not isCompressed(filename): return set(loadChromOffsets(filename).keys())
+    ret = set()
+    f = openFile(filename)
+    for line in f:
+        if line.strip() and not line[0:5] in [ "track", "brows" ] and line[0] != "#":
+            ret.add(line.split("\t", 1)[0])
+    f.close()
+    return ret
+
+# Yield the parts of each (start, end, line) record that aren't covered by a sorted list of
+# disjoint (start, end) regions, as (start, end, line) records
+def subtractRegions(records, regions):
+    ends = [ e for s, e in regions ]
+    for start, end, line in records:
+        i = bisect_right(ends, start)
+        while i < len(regions) and regions[i][0] < end:
+            if regions[i][0] > start: yield (start, regions[i][0], line)
+            start = max(start, regions[i][1])
+            i += 1
+        if start < end: yield (start, end, line)
+
+# Add sorted (start, end, ...) records to a sorted list of disjoint (start, end) regions
+def unionRegions(regions, records):
+    ret = list()
+    for start, end in heapq.merge(regions, [ r[0:2] for r in records ]):
+        if ret and start <= ret[-1][1]:
+            if end > ret[-1][1]: ret[-1] = (ret[-1][0], end)
+        else: ret.append((start, end))
+    return ret
+
+# Split the loci of several BED files into exclusive partitions: the loci of each file that
+# aren't covered by any file before it. This gives the same result as complementing each
+# file with bedtools complement and intersecting the later files with each complement in
+# turn (so the later files only keep loci on the chromosomes in the size file, within their
+# sizes), but in one pass over each chromosome, which is read through loadChromOffsets or
+# an index. The first file is written as it is. Each output is sorted like sort -k1,1V -k2,2n
+def exclusivePartitions(filenames, out_filenames, size_file):
+    sizes = loadSizes(size_file)
+    chromosomes = set()
+    for filename in filenames: chromosomes |= listChromosomes(filename)
+    outs = [ open(f, 'w') for f in out_filenames ]
+    for chromosome in sorted(chromosomes, key=lambda c: (versionSortKey(c), c)):
+        claimed = list()
+        for level, filename in enumerate(filenames):
+            records = list()
+            for line in iterRegion(filename, chromosome):
+                t = line.rstrip("\r\n").split("\t", 3)
+                records.append((int(t[1]), int(t[2]), t[3] if len(t) > 3 else None, line))
+            records.sort()
+            if level == 0: pieces = [ (r[0], r[3]) for r in records ]
+            elif not chromosome in sizes: pieces = list()
+            else:
+                size = sizes[chromosome]
+                pieces = [ (start, chromosome+"\t"+str(start)+"\t"+str(end)+("\t"+rest if rest is not None else "")+"\n")
+                           for start, end, rest in subtractRegions([ (r[0], min(r[1], size), r[2]) for r in records ], claimed) ]
+            for start, line in sorted(pieces): outs[level].write(line)
+            claimed = unionRegions(claimed, records)
+    for f in outs: f.close()
+
+# Prune a BED file to remove all entries with out-of-bounds errors. The entries that are
+# kept are written exactly as they were
+def pruneBED(filename, size_file):
+    sizes = loadSizes(size_file)
+    f = open(filename[:-3]+"pruned.bed", 'w')
+    for chunk in iterBedColumns(filename, lines=True):
+        chromosomes = chunk["chromosomes"]
+        for code, start, end, line in zip(chunk["chrom"], chunk["start"], chunk["end"],
+                                          chunk["lines"]):
+            if start >= 0 and end <= sizes[chromosomes[code]]: f.write(line)
+    f.close()
+
+# Prune a BedGraph file to remove all entries with out-of-bounds errors
+def pruneBGR(filename, size_file):
+    sizes = loadSizes(size_file)
+    f = openFile(filename); line = f.readline()
+    g = open(filename[:-3]+"pruned.bgr", 'w')
+    while line != "":
+        if len(line) > 0 and not line[0] in [ "b", "t", "#" ]:
+            t = line[:-1].split("\t")
+            if int(t[1]) >= 0 and int(t[2]) <= sizes[t[0]]: g.write(line)
+        else: g.write(line)
+        line = f.readline()
+    f.close()
+    g.close()
+
+# Load a size file from UCSC Genome Browser
+def loadSizes(filename):
+    ret = dict()
+    f = openFile(filename); lines = f.readlines(); f.close()
+    for line in lines:
+        t = line[:-1].split("\t")
+        ret[t[0]] = int(t[1])
+    return ret
+
+# Load a dictionary of the form (chromosome,start,stop)->score from a bedGraph. This holds
+# a tuple per entry; a BedGraphTrack is much smaller and can be queried by range
+def loadBedGraph(filename):
+    ret = dict()
+    f = openFile(filename)
+    for line in f:
+        if line[0] in [ "t", "b", "#" ] or not line.strip(): continue
+        t = line.rstrip("\r\n").split("\t")
+        ret[(t[0],int(t[1]),int(t[2]))] = float(t[3])
+    f.close()
+    return ret
+
+# Check whether a file is gzip/bgzip or zstd compressed
+def isCompressed(filename):
+    f = open(filename, 'rb'); magic = f.read(4); f.close()
+    return magic[0:2] == gzip_magic or magic == zstd_magic
+
+# Open a plain, gzip/bgzip or zstd (if the zstandard module is installed) compressed file
+# for reading lines, going by the first bytes of the file rather than its name
+def openFile(filename):
+    f = open(filename, 'rb'); magic = f.read(4); f.close()
+    if magic[0:2] == gzip_magic: return gzip.open(filename, 'rb')
+    if magic == zstd_magic:
+        try: import zstandard
+        except ImportError, e:
+            raise ImportError("Reading the zstd file "+filename+" requires the zstandard module")
+        return LineReader(zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb')))
+    return open(filename)
+
+# Find the tabix or CSI index of a bgzip-compressed file, or None if there isn't one
+# Find a tabix or CSI index of a file that is at least as new as it, or None. A CSI without
+# the tabix header (like the ones bcftools makes) has no sequence names, so it's skipped and
+# the file is read through instead
+def findRegionIndex(filename):
+    for index in [ filename+".tbi", filename+".csi" ]:
+        if os.path.exists(index) and os.path.getmtime(index) >= os.path.getmtime(filename):
+            if index.endswith(".csi") and not hasSequenceNames(index): continue
+            return index
+    return None
+
+# Check whether a CSI index has the tabix header, which holds the sequence names
+def hasSequenceNames(filename):
+    f = gzip.open(filename, 'rb'); data = f.read(16); f.close()
+    return len(data) == 16 and data[0:4] == "CSI\x01" and struct.unpack("<i", data[12:16])[0] >= 28
+
+# Find the byte ranges of each chromosome's lines in a plain BED-like file, in one pass.
+# Returns a dictionary CHROMOSOME->[ (START, END), ... ]
+def scanChromOffsets(filename):
+    ret, chromosome, offset = dict(), None, 0
+    f = open(filename, 'rb')
+    for line in f:
+        if line.strip() and not line[0:5] in [ "track", "brows" ] and line[0] != "#":
+            t = line.split("\t", 1)[0].split(" ", 1)[0]
+            if t != chromosome:
+                chromosome = t
+                ret.setdefault(chromosome, list()).append([offset, offset])
+            ret[chromosome][-1][1] = offset+len(line)
+        offset += len(line)
+    f.close()
+    return dict((k, [ tuple(r) for r in v ]) for k, v in ret.items())
+
+# Get the byte ranges of each chromosome's lines in a plain BED-like file (see
+# scanChromOffsets). They're cached in FILENAME.chroms the first time, and the cache is
+# used until the file's size or modification time changes. If the cache can't be written,
+# the offsets are just returned
+def loadChromOffsets(filename):
+    cache, stamp = filename+".chroms", "%d\t%d" % (os.path.getsize(filename), int(os.path.getmtime(filename)))
+    if os.path.exists(cache):
+        f = open(cache); lines = f.readlines(); f.close()
+        if lines and lines[0] == chrom_offsets_magic+"\t"+stamp+"\n":
+            ret = dict()
+            for line in lines[1:]:
+                t = line[:-1].split("\t")
+                ret.setdefault(t[0], list()).append((int(t[1]), int(t[2])))
+            return ret
+    ret = scanChromOffsets(filename)
+    try:
+        f = open(cache+".tmp", 'w')
+        f.write(chrom_offsets_magic+"\t"+stamp+"\n")
+        for chromosome in sorted(ret.keys()):
+            for start, end in ret[chromosome]:
+                f.write(chromosome+"\t"+str(start)+"\t"+str(end)+"\n")
+        f.close()
+        os.rename(cache+".tmp", cache)
+    except (IOError, OSError), e: pass
+    return ret
+
+# Yield the lines of the records on a chromosome (overlapping [start, end) if those are
+# given) from a BED-like file. A bgzip-compressed file with a tabix or CSI index is read
+# from the parts the index points to, and a plain file from the parts its chromosome
+# offsets (loadChromOffsets) point to. Other compressed files are read through
+def iterRegion(filename, chromosome, start=0, end=None):
+    if end is None: end = 1 << 62
+    index_f = findRegionIndex(filename)
+    if index_f is None and not isCompressed(filename):
+        f = open(filename, 'rb')
+        for block_start, block_end in loadChromOffsets(filename).get(chromosome, []):
+            f.seek(block_start)
+            offset = block_start
+            while offset < block_end:
+                line = f.readline()
+                offset += len(line)
+                t = line.split("\t", 3)
+                if len(t) < 3: continue
+                if int(t[1]) < end and int(t[2]) > start: yield line
+        f.close()
+        return
+    if index_f is None:
+        f = openFile(filename)
+        for line in f:
+            t = line.split("\t", 3)
+            if t[0] != chromosome or len(t) < 3: continue
+            if int(t[1]) < end and int(t[2]) > start: yield line
+        f.close()
+        return
+    index = RegionIndex(index_f)
+    last = max(index.col_seq, index.col_beg, index.col_end)+1
+    # records can't be 0 bases in the index's coordinates, so 1-based ones end at their
+    # start when there's no end column
+    shift = 0 if index.zero_based else 1
+    reader = BgzfReader(filename)
+    for chunk_start, chunk_end in index.chunks(chromosome, start, end):
+        reader.seek(chunk_start)
+        while reader.tell() < chunk_end:
+            line = reader.readline()
+            if line == "": break
+            if line[0:1] == index.meta: continue
+            t = line.rstrip("\r\n").split("\t", last)
+            if t[index.col_seq] != chromosome: continue
+            record_start = int(t[index.col_beg])-shift
+            record_end = int(t[index.col_end]) if index.col_end != index.col_beg else record_start+1
+            if record_start < end and record_end > start: yield line
+    reader.close()
+
+# Parse a region like chr1:1,000-2,000 (1-based and inclusive, as for samtools and tabix)
+# or just chr1 into a (chromosome, start, end) locus with 0-based, half-open coordinates.
+# The end of a whole chromosome is None
+def parseRegion(region):
+    if not ":" in region: return (region, 0, None)
+    chromosome, span = region.rsplit(":", 1)
+    try:
+        start, end = span.replace(",", "").split("-")
+        start, end = int(start)-1, int(end)
+    except ValueError, e: raise ValueError("Can't parse the region "+region)
+    if start < 0 or end <= start: raise ValueError("Can't parse the region "+region)
+    return (chromosome, start, end)
+
+# Collect whole chromosomes, region strings (parseRegion) and the loci of a BED file into a
+# list of (CHROMOSOME, [ (START, END), ... ]) with each chromosome's regions sorted and
+# merged. Chromosomes are in the order they're first given in
+def collectRegions(chromosomes=(), regions=(), regions_bed=None):
+    loci = [ (c, 0, None) for c in chromosomes ]+[ parseRegion(r) for r in regions ]
+    if regions_bed:
+        bed = loadBedColumns(regions_bed)
+        loci += [ (bed["chromosomes"][c], s, e) for c, s, e in zip(bed["chrom"], bed["start"], bed["end"]) ]
+    order, by_chromosome = list(), dict()
+    for chromosome, start, end in loci:
+        if not chromosome in by_chromosome:
+            order.append(chromosome)
+            by_chromosome[chromosome] = list()
+        by_chromosome[chromosome].append((chromosome, start, 1 << 62 if end is None else end))
+    return [ (c, [ (s, e) for c2, s, e in mergeSortedLoci(sorted(by_chromosome[c])) ]) for c in order ]
+
+# Check whether [start, end) overlaps any of a sorted, merged list of (START, END) regions
+def overlapsRegions(regions, start, end):
+    i = bisect_right(regions, (start, 1 << 62))
+    if i > 0 and regions[i-1][1] > start: return True
+    return i < len(regions) and regions[i][0] < end
+
+# Make sure numpy is available before using one of the array-backed functions
+def requireNumpy(purpose):
+    if numpy is None: raise ImportError(purpose+" requires numpy")
+
+# Save a dictionary of NAME->numpy array, plus a dictionary of metadata that can be
+# written as JSON, to one binary file. Each array starts on an 8-byte boundary so
+# loadArrayStore can memory-map them all
+def saveArrayStore(filename, arrays, meta=None):
+    requireNumpy("saveArrayStore")
+    table, offset = dict(), 0
+    for name in sorted(arrays.keys()):
+        a = numpy.ascontiguousarray(arrays[name])
+        table[name] = (a.dtype.str, offset, len(a))
+        offset += (a.nbytes+7)//8*8
+    header = json.dumps({ "meta":meta or dict(), "arrays":table })
+    header += " "*((8-(len(array_store_magic)+8+len(header))%8)%8)
+    f = open(filename, 'wb')
+    f.write(array_store_magic+struct.pack("<Q", len(header))+header)
+    for name in sorted(arrays.keys()):
+        a = numpy.ascontiguousarray(arrays[name])
+        f.write(a.tostring()+"\0"*((8-a.nbytes%8)%8))
+    f.close()
+
+# Memory-map a file written by saveArrayStore, returning (NAME->array, metadata)
+def loadArrayStore(filename):
+    requireNumpy("loadArrayStore")
+    f = open(filename, 'rb')
+    if f.read(len(array_store_magic)) != array_store_magic:
+        f.close()
+        raise ValueError(filename+" is not an array store")
+    header = json.loads(f.read(struct.unpack("<Q", f.read(8))[0]))
+    data_start = f.tell(); f.close()
+    raw = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+    arrays = dict()
+    for name, (dtype, offset, length) in header["arrays"].items():
+        dtype = numpy.dtype(str(dtype))
+        start = data_start+offset
+        arrays[str(name)] = raw[start:start+length*dtype.itemsize].view(dtype)
+    return arrays, header["meta"]
+
+# ------------------------------------------------------------------------------
+# The following code is executed upon command-line invocation
+if __name__ == "__main__": main(sys.argv)
+
+# ------------------------------------------------------------------------------
+# EOF
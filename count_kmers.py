@@ -0,0 +1,242 @@
+"""
+count_kmers.py
+
+Counts the canonical k-mers (each k-mer and its reverse complement counted together, under
+whichever comes first alphabetically, like jellyfish count -C) in the entries of a .bed file,
+reading their sequences straight from a genome FASTA file. Without a .bed file, every sequence
+of the FASTA file is counted instead. K-mers containing anything but A, C, G or T (in either
+case) are skipped, and no k-mer spans two entries. The output has one line per k-mer that was
+seen, with the k-mer and its count separated by a tab and sorted by k-mer, like jellyfish dump
+-c -t (which writes them in hash order instead).
+
+The FASTA file is memory-mapped through chipseq.FastaFile, and the sequences are read in
+chunks. Each chunk is encoded as 2 bits per base in a numpy array, and the k-mers of the whole
+chunk are computed with k shifted additions. For k <= 12 they're counted with bincount into an
+array of all 4^k k-mers, and for larger k (up to 31) by sorting them. With --workers, the
+chunks are counted in a pool of processes.
+
+Requires Python >= 2.7 and numpy
+"""
+
+import argparse, sys, multiprocessing
+import chipseq
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+## the largest k counted with bincount, and the largest that fits in 64 bits
+MAX_DENSE_K = 12
+MAX_K = 31
+
+## the 2-bit code of each byte, with 4 for anything that isn't a base
+BASE_CODES = [4] * 256
+for i, bases in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+    for base in bases:
+        BASE_CODES[ord(base)] = i
+
+# define a convenience dictionary to make subsetting clearer
+bed_coords = {"chrom": 0, "start": 1, "end": 2}
+
+def encode_sequences(seqs):
+    """
+    encodes a list of sequences as one array of 2-bit base codes. the sequences are joined
+    with a code of 4 between them, so that no valid k-mer spans two of them
+    """
+    table = numpy.array(BASE_CODES, dtype=numpy.uint8)
+    return table[numpy.frombuffer('N'.join(seqs), dtype=numpy.uint8)]
+
+def canonical_kmers(codes, k):
+    """
+    computes the canonical value of every k-mer in an array of base codes that doesn't contain
+    a code of 4. the value of a k-mer is its bases read as a base 4 number, so the canonical
+    value is the smaller of the values of the k-mer and of its reverse complement
+    """
+    num_kmers = len(codes) - k + 1
+    if num_kmers <= 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    invalid = numpy.concatenate(([0], numpy.cumsum(codes == 4)))
+    valid = (invalid[k:] - invalid[:num_kmers]) == 0
+    bases = numpy.where(codes == 4, 0, codes).astype(numpy.int64)
+    forward = numpy.zeros(num_kmers, dtype=numpy.int64)
+    reverse = numpy.zeros(num_kmers, dtype=numpy.int64)
+    for i in range(k):
+        window = bases[i:i+num_kmers]
+        forward = (forward << 2) | window
+        reverse |= (3 - window) << (2 * i)
+    return numpy.minimum(forward, reverse)[valid]
+
+def count_codes(codes, k):
+    """
+    counts the canonical k-mers of an array of base codes. returns the sorted k-mer values that
+    were seen and their counts. a chunk with far fewer k-mers than there are possible ones is
+    sorted rather than counted into an array of all of them
+    """
+    kmers = canonical_kmers(codes, k)
+    if k <= MAX_DENSE_K and len(kmers) * 16 >= 4**k:
+        counts = numpy.bincount(kmers, minlength=4**k)
+        keys = numpy.flatnonzero(counts)
+        return keys, counts[keys]
+    return numpy.unique(kmers, return_counts=True)
+
+def merge_counts(keys_list, counts_list):
+    """
+    adds up several sets of sorted k-mer values and counts into one
+    """
+    keys = numpy.concatenate(keys_list)
+    counts = numpy.concatenate(counts_list)
+    order = numpy.argsort(keys, kind='mergesort')
+    keys, counts = keys[order], counts[order]
+    if not len(keys):
+        return keys, counts
+    starts = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], numpy.add.reduceat(counts, starts)
+
+def decode_kmers(keys, k):
+    """
+    turns an array of k-mer values back into a list of k-mer strings
+    """
+    letters = numpy.frombuffer('ACGT', dtype=numpy.uint8)
+    chars = numpy.empty((len(keys), k), dtype=numpy.uint8)
+    for i in range(k):
+        chars[:, i] = letters[(keys >> (2 * (k - 1 - i))) & 3]
+    return chars.view('S%d' % k).ravel().tolist() if k else []
+
+## the FASTA file of each worker process, opened when the pool starts
+worker_fasta = None
+def init_worker(fasta_f):
+    global worker_fasta
+    worker_fasta = chipseq.FastaFile(fasta_f)
+
+def count_job(job):
+    """
+    counts the k-mers of a list of (chromosome, start, end) segments in a worker process
+    """
+    segments, k = job
+    seqs = [worker_fasta.fetch(chrom, start, end) for chrom, start, end in segments]
+    return count_codes(encode_sequences(seqs), k)
+
+def fasta_segments(fasta):
+    """
+    yields a (chromosome, start, end) segment for every sequence of the FASTA file
+    """
+    for name in fasta.names:
+        yield name, 0, fasta.length(name)
+
+def bed_segments(fasta, bed_lines):
+    """
+    yields the (chromosome, start, end) segment of every entry of a .bed file, clipped to its
+    chromosome. entries on chromosomes that aren't in the FASTA file are skipped with a warning
+    """
+    missing = set()
+    for line in bed_lines:
+        if not line.strip() or line.startswith('#') or line.startswith('track') or line.startswith('browser'):
+            continue
+        data = line.split('\t', 3)
+        chrom = data[bed_coords['chrom']]
+        if chrom not in fasta:
+            if chrom not in missing:
+                sys.stderr.write('WARNING. chromosome (%s) was not found in the FASTA file. Skipping.\n' % chrom)
+                missing.add(chrom)
+            continue
+        yield chrom, int(data[bed_coords['start']]), min(int(data[bed_coords['end']]), fasta.length(chrom))
+
+def count_jobs(segments, k, chunk_bases):
+    """
+    groups the segments into jobs of about chunk_bases bases. segments longer than that (like
+    whole chromosomes) are split into pieces that overlap by k-1 bases, so that every k-mer is
+    in exactly one piece
+    """
+    job = []
+    job_bases = 0
+    for chrom, start, end in segments:
+        while end - start > chunk_bases:
+            yield [(chrom, start, start + chunk_bases)], k
+            start += chunk_bases - k + 1
+        if end - start < k:
+            continue
+        job.append((chrom, start, end))
+        job_bases += end - start
+        if job_bases >= chunk_bases:
+            yield job, k
+            job = []
+            job_bases = 0
+    if job:
+        yield job, k
+
+def count_kmers(fasta_f, k, bed_lines=None, workers=1, chunk_bases=1<<24):
+    """
+    the main function: counts the canonical k-mers in the entries of a .bed file (given as an
+    iterable of lines), or in every sequence of the FASTA file if there are none. returns the
+    sorted k-mer values and their counts. with workers more than 1, the chunks are counted in
+    a pool of processes, which gives the same counts
+    """
+    if not 0 < k <= MAX_K:
+        raise ValueError("k must be between 1 and %d" % MAX_K)
+    chunk_bases = max(chunk_bases, 2 * k)
+    fasta = chipseq.FastaFile(fasta_f)
+    segments = fasta_segments(fasta) if bed_lines is None else bed_segments(fasta, bed_lines)
+    jobs = count_jobs(segments, k, chunk_bases)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, init_worker, (fasta_f,))
+        results = pool.imap(count_job, jobs)
+    else:
+        pool = None
+        init_worker(fasta_f)
+        results = (count_job(job) for job in jobs)
+
+    ## small k-mers are added up in an array of every k-mer, and larger ones are merged in
+    ## batches so that we don't hold the counts of every chunk at once
+    dense = numpy.zeros(4**k, dtype=numpy.int64) if k <= MAX_DENSE_K else None
+    keys_list, counts_list, pending = [], [], 0
+    try:
+        for keys, counts in results:
+            if dense is not None:
+                dense[keys] += counts
+                continue
+            keys_list.append(keys)
+            counts_list.append(counts)
+            pending += len(keys)
+            if pending >= chunk_bases:
+                keys, counts = merge_counts(keys_list, counts_list)
+                keys_list, counts_list, pending = [keys], [counts], len(keys)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    fasta.close()
+    if dense is not None:
+        keys = numpy.flatnonzero(dense)
+        return keys, dense[keys]
+    if not keys_list:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+    return merge_counts(keys_list, counts_list)
+
+def write_counts(keys, counts, k, out):
+    """
+    writes each k-mer and its count, tab-separated
+    """
+    for start in xrange(0, len(keys), 1<<20):
+        kmers = decode_kmers(keys[start:start+(1<<20)], k)
+        out.write(''.join(['%s\t%d\n' % pair for pair in zip(kmers, counts[start:start+(1<<20)].tolist())]))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Count the canonical k-mers in the entries of a .bed file (or every sequence of a FASTA file), like jellyfish count -C")
+    parser.add_argument("fasta", help="The genome FASTA file. It must be uncompressed; a .fai index is built next to it if there isn't one")
+    parser.add_argument("k", type=int, help="The length of the k-mers to count, up to %d" % MAX_K)
+    parser.add_argument("output", help="The file to write the k-mers and their counts to")
+    parser.add_argument("--bed", help="Only count the k-mers in the entries of this .bed file, instead of every sequence of the FASTA file. It can be gzip or zstd compressed", default=None)
+    parser.add_argument("--workers", type=int, help="The number of processes to count chunks of the sequences in", default=1)
+    pargs = parser.parse_args()
+
+    if numpy is None:
+        parser.error("counting k-mers requires numpy")
+    if not 0 < pargs.k <= MAX_K:
+        parser.error("k must be between 1 and %d" % MAX_K)
+
+    bed_in = chipseq.openFile(pargs.bed) if pargs.bed else None
+    keys, counts = count_kmers(pargs.fasta, pargs.k, bed_in, pargs.workers)
+    if bed_in is not None:
+        bed_in.close()
+    with open(pargs.output, 'w') as out:
+        write_counts(keys, counts, pargs.k, out)
@@ -9,729 +9,778 @@ we will miss peaks. It outputs one file containing each entry of the input bed f
 overlap with each type of element, and another file containing summary statistics for how much
 overlap there was for each element
 
+Any number of additional element types can be added with --category; they are swept together
+with the standard ones and reported after the repeats. With --batch, the overlaps on each
+chromosome are computed with numpy arrays instead of the entry by entry sweep, which is much
+faster for large input files. With --jobs, the chromosomes are computed in parallel. With
+--index, the element files are compiled once into a binary index that later runs memory-map
+instead of parsing the text files again. With --hierarchy_output, each entry is also assigned to
+an exclusive class during the sweep, and the class counts are written to a separate summary.
+With --signal, the summed signal of a bedGraph or bigWig track over each entry's overlap with
+each type of element is reported as well, computed from prefix sums of the track so it costs
+about as much as the --batch overlaps.
+
 For now, takes in bed files with only three columns (because bedtools complement removes strand
-information). To do stranded analysis, you have to run the script
-separately using element information for each strand.
+information). To do stranded analysis, give the - strand element files with --neg_elements: the
+entries are then split by the strand in column 6 (or, with --unstranded, each one is compared to
+both strands) and both strands are computed in the same pass over the input.
 
 Requires Python >= 2.7
 """
 
-import argparse, sys, os, time, gzip, re
+import argparse, sys, os, time, re, heapq, multiprocessing
+import chipseq
+from array import array
+from itertools import groupby, izip, repeat
+
+## numpy is only needed for --batch, --index and --signal
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+## pyBigWig is only needed to read a bigWig file with --signal
+try:
+    import pyBigWig
+except ImportError:
+    pyBigWig = None
+
+## the labels of each type of element, in the order that the coverage functions take them
+BASIC_LABELS = ['promoter', 'exon', 'intron', 'repeat']
+FULL_UTR_LABELS = ['fp_utr', 'tp_utr'] + BASIC_LABELS
+SPLIT_UTR_LABELS = ['fp_utr_exon', 'fp_utr_intron', 'tp_utr_exon', 'tp_utr_intron'] + BASIC_LABELS
+
+## the names used for each type of element in the hierarchy summary (other labels are used as is)
+CLASS_NAMES = {'fp_utr': "5' UTRs", 'tp_utr': "3' UTRs",
+               'fp_utr_exon': "5' UTR exons", 'fp_utr_intron': "5' UTR introns",
+               'tp_utr_exon': "3' UTR exons", 'tp_utr_intron': "3' UTR introns",
+               'promoter': 'Promoters', 'exon': 'Exons', 'intron': 'Introns', 'repeat': 'Repeats'}
+
+# define a convenience dictionary to make subsetting clearer
+bed_coords = {"chrom": 0, "start": 1, "end": 2, "strand": 5}
+
+## need to make sure that if the entry's chromosome is not in our reference file, we don't
+## look for it..do this by checking if the chromosome is in the form of chr[0-9]_* (i.e. it's got
+## some random crap after it). i am assuming that the reference files only contain canonical
+## chromosomes. chrM is checked separately
+nonref_chr_pattern = re.compile("^chr.*\_.*$")
+
+def is_nonref_chr(chrom):
+    return bool(nonref_chr_pattern.match(chrom)) or chrom=='chrM'
+
+class AnnotationReader:
+    """
+    Reads one sorted element .bed file a chromosome at a time. Each chromosome is returned as a
+    pair of arrays holding the start and end coordinates of its entries, so that the coordinates
+    only get parsed once. Chromosomes that we read past while looking for another one are kept,
+    so a difference in chromosome order between files doesn't lose any elements.
+    """
+    def __init__(self, bed_f):
+        self.handle = chipseq.openFile(bed_f)
+        self.line = self.handle.readline()
+        self.skipped = {}
+
+    ## read the block of entries on the next chromosome in the file
+    def read_block(self):
+        chrom = self.line.split('\t', 1)[0]
+        starts = array('l')
+        ends = array('l')
+        while self.line.strip():
+            data = self.line.split('\t', 3)
+            if data[0] != chrom:
+                break
+            starts.append(int(data[1]))
+            ends.append(int(data[2]))
+            self.line = self.handle.readline()
+        return chrom, starts, ends
+
+    ## get the (starts, ends) arrays for a chromosome
+    def read_chrom(self, chrom):
+        if chrom in self.skipped:
+            return self.skipped.pop(chrom)
+        while self.line.strip():
+            this_chr, starts, ends = self.read_block()
+            if this_chr == chrom:
+                return starts, ends
+            self.skipped[this_chr] = (starts, ends)
+        return array('l'), array('l')
+
+    def close(self):
+        self.handle.close()
+
+def compile_partition_index(categories, index_f):
+    """
+    writes the elements of each category into a binary index. for each category, the start and
+    end coordinates of all its elements are stored as flat arrays sorted by chromosome and start,
+    along with a table of where each chromosome's block begins in them
+    """
+    chroms = []
+    arrays = {}
+    blocks = []
+    for label, bed_f in categories:
+        reader = AnnotationReader(bed_f)
+        cat_blocks = {}
+        while reader.line.strip():
+            chrom, starts, ends = reader.read_block()
+            if chrom not in cat_blocks:
+                cat_blocks[chrom] = (array('l'), array('l'))
+            cat_blocks[chrom][0].extend(starts)
+            cat_blocks[chrom][1].extend(ends)
+            if chrom not in chroms:
+                chroms.append(chrom)
+        reader.close()
+        blocks.append(cat_blocks)
+
+    for (label, bed_f), cat_blocks in zip(categories, blocks):
+        chrom_offsets = [0]
+        cat_starts = []
+        cat_ends = []
+        for chrom in chroms:
+            starts, ends = cat_blocks.get(chrom, (array('l'), array('l')))
+            starts = as_int64(starts)
+            ends = as_int64(ends)
+            order = numpy.argsort(starts, kind='mergesort')
+            cat_starts.append(starts[order])
+            cat_ends.append(ends[order])
+            chrom_offsets.append(chrom_offsets[-1] + len(starts))
+        cat_starts = numpy.concatenate(cat_starts) if chroms else numpy.zeros(0, dtype=numpy.int64)
+        cat_ends = numpy.concatenate(cat_ends) if chroms else numpy.zeros(0, dtype=numpy.int64)
+        ## most genomes fit in 32 bit coordinates
+        coord_type = numpy.int32 if len(cat_ends)==0 or cat_ends.max() < 2**31 else numpy.int64
+        arrays[label+'.starts'] = cat_starts.astype(coord_type)
+        arrays[label+'.ends'] = cat_ends.astype(coord_type)
+        arrays[label+'.chrom_offsets'] = numpy.array(chrom_offsets, dtype=numpy.int64)
+
+    meta = {'labels': [label for label, bed_f in categories],
+            'sources': [os.path.abspath(bed_f) for label, bed_f in categories],
+            'chroms': chroms}
+    chipseq.saveArrayStore(index_f, arrays, meta)
+
+def index_is_current(categories, index_f):
+    """
+    checks whether an index exists, was compiled from the same element files and is newer than
+    all of them
+    """
+    if not os.path.exists(index_f):
+        return False
+    try:
+        arrays, meta = chipseq.loadArrayStore(index_f)
+    except ValueError:
+        return False
+    if meta['labels'] != [label for label, bed_f in categories] or meta['sources'] != [os.path.abspath(bed_f) for label, bed_f in categories]:
+        return False
+    index_time = os.path.getmtime(index_f)
+    return all(os.path.getmtime(bed_f) <= index_time for label, bed_f in categories)
+
+class PartitionIndex:
+    """
+    Memory-maps an index written by compile_partition_index
+    """
+    def __init__(self, index_f):
+        self.arrays, meta = chipseq.loadArrayStore(index_f)
+        self.chrom_ids = dict((str(chrom), i) for i, chrom in enumerate(meta['chroms']))
+
+    ## get the (starts, ends) arrays of a category on a chromosome
+    def read_chrom(self, label, chrom):
+        if chrom not in self.chrom_ids:
+            return array('l'), array('l')
+        i = self.chrom_ids[chrom]
+        offsets = self.arrays[label+'.chrom_offsets']
+        start, end = offsets[i], offsets[i+1]
+        return self.arrays[label+'.starts'][start:end], self.arrays[label+'.ends'][start:end]
+
+class IndexedCategory:
+    """
+    Reads one category out of a PartitionIndex, the same way as an AnnotationReader
+    """
+    def __init__(self, index, label):
+        self.index = index
+        self.label = label
 
-def compute_coverage(promoter_f, exon_f, intron_f, repeat_f, input_f, entrywise_out_f, summary_out_f):
-    start = time.clock()
+    def read_chrom(self, chrom):
+        return self.index.read_chrom(self.label, chrom)
+
+    def close(self):
+        pass
+
+class SignalTrack:
+    """
+    The signal track given with --signal: a bedGraph, a track saved with
+    chipseq.BedGraphTrack.save, or a local bigWig file (which needs pyBigWig). A bedGraph is
+    loaded once into a chipseq.BedGraphTrack, while a bigWig is read one chromosome at a time.
+    """
+    def __init__(self, signal_f):
+        self.signal_f = signal_f
+        self.bigwig = signal_f.lower().endswith(('.bw', '.bigwig'))
+        self.handle = None
+        if self.bigwig:
+            if pyBigWig is None:
+                raise ImportError("reading a bigWig file requires pyBigWig")
+            self.track = chipseq.BedGraphTrack()
+            return
+        try:
+            self.track = chipseq.loadBedGraphTrack(signal_f)
+        except ValueError:
+            self.track = chipseq.BedGraphTrack(signal_f)
+
+    ## load a chromosome of the bigWig file, replacing the last one. the file is opened again in
+    ## each process, since a handle can't be shared between them
+    def load_bigwig_chrom(self, chrom):
+        if self.handle is None or self.handle[0] != os.getpid():
+            self.handle = (os.getpid(), pyBigWig.open(self.signal_f))
+        bigwig = self.handle[1]
+        self.track.tracks.clear()
+        if chrom in bigwig.chroms():
+            intervals = numpy.array(bigwig.intervals(chrom) or [], dtype=numpy.float64).reshape(-1, 3)
+            self.track.setChromosome(chrom, intervals[:,0], intervals[:,1], intervals[:,2])
+
+    ## get a function giving the signal before each position of an array on a chromosome
+    def read_chrom(self, chrom):
+        if self.bigwig and chrom not in self.track.tracks:
+            self.load_bigwig_chrom(chrom)
+        if chrom not in self.track.tracks:
+            return lambda positions: numpy.zeros(len(positions))
+        return lambda positions: self.track.cumulative(chrom, positions)
+
+## the signal track of each worker process, set when the pool starts
+worker_signal = None
+def init_worker(signal):
+    global worker_signal
+    worker_signal = signal
+
+def sweep_chrom(entries, blocks):
+    """
+    computes the number of base pairs of each entry (a list of (start, end) pairs on one
+    chromosome, sorted by start) that overlap each type of element. blocks holds the (starts,
+    ends) arrays of each element type on this chromosome. all the element types are advanced in
+    one k-way merged pass, and the overlaps are returned as one list per entry with one value
+    for each element type
+    """
+    num_cats = len(blocks)
+    merged = heapq.merge(*[izip(starts.tolist(), ends.tolist(), repeat(i)) for i, (starts, ends) in enumerate(blocks)])
+    ## we don't want to stop considering an element until the start site that we are looking at
+    ## is past its end site
+    cur_elements = []
+    next_element = next(merged, None)
+    overlaps = []
+    for entry_start, entry_end in entries:
+        ## add all possibly overlapping elements (ones that start before the end of the entry)
+        while next_element is not None and next_element[0] <= entry_end:
+            cur_elements.append(next_element)
+            next_element = next(merged, None)
+        ## remove elements that are before the current entry
+        cur_elements = [e for e in cur_elements if e[1] >= entry_start]
+        ## here i am relying on the correct merging of the bed entries from the element files
+        ## because i dont ever re-merge anything
+        this_bp = [0.0] * num_cats
+        for el_start, el_end, i in cur_elements:
+            this_bp[i] += max(0, min(el_end, entry_end) - max(el_start, entry_start))
+        overlaps.append(this_bp)
+    return overlaps
+
+def depth_integral(starts, ends, positions, cumulative=None):
+    """
+    for each position, computes the number of element base pairs before it (if elements overlap
+    each other, their shared bases are counted once for each element). starts and ends must be
+    sorted int64 arrays, which don't have to be paired up. if cumulative is given (a function
+    giving the signal before each position of an array, see SignalTrack.read_chrom), each base
+    is weighted by its signal, so this computes the element signal before each position instead
+    """
+    weight = cumulative or (lambda coords: coords)
+    start_sums = numpy.concatenate(([0], numpy.cumsum(weight(starts))))
+    end_sums = numpy.concatenate(([0], numpy.cumsum(weight(ends))))
+    ## the number of elements that have started and ended at each position
+    num_started = numpy.searchsorted(starts, positions, side='right')
+    num_ended = numpy.searchsorted(ends, positions, side='right')
+    position_weights = weight(positions)
+    return (num_started * position_weights - start_sums[num_started]) - (num_ended * position_weights - end_sums[num_ended])
+
+## view an array of coordinates as an int64 numpy array without converting each value
+def as_int64(coords):
+    if isinstance(coords, array):
+        return numpy.frombuffer(coords, dtype=coords.typecode).astype(numpy.int64)
+    return numpy.asarray(coords, dtype=numpy.int64)
+
+def batch_overlaps(entry_starts, entry_ends, blocks, cumulative=None):
+    """
+    computes the overlap of each entry with each type of element as a 2d int64 array with one
+    row per entry. the overlap with one type of element is the difference of the element base
+    pairs before the entry's end and before its start, so we can compute it for all the entries
+    at once with searchsorted and cumulative sums. the entries don't have to be sorted. with
+    cumulative (see depth_integral), this is the float64 array of the signal over each overlap
+    """
+    overlaps = numpy.zeros((len(entry_starts), len(blocks)), dtype=numpy.int64 if cumulative is None else numpy.float64)
+    for i, (starts, ends) in enumerate(blocks):
+        starts = numpy.sort(as_int64(starts))
+        ends = numpy.sort(as_int64(ends))
+        overlaps[:,i] = depth_integral(starts, ends, entry_ends, cumulative) - depth_integral(starts, ends, entry_starts, cumulative)
+    return overlaps
+
+def batch_chrom(entries, blocks):
+    """
+    the vectorised version of sweep_chrom, using batch_overlaps
+    """
+    entry_coords = numpy.array(entries, dtype=numpy.int64).reshape(-1, 2)
+    overlaps = batch_overlaps(entry_coords[:,0], entry_coords[:,1], blocks)
+    return overlaps.astype(numpy.float64).tolist()
+
+def read_offset_lines(bed_f, start, end):
     """
-    the main function to compute the coverage of the entries in the bed file.
+    reads the lines between two byte offsets of a file
     """
-    # define a convenience dictionary to make subsetting clearer
-    bed_coords = {} 
-    bed_coords["chrom"] = 0
-    bed_coords["start"] = 1
-    bed_coords["end"] = 2    
-    bed_coords["strand"] = 5
+    with open(bed_f, 'rb') as bed:
+        bed.seek(start)
+        return bed.read(end - start).splitlines()
 
-    if input_f[-2:]=='gz':
-        input_beds = gzip.open(input_f, 'rb')
+def parse_block(lines):
+    """
+    parses the start and end coordinates of a list of .bed lines into arrays
+    """
+    starts = array('l')
+    ends = array('l')
+    for line in lines:
+        data = line.split('\t', 3)
+        starts.append(int(data[1]))
+        ends.append(int(data[2]))
+    return starts, ends
+
+def chrom_coverage(chr_entries, blocks, chrom_overlaps, cumulative=None):
+    """
+    computes the coverage of the entries on one chromosome. chr_entries holds the split input
+    lines, blocks the (starts, ends) arrays of each type of element on this chromosome, and
+    chrom_overlaps is either sweep_chrom or batch_chrom. returns the entrywise output lines, the
+    number of base pairs in the entries, the number of base pairs overlapping each element type,
+    and the number of entries in each class of the hierarchy. the hierarchy follows the order of
+    the element types: an entry belongs to the first type it overlaps at all, and entries that
+    don't overlap anything are counted in the last (intergenic) class. if cumulative is given
+    (see SignalTrack.read_chrom), it also returns the signal in the entries and the signal over
+    their overlap with each element type, and each entry's line gets the same signal columns
+    """
+    coords = [(int(e[bed_coords['start']]), int(e[bed_coords['end']])) for e in chr_entries]
+    overlaps = chrom_overlaps(coords, blocks)
+    if cumulative is not None:
+        entry_coords = numpy.array(coords, dtype=numpy.int64).reshape(-1, 2)
+        entry_signals = (cumulative(entry_coords[:,1]) - cumulative(entry_coords[:,0])).tolist()
+        signals = batch_overlaps(entry_coords[:,0], entry_coords[:,1], blocks, cumulative).tolist()
+        this_chr_entry_signal = 0.0
+        this_chr_signal = [0.0] * len(blocks)
+
+    ## write out the entries and add up the overlaps for this chromosome
+    out_lines = []
+    this_chr_entry_bp = 0.0
+    this_chr_bp = [0.0] * len(blocks)
+    class_counts = [0] * (len(blocks) + 1)
+    for entry_data, (entry_start, entry_end), this_bp in izip(chr_entries, coords, overlaps):
+        this_length = entry_end - entry_start
+        this_chr_entry_bp += this_length
+        outdata = [entry_data[bed_coords['chrom']], entry_data[bed_coords['start']], entry_data[bed_coords['end']]]
+        entry_class = len(blocks)
+        for i in range(len(blocks)):
+            this_chr_bp[i] += this_bp[i]
+            outdata += [str(this_bp[i]), str(this_bp[i] / this_length)]
+            if this_bp[i] > 0 and entry_class==len(blocks):
+                entry_class = i
+        class_counts[entry_class] += 1
+        if cumulative is not None:
+            entry_signal = entry_signals[len(out_lines)]
+            this_chr_entry_signal += entry_signal
+            for i, signal in enumerate(signals[len(out_lines)]):
+                this_chr_signal[i] += signal
+                outdata += [str(signal), str(signal / entry_signal if entry_signal else 0.0)]
+        out_lines.append('\t'.join(outdata)+'\n')
+    if cumulative is not None:
+        return out_lines, this_chr_entry_bp, this_chr_bp, class_counts, (this_chr_entry_signal, this_chr_signal)
+    return out_lines, this_chr_entry_bp, this_chr_bp, class_counts, None
+
+def route_entries(chr_entries, strands, unstranded=False):
+    """
+    splits the entries on one chromosome between partitions with the given strands. a partition
+    with a strand only gets the entries on that strand (by column 6), unless unstranded is True,
+    in which case every partition gets every entry
+    """
+    routed = []
+    for strand in strands:
+        if strand is None or unstranded:
+            routed.append(chr_entries)
+        else:
+            routed.append([e for e in chr_entries if len(e) > bed_coords['strand'] and e[bed_coords['strand']]==strand])
+    return routed
+
+def chrom_job(job):
+    """
+    computes the coverage of one chromosome in a worker process. the input entries are read
+    from their byte offsets in the input file (or passed in directly, for compressed input).
+    each element file's block is given as a (kind, file, location) tuple, where kind is one of
+    'empty', 'index' (a label in a binary index), 'region' (the lines of this chromosome found
+    by chipseq.iterRegion, between the start and end given as the location if it isn't None)
+    or 'arrays' (already parsed)
+    """
+    this_chr, input_f, input_block, input_lines, strands, partition_blocks, unstranded, batch = job
+    if input_lines is None:
+        input_lines = read_offset_lines(input_f, input_block[0], input_block[1])
+    chr_entries = [line.strip().split('\t') for line in input_lines if line.strip()]
+    cumulative = worker_signal.read_chrom(this_chr) if worker_signal is not None else None
+    results = []
+    for entries, element_blocks in zip(route_entries(chr_entries, strands, unstranded), partition_blocks):
+        if not entries:
+            results.append(None)
+            continue
+        blocks = []
+        index = None
+        for kind, element_f, location in element_blocks:
+            if kind == 'empty':
+                blocks.append((array('l'), array('l')))
+            elif kind == 'region':
+                blocks.append(parse_block(chipseq.iterRegion(element_f, this_chr, *(location or ()))))
+            elif kind == 'arrays':
+                blocks.append(location)
+            else:
+                if index is None:
+                    index = PartitionIndex(element_f)
+                blocks.append(index.read_chrom(location, this_chr))
+        out_lines, this_chr_entry_bp, this_chr_bp, class_counts, chr_signal = chrom_coverage(entries, blocks, batch_chrom if batch else sweep_chrom, cumulative)
+        results.append((''.join(out_lines), this_chr_entry_bp, this_chr_bp, class_counts, chr_signal))
+    return results
+
+def parallel_chrom_results(partitions, input_f, batch, jobs, unstranded=False, signal=None):
+    """
+    splits the input and element files by chromosome and computes each chromosome in a pool of
+    jobs processes. yields the chromosome and a list with one (output text, entry bp, element bp,
+    class counts, signal) tuple for each partition (None if it has no entries there), in input
+    order. the signal is None unless a SignalTrack is given (see chrom_coverage)
+    """
+    ## find where each chromosome is in the element files, through the chromosome offsets
+    ## that chipseq caches next to each plain file. we can't seek in a compressed file unless
+    ## it has a tabix index, so the others get read here
+    partition_offsets = []
+    for partition in partitions:
+        element_offsets = []
+        for label, bed_f in partition.categories:
+            if partition.index_f:
+                element_offsets.append(('index', partition.index_f, label))
+            elif chipseq.isCompressed(bed_f):
+                if chipseq.findRegionIndex(bed_f):
+                    element_offsets.append(('region', bed_f, None))
+                else:
+                    reader = AnnotationReader(bed_f)
+                    chrom_arrays = {}
+                    while reader.line.strip():
+                        chrom, starts, ends = reader.read_block()
+                        chrom_starts, chrom_ends = chrom_arrays.setdefault(chrom, (array('l'), array('l')))
+                        chrom_starts.extend(starts)
+                        chrom_ends.extend(ends)
+                    reader.close()
+                    element_offsets.append(('arrays', None, chrom_arrays))
+            else:
+                element_offsets.append(('offsets', bed_f, chipseq.loadChromOffsets(bed_f)))
+        partition_offsets.append(element_offsets)
+
+    ## and in the input file
+    if chipseq.isCompressed(input_f):
+        input_beds = chipseq.openFile(input_f)
+        input_blocks = [(chrom, None, list(lines)) for chrom, lines in groupby(input_beds, lambda l: l.split('\t', 1)[0]) if chrom.strip()]
+        input_beds.close()
     else:
-        input_beds = open(input_f, 'r')
-    
-    with open(promoter_f, 'r') as promoters, open(exon_f, 'r') as exons, open(intron_f, 'r') as introns, open(repeat_f, 'r') as repeats, open(entrywise_out_f, 'w') as entry_out, open(summary_out_f, 'w') as summary_out:
-        # loop through input bed file, and store lists of potential peaks from other file types
-        # (we don't want to stop considering a peak until the start site that we are looking at is
-        # past its end site)
-
-        ## write the output file headers
-        # for the individual entries, write the original entry along with its amount and percent of
-        # overlap with each element
-        ## might want to add in 'other' here, although it's implied 
-        entry_out.write("\t".join(['chr', 'start', 'end', 'promoter_bp', 'promoter_pct', 'exon_bp', 'exon_pct', 'intron_bp', 'intron_pct', 'repeat_bp', 'repeat_pct'])+'\n')
-        # for the summary, we write each chromosomes entry as well as genomewide
-        summary_out.write('\t'.join(['partition', 'promoter_bp', 'promoter_pct', 'exon_bp', 'exon_pct', 'intron_bp', 'intron_pct', 'repeat_bp', 'repeat_pct'])+'\n')
-
-        ## we store lists of each type of element
-        cur_promoters = []
-        cur_exons = []
-        cur_introns = []
-        cur_repeats = []
-
-        ## start reading in these genomic elements
-        cur_promoter = promoters.readline().strip().split('\t')
-        cur_exon = exons.readline().strip().split('\t')
-        cur_intron = introns.readline().strip().split('\t')
-        cur_repeat = repeats.readline().strip().split('\t')
-
-        ## also initialize our tracking variables for the summary statistics:
-        total_entry_bp = 0.0 # the total number of base pairs covered by the input bed
-        total_promoter_bp = 0.0 # the total number of promoter BPs overlapped
-        total_exon_bp = 0.0 # total number of exon BPs overlapped
-        total_intron_bp = 0.0 # total number of intron BPs overlapped
-        total_repeat_bp = 0.0 # total number of repeat BPs overlapped
-
-        # for each chromosome, also store similar info
-        this_chr_entry_bp = 0.0
-        this_chr_promoter_bp = 0.0 
-        this_chr_exon_bp = 0.0 
-        this_chr_intron_bp = 0.0 
-        this_chr_repeat_bp = 0.0 
-
-        # to track which chromosome we're on
-        this_chr = ''
-
-        ## need to make sure that if the entry's chromosome is not in our reference file,
-        ## we just wait..do this by checking if this_chr is in the form of
-        ## chr[0-9]_* (i.e. it's got some random crap after it)
-        ## i am assuming that the reference files only contain canonical chromosomes
-        nonref_chr_pattern = re.compile("^chr.*\_.*$")                        
-                
-        entry_ctr = 0        
-        for entry in input_beds:
-            entry_ctr += 1
-            # if entry_ctr % 1000==0:
-            #     print entry_ctr
-            entry_data = entry.strip().split('\t')
-            entry_start = int(entry_data[bed_coords['start']])
-            entry_end = int(entry_data[bed_coords['end']])
-            this_length = int(entry_data[bed_coords['end']]) - entry_start
-            total_entry_bp += this_length
-            if entry_data[bed_coords['chrom']] == this_chr:
-                this_chr_entry_bp += this_length
+        ## each block of lines on a chromosome is its own job, in the order of the file, like
+        ## the groups of serial_chrom_results
+        input_offsets = chipseq.loadChromOffsets(input_f)
+        input_blocks = [(chrom, (start, end), None) for start, end, chrom in sorted((start, end, chrom) for chrom, blocks in input_offsets.items() for start, end in blocks)]
+
+    chrom_jobs = []
+    for chrom, input_block, input_lines in input_blocks:
+        partition_blocks = []
+        for partition, element_offsets in zip(partitions, partition_offsets):
+            element_blocks = []
+            for kind, element_f, location in element_offsets:
+                if is_nonref_chr(chrom):
+                    element_blocks.append(('empty', None, None))
+                elif kind == 'offsets':
+                    element_blocks.append(('region', element_f, None) if chrom in location else ('empty', None, None))
+                elif kind == 'arrays':
+                    element_blocks.append(('arrays', None, location[chrom]) if chrom in location else ('empty', None, None))
+                else:
+                    element_blocks.append((kind, element_f, location))
+            partition_blocks.append(element_blocks)
+        chrom_jobs.append((chrom, input_f, input_block, input_lines, [p.strand for p in partitions], partition_blocks, unstranded, batch))
+
+    pool = multiprocessing.Pool(jobs, init_worker, (signal,))
+    try:
+        for (chrom, input_block, input_lines), results in izip(input_blocks, pool.imap(chrom_job, chrom_jobs)):
+            yield chrom, results
+    finally:
+        pool.terminate()
+
+def region_chrom_results(partitions, input_f, batch, jobs, regions, unstranded=False, signal=None):
+    """
+    computes only the entries that overlap the given regions, a list of (chromosome, [(start,
+    end), ...]) as returned by chipseq.collectRegions. the input and element files are read
+    with chipseq.iterRegion, which jumps straight to each chromosome, so the rest of the genome
+    is never read. yields the same results as parallel_chrom_results, in the order of regions
+    """
+    ## build the chromosome offsets of the plain element files here, so the worker processes
+    ## don't all try to write them at once
+    for partition in partitions:
+        if not partition.index_f:
+            for label, bed_f in partition.categories:
+                if not chipseq.isCompressed(bed_f):
+                    chipseq.loadChromOffsets(bed_f)
+    chrom_jobs = []
+    for chrom, chrom_regions in regions:
+        input_lines = [line for line in chipseq.iterRegion(input_f, chrom, chrom_regions[0][0], chrom_regions[-1][1])
+                       if chipseq.overlapsRegions(chrom_regions, *[int(c) for c in line.split('\t', 3)[1:3]])]
+        if not input_lines:
+            continue
+        ## the elements only need to be read as far as the entries reach
+        bounds = (min(int(l.split('\t', 3)[1]) for l in input_lines), max(int(l.split('\t', 3)[2]) for l in input_lines))
+        partition_blocks = []
+        for partition in partitions:
+            element_blocks = []
+            for label, bed_f in partition.categories:
+                if is_nonref_chr(chrom):
+                    element_blocks.append(('empty', None, None))
+                elif partition.index_f:
+                    element_blocks.append(('index', partition.index_f, label))
+                else:
+                    element_blocks.append(('region', bed_f, bounds))
+            partition_blocks.append(element_blocks)
+        chrom_jobs.append((chrom, input_f, None, input_lines, [p.strand for p in partitions], partition_blocks, unstranded, batch))
+
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, init_worker, (signal,))
+        try:
+            for job, results in izip(chrom_jobs, pool.imap(chrom_job, chrom_jobs)):
+                yield job[0], results
+        finally:
+            pool.terminate()
+    else:
+        init_worker(signal)
+        for job in chrom_jobs:
+            yield job[0], chrom_job(job)
+
+def serial_chrom_results(partitions, input_f, batch, unstranded=False, signal=None):
+    """
+    computes each chromosome in turn while streaming through the input and element files.
+    yields the same results as parallel_chrom_results
+    """
+    chrom_overlaps = batch_chrom if batch else sweep_chrom
+    partition_readers = []
+    for partition in partitions:
+        if partition.index_f:
+            index = PartitionIndex(partition.index_f)
+            partition_readers.append([IndexedCategory(index, label) for label, bed_f in partition.categories])
+        else:
+            partition_readers.append([AnnotationReader(bed_f) for label, bed_f in partition.categories])
+
+    input_beds = chipseq.openFile(input_f)
+
+    entry_lines = (entry.strip().split('\t') for entry in input_beds)
+    for this_chr, chr_entries in groupby(entry_lines, lambda e: e[bed_coords['chrom']]):
+        cumulative = signal.read_chrom(this_chr) if signal is not None else None
+        results = []
+        for entries, readers in zip(route_entries(list(chr_entries), [p.strand for p in partitions], unstranded), partition_readers):
+            if not entries:
+                results.append(None)
+                continue
+            if is_nonref_chr(this_chr):
+                ## nothing in the reference files can overlap these
+                blocks = [(array('l'), array('l')) for r in readers]
             else:
-                if this_chr: # if we've read anything in yet:
-                    summary_out.write('\t'.join([this_chr, str(this_chr_promoter_bp), str(this_chr_promoter_bp/this_chr_entry_bp), str(this_chr_exon_bp), str(this_chr_exon_bp/this_chr_entry_bp), str(this_chr_intron_bp), str(this_chr_intron_bp/this_chr_entry_bp), str(this_chr_repeat_bp), str(this_chr_repeat_bp/this_chr_entry_bp)])+'\n')
-                ## reset the genomic element lists and read through their files until they're
-                ## on the right chromosome again
-                this_chr = entry_data[bed_coords['chrom']]
-                cur_promoters = []
-                cur_exons = []
-                cur_introns = []
-                cur_repeats = []
-                ## reset the chromosome tracking variables
-                this_chr_entry_bp = float(this_length)
-                this_chr_promoter_bp = 0.0 
-                this_chr_exon_bp = 0.0 
-                this_chr_intron_bp = 0.0 
-                this_chr_repeat_bp = 0.0                                 
-
-                if nonref_chr_pattern.match(this_chr) or this_chr=='chrM':
-                    continue
-                
-                while len(cur_promoter) > 1 and cur_promoter[bed_coords['chrom']] != this_chr:
-                    cur_promoter = promoters.readline().strip().split('\t')
-                while len(cur_exon) > 1 and cur_exon[bed_coords['chrom']] != this_chr:
-                    cur_exon = exons.readline().strip().split('\t')
-                while len(cur_intron) > 1 and cur_intron[bed_coords['chrom']] != this_chr:
-                    cur_intron = introns.readline().strip().split('\t')
-                while len(cur_repeat) > 1 and cur_repeat[bed_coords['chrom']] != this_chr:
-                    cur_repeat = repeats.readline().strip().split('\t')
-                print 'Parsing chromosome '+this_chr
-            ## add all possibly overlapping entries for each type of element
-            ## must have same chromosome and start before the end of the entry
-            promoterbool = len(cur_promoter) > 1 and cur_promoter[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_promoter[bed_coords['start']]) <= entry_end
-            while promoterbool:
-                cur_promoters.append(cur_promoter)
-                cur_promoter = promoters.readline().strip().split('\t')
-                promoterbool = len(cur_promoter) > 1 and cur_promoter[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_promoter[bed_coords['start']]) <= entry_end
-                
-            exonbool = len(cur_exon) > 1 and cur_exon[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_exon[bed_coords['start']]) <= entry_end
-            while exonbool:
-                cur_exons.append(cur_exon)
-                cur_exon = exons.readline().strip().split('\t')
-                exonbool = len(cur_exon) > 1 and cur_exon[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_exon[bed_coords['start']]) <= entry_end 
-
-            intronbool = len(cur_intron) > 1 and cur_intron[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_intron[bed_coords['start']]) <= entry_end 
-            while intronbool:
-                cur_introns.append(cur_intron)
-                cur_intron = introns.readline().strip().split('\t')
-                intronbool = len(cur_intron) > 1 and cur_intron[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_intron[bed_coords['start']]) <= entry_end 
-
-            repeatbool = len(cur_repeat) > 1 and cur_repeat[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_repeat[bed_coords['start']]) <= entry_end 
-            while repeatbool:
-                cur_repeats.append(cur_repeat)
-                cur_repeat = repeats.readline().strip().split('\t')
-                repeatbool = len(cur_repeat) > 1 and cur_repeat[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_repeat[bed_coords['start']]) <= entry_end 
-
-            ## remove entries that are before the current entry here:
-            for i in range(len(cur_promoters)-1, -1, -1):
-                if cur_promoters[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_promoters[i][bed_coords['end']]) < entry_start:
-                    cur_promoters.pop(i)
-
-            for i in range(len(cur_exons)-1, -1, -1):
-                if cur_exons[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_exons[i][bed_coords['end']]) < entry_start:
-                    cur_exons.pop(i)
-
-            for i in range(len(cur_introns)-1, -1, -1):
-                if cur_introns[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_introns[i][bed_coords['end']]) < entry_start:
-                    cur_introns.pop(i)
-
-            for i in range(len(cur_repeats)-1, -1, -1):
-                if cur_repeats[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_repeats[i][bed_coords['end']]) < entry_start:
-                    cur_repeats.pop(i)                                        
-                                    
-            ## now compare the current entry to all these peaks
-            ## here i am relying on the correct merging of the bed entries from the element files
-            ## because i dont ever re-merge anything
-            this_promoter_bp = 0.0
-            this_exon_bp = 0.0
-            this_intron_bp = 0.0
-            this_repeat_bp = 0.0
-            for cp in cur_promoters:
-                # if int(cp[bed_coords['start']]) > int(entry_data[bed_coords['end']]):
-                #     break
-                this_promoter_bp += max(0, min(int(cp[bed_coords['end']]), entry_end) - max(int(cp[bed_coords['start']]), entry_start))
-            for ce in cur_exons:
-                # if int(ce[bed_coords['start']]) > int(entry_data[bed_coords['end']]):
-                #     break
-                this_exon_bp += max(0, min(int(ce[bed_coords['end']]), entry_end) - max(int(ce[bed_coords['start']]), entry_start))
-            for ci in cur_introns:
-                # if int(ci[bed_coords['start']]) > int(entry_data[bed_coords['end']]):
-                #     break                
-                this_intron_bp += max(0, min(int(ci[bed_coords['end']]), entry_end) - max(int(ci[bed_coords['start']]), entry_start))
-            for cr in cur_repeats:
-                # if int(cr[bed_coords['start']]) > int(entry_data[bed_coords['end']]):
-                #     break                
-                this_repeat_bp += max(0, min(int(cr[bed_coords['end']]), entry_end) - max(int(cr[bed_coords['start']]), entry_start))
-            ## add these overlaps to the summary trackers
-            this_chr_promoter_bp += this_promoter_bp
-            this_chr_exon_bp += this_exon_bp
-            this_chr_intron_bp += this_intron_bp
-            this_chr_repeat_bp += this_repeat_bp
-            total_promoter_bp += this_promoter_bp
-            total_exon_bp += this_exon_bp
-            total_intron_bp += this_intron_bp
-            total_repeat_bp += this_repeat_bp
-            
-            entry_out.write('\t'.join([entry_data[bed_coords['chrom']], entry_data[bed_coords['start']], entry_data[bed_coords['end']], str(this_promoter_bp), str(this_promoter_bp / this_length), str(this_exon_bp), str(this_exon_bp / this_length), str(this_intron_bp), str(this_intron_bp / this_length), str(this_repeat_bp), str(this_repeat_bp / this_length)])+'\n')
-
-        summary_out.write('\t'.join(['genomewide', str(total_promoter_bp), str(total_promoter_bp/total_entry_bp), str(total_exon_bp), str(total_exon_bp/total_entry_bp), str(total_intron_bp), str(total_intron_bp/total_entry_bp), str(total_repeat_bp), str(total_repeat_bp/total_entry_bp)])+'\n')
+                blocks = [r.read_chrom(this_chr) for r in readers]
+            out_lines, this_chr_entry_bp, this_chr_bp, class_counts, chr_signal = chrom_coverage(entries, blocks, chrom_overlaps, cumulative)
+            results.append((''.join(out_lines), this_chr_entry_bp, this_chr_bp, class_counts, chr_signal))
+        yield this_chr, results
 
     input_beds.close()
-        
-    end = time.clock()
-    length = end - start
-    print "Analysis complete, time: ", length
+    for readers in partition_readers:
+        for r in readers:
+            r.close()
 
-## another function to calculate coverage over the UTRs (given one file for each UTR):
-def compute_full_utr_coverage(fp_utr_f, tp_utr_f, promoter_f, exon_f, intron_f, repeat_f, input_f, entrywise_out_f, summary_out_f):
-    start = time.clock()
+class PartitionOutput:
     """
-    the main function to compute the coverage of the entries in the bed file.
+    One set of element files and the output files that the coverage over them is written to.
+    strand is '+' or '-' if this set should only get the input entries on that strand, or None
+    if it should get all of them. If index_f is given, the elements are read from that index
+    (see compile_partition_index), and if hierarchy_out_f is given, the number of entries in each
+    class of the hierarchy (see chrom_coverage) is written to it.
     """
-    # define a convenience dictionary to make subsetting clearer
-    bed_coords = {} 
-    bed_coords["chrom"] = 0
-    bed_coords["start"] = 1
-    bed_coords["end"] = 2    
-    bed_coords["strand"] = 5
-
-    if input_f[-2:]=='gz':
-        input_beds = gzip.open(input_f, 'rb')
-    else:
-        input_beds = open(input_f, 'r')
-    
-    with open(fp_utr_f, 'r') as fp_utrs, open(tp_utr_f, 'r') as tp_utrs, open(promoter_f, 'r') as promoters, open(exon_f, 'r') as exons, open(intron_f, 'r') as introns, open(repeat_f, 'r') as repeats, open(entrywise_out_f, 'w') as entry_out, open(summary_out_f, 'w') as summary_out:
-        # loop through input bed file, and store lists of potential peaks from other file types
-        # (we don't want to stop considering a peak until the start site that we are looking at is
-        # past its end site)
-
-        ## write the output file headers
+    def __init__(self, categories, entrywise_out_f, summary_out_f, hierarchy_out_f=None, index_f=None, strand=None):
+        self.categories = categories
+        self.labels = [label for label, bed_f in categories]
+        self.entrywise_out_f = entrywise_out_f
+        self.summary_out_f = summary_out_f
+        self.hierarchy_out_f = hierarchy_out_f
+        self.index_f = index_f
+        self.strand = strand
+
+    ## open the output files and write their headers. with signal, each element type also gets
+    ## the signal over its overlap and the proportion of the entries' signal that is
+    def open(self, signal=False):
+        self.entry_out = open(self.entrywise_out_f, 'w')
+        self.summary_out = open(self.summary_out_f, 'w')
+        suffixes = ('_bp', '_pct')
+        signal_suffixes = ('_signal', '_signal_pct') if signal else ()
+        columns = [l+suffix for l in self.labels for suffix in suffixes] + [l+suffix for l in self.labels for suffix in signal_suffixes]
         # for the individual entries, write the original entry along with its amount and percent of
         # overlap with each element
-        entry_out.write("\t".join(['chr', 'start', 'end', 'fp_utr_bp', 'fp_utr_pct', 'tp_utr_bp', 'tp_utr_pct', 'promoter_bp', 'promoter_pct', 'exon_bp', 'exon_pct', 'intron_bp', 'intron_pct', 'repeat_bp', 'repeat_pct'])+'\n')
+        self.entry_out.write('\t'.join(['chr', 'start', 'end'] + columns)+'\n')
         # for the summary, we write each chromosomes entry as well as genomewide
-        summary_out.write('\t'.join(['partition', 'fp_utr_bp', 'fp_utr_pct', 'tp_utr_bp', 'tp_utr_pct', 'promoter_bp', 'promoter_pct', 'exon_bp', 'exon_pct', 'intron_bp', 'intron_pct', 'repeat_bp', 'repeat_pct'])+'\n')
-
-        ## we store lists of each type of element
-        cur_fp_utrs = []
-        cur_tp_utrs = []
-        cur_promoters = []
-        cur_exons = []
-        cur_introns = []
-        cur_repeats = []
-
-        ## start reading in these genomic elements
-        cur_fp_utr = fp_utrs.readline().strip().split('\t')
-        cur_tp_utr = tp_utrs.readline().strip().split('\t')                
-        cur_promoter = promoters.readline().strip().split('\t')
-        cur_exon = exons.readline().strip().split('\t')
-        cur_intron = introns.readline().strip().split('\t')
-        cur_repeat = repeats.readline().strip().split('\t')
-
-        ## also initialize our tracking variables for the summary statistics:
-        total_entry_bp = 0.0 # the total number of base pairs covered by the input bed
-        total_fp_utr_bp = 0.0 # total number of 5' UTR bps
-        total_tp_utr_bp = 0.0 # total number of 3' UTR bps        
-        total_promoter_bp = 0.0 # the total number of promoter BPs overlapped
-        total_exon_bp = 0.0 # total number of exon BPs overlapped
-        total_intron_bp = 0.0 # total number of intron BPs overlapped
-        total_repeat_bp = 0.0 # total number of repeat BPs overlapped
-
-        # for each chromosome, also store similar info
-        this_chr_entry_bp = 0.0
-        this_chr_fp_utr_bp = 0.0
-        this_chr_tp_utr_bp = 0.0
-        this_chr_promoter_bp = 0.0 
-        this_chr_exon_bp = 0.0 
-        this_chr_intron_bp = 0.0 
-        this_chr_repeat_bp = 0.0 
-
-        # to track which chromosome we're on
-        this_chr = ''
-
-        ## need to make sure that if the entry's chromosome is not in our reference file,
-        ## we just wait..do this by checking if this_chr is in the form of
-        ## chr[0-9]_* (i.e. it's got some random crap after it)
-        ## i am assuming that the reference files only contain canonical chromosomes
-        nonref_chr_pattern = re.compile("^chr.*\_.*$")                        
-        
-        entry_ctr = 0        
-        for entry in input_beds:
-            entry_ctr += 1
-            # if entry_ctr % 1000==0:
-            #     print entry_ctr
-            entry_data = entry.strip().split('\t')
-            entry_start = int(entry_data[bed_coords['start']])
-            entry_end = int(entry_data[bed_coords['end']])
-            this_length = int(entry_data[bed_coords['end']]) - entry_start
-            total_entry_bp += this_length
-            if entry_data[bed_coords['chrom']] == this_chr:
-                this_chr_entry_bp += this_length
-            else:
-                if this_chr: # if we've read anything in yet:
-                    summary_out.write('\t'.join([this_chr, str(this_chr_fp_utr_bp), str(this_chr_fp_utr_bp/this_chr_entry_bp), str(this_chr_tp_utr_bp), str(this_chr_tp_utr_bp/this_chr_entry_bp), str(this_chr_promoter_bp), str(this_chr_promoter_bp/this_chr_entry_bp), str(this_chr_exon_bp), str(this_chr_exon_bp/this_chr_entry_bp), str(this_chr_intron_bp), str(this_chr_intron_bp/this_chr_entry_bp), str(this_chr_repeat_bp), str(this_chr_repeat_bp/this_chr_entry_bp)])+'\n')
-                ## reset the genomic element lists and read through their files until they're
-                ## on the right chromosome again
-                this_chr = entry_data[bed_coords['chrom']]
-                cur_fp_utrs = []
-                cur_tp_utrs = []                
-                cur_promoters = []
-                cur_exons = []
-                cur_introns = []
-                cur_repeats = []
-
-                ## reset the chromosome tracking variables
-                this_chr_entry_bp = float(this_length)
-                this_chr_fp_utr_bp = 0.0
-                this_chr_tp_utr_bp = 0.0                
-                this_chr_promoter_bp = 0.0 
-                this_chr_exon_bp = 0.0 
-                this_chr_intron_bp = 0.0 
-                this_chr_repeat_bp = 0.0                                 
-
-                ## if we have a match to one of the weird chromosomes, just skip to the next entry
-                if nonref_chr_pattern.match(this_chr) or this_chr=='chrM':
-                    continue
-                
-                while len(cur_fp_utr) > 1 and cur_fp_utr[bed_coords['chrom']] != this_chr:
-                    cur_fp_utr = fp_utrs.readline().strip().split('\t')
-                while len(cur_tp_utr) > 1 and cur_tp_utr[bed_coords['chrom']] != this_chr:
-                    cur_tp_utr = tp_utrs.readline().strip().split('\t')                    
-                while len(cur_promoter) > 1 and cur_promoter[bed_coords['chrom']] != this_chr:
-                    cur_promoter = promoters.readline().strip().split('\t')
-                while len(cur_exon) > 1 and cur_exon[bed_coords['chrom']] != this_chr:
-                    cur_exon = exons.readline().strip().split('\t')
-                while len(cur_intron) > 1 and cur_intron[bed_coords['chrom']] != this_chr:
-                    cur_intron = introns.readline().strip().split('\t')
-                while len(cur_repeat) > 1 and cur_repeat[bed_coords['chrom']] != this_chr:
-                    cur_repeat = repeats.readline().strip().split('\t')
-                print 'Parsing chromosome '+this_chr
-            ## add all possibly overlapping entries for each type of element
-            ## must have same chromosome and start before the end of the entry
-            fp_utrbool = len(cur_fp_utr) > 1 and cur_fp_utr[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_fp_utr[bed_coords['start']]) <= entry_end
-            while fp_utrbool:
-                cur_fp_utrs.append(cur_fp_utr)
-                cur_fp_utr = fp_utrs.readline().strip().split('\t')
-                fp_utrbool = len(cur_fp_utr) > 1 and cur_fp_utr[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_fp_utr[bed_coords['start']]) <= entry_end
-
-            tp_utrbool = len(cur_tp_utr) > 1 and cur_tp_utr[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_tp_utr[bed_coords['start']]) <= entry_end
-            while tp_utrbool:
-                cur_tp_utrs.append(cur_tp_utr)
-                cur_tp_utr = tp_utrs.readline().strip().split('\t')
-                tp_utrbool = len(cur_tp_utr) > 1 and cur_tp_utr[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_tp_utr[bed_coords['start']]) <= entry_end
-                        
-            promoterbool = len(cur_promoter) > 1 and cur_promoter[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_promoter[bed_coords['start']]) <= entry_end
-            while promoterbool:
-                cur_promoters.append(cur_promoter)
-                cur_promoter = promoters.readline().strip().split('\t')
-                promoterbool = len(cur_promoter) > 1 and cur_promoter[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_promoter[bed_coords['start']]) <= entry_end
-                
-            exonbool = len(cur_exon) > 1 and cur_exon[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_exon[bed_coords['start']]) <= entry_end
-            while exonbool:
-                cur_exons.append(cur_exon)
-                cur_exon = exons.readline().strip().split('\t')
-                exonbool = len(cur_exon) > 1 and cur_exon[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_exon[bed_coords['start']]) <= entry_end 
-
-            intronbool = len(cur_intron) > 1 and cur_intron[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_intron[bed_coords['start']]) <= entry_end 
-            while intronbool:
-                cur_introns.append(cur_intron)
-                cur_intron = introns.readline().strip().split('\t')
-                intronbool = len(cur_intron) > 1 and cur_intron[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_intron[bed_coords['start']]) <= entry_end 
-
-            repeatbool = len(cur_repeat) > 1 and cur_repeat[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_repeat[bed_coords['start']]) <= entry_end 
-            while repeatbool:
-                cur_repeats.append(cur_repeat)
-                cur_repeat = repeats.readline().strip().split('\t')
-                repeatbool = len(cur_repeat) > 1 and cur_repeat[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_repeat[bed_coords['start']]) <= entry_end 
-
-            ## remove entries that are before the current entry here:
-            for i in range(len(cur_fp_utrs)-1, -1, -1):
-                if cur_fp_utrs[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_fp_utrs[i][bed_coords['end']]) < entry_start:
-                    cur_fp_utrs.pop(i)
-
-            for i in range(len(cur_tp_utrs)-1, -1, -1):
-                if cur_tp_utrs[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_tp_utrs[i][bed_coords['end']]) < entry_start:
-                    cur_tp_utrs.pop(i)
-            
-            for i in range(len(cur_promoters)-1, -1, -1):
-                if cur_promoters[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_promoters[i][bed_coords['end']]) < entry_start:
-                    cur_promoters.pop(i)
-
-            for i in range(len(cur_exons)-1, -1, -1):
-                if cur_exons[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_exons[i][bed_coords['end']]) < entry_start:
-                    cur_exons.pop(i)
-
-            for i in range(len(cur_introns)-1, -1, -1):
-                if cur_introns[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_introns[i][bed_coords['end']]) < entry_start:
-                    cur_introns.pop(i)
-
-            for i in range(len(cur_repeats)-1, -1, -1):
-                if cur_repeats[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_repeats[i][bed_coords['end']]) < entry_start:
-                    cur_repeats.pop(i)                                        
-                                    
-            ## now compare the current entry to all these peaks
-            ## here i am relying on the correct merging of the bed entries from the element files
-            ## because i dont ever re-merge anything
-            this_fp_utr_bp = 0.0
-            this_tp_utr_bp = 0.0            
-            this_promoter_bp = 0.0
-            this_exon_bp = 0.0
-            this_intron_bp = 0.0
-            this_repeat_bp = 0.0
-            for cfp in cur_fp_utrs:
-                this_fp_utr_bp += max(0, min(int(cfp[bed_coords['end']]), entry_end) - max(int(cfp[bed_coords['start']]), entry_start))
-            for ctp in cur_tp_utrs:
-                this_tp_utr_bp += max(0, min(int(ctp[bed_coords['end']]), entry_end) - max(int(ctp[bed_coords['start']]), entry_start))                                
-            for cp in cur_promoters:
-                this_promoter_bp += max(0, min(int(cp[bed_coords['end']]), entry_end) - max(int(cp[bed_coords['start']]), entry_start))
-            for ce in cur_exons:
-                this_exon_bp += max(0, min(int(ce[bed_coords['end']]), entry_end) - max(int(ce[bed_coords['start']]), entry_start))
-            for ci in cur_introns:
-                this_intron_bp += max(0, min(int(ci[bed_coords['end']]), entry_end) - max(int(ci[bed_coords['start']]), entry_start))
-            for cr in cur_repeats:
-                this_repeat_bp += max(0, min(int(cr[bed_coords['end']]), entry_end) - max(int(cr[bed_coords['start']]), entry_start))
-            ## add these overlaps to the summary trackers
-            this_chr_fp_utr_bp += this_fp_utr_bp
-            this_chr_tp_utr_bp += this_tp_utr_bp                        
-            this_chr_promoter_bp += this_promoter_bp
-            this_chr_exon_bp += this_exon_bp
-            this_chr_intron_bp += this_intron_bp
-            this_chr_repeat_bp += this_repeat_bp
-            
-            total_fp_utr_bp += this_fp_utr_bp
-            total_tp_utr_bp += this_tp_utr_bp            
-            total_promoter_bp += this_promoter_bp
-            total_exon_bp += this_exon_bp
-            total_intron_bp += this_intron_bp
-            total_repeat_bp += this_repeat_bp
-            
-            entry_out.write('\t'.join([entry_data[bed_coords['chrom']], entry_data[bed_coords['start']], entry_data[bed_coords['end']], str(this_fp_utr_bp), str(this_fp_utr_bp / this_length), str(this_tp_utr_bp), str(this_tp_utr_bp / this_length), str(this_promoter_bp), str(this_promoter_bp / this_length), str(this_exon_bp), str(this_exon_bp / this_length), str(this_intron_bp), str(this_intron_bp / this_length), str(this_repeat_bp), str(this_repeat_bp / this_length)])+'\n')
-
-        summary_out.write('\t'.join(['genomewide', str(total_fp_utr_bp), str(total_fp_utr_bp / total_entry_bp), str(total_tp_utr_bp), str(total_tp_utr_bp / total_entry_bp), str(total_promoter_bp), str(total_promoter_bp/total_entry_bp), str(total_exon_bp), str(total_exon_bp/total_entry_bp), str(total_intron_bp), str(total_intron_bp/total_entry_bp), str(total_repeat_bp), str(total_repeat_bp/total_entry_bp)])+'\n')
+        self.summary_out.write('\t'.join(['partition'] + columns)+'\n')
+
+        ## the summary statistics: the total number of base pairs covered by the input bed, and
+        ## the total number of base pairs of each element type overlapped
+        self.total_entry_bp = 0.0
+        self.total_bp = [0.0] * len(self.labels)
+        self.total_class_counts = [0] * (len(self.labels) + 1)
+        self.total_entry_signal = 0.0
+        self.total_signal = [0.0] * len(self.labels) if signal else None
+
+    ## write the results of one chromosome. chr_signal is the (entry signal, element signal)
+    ## pair from chrom_coverage, if there is a signal track
+    def add_chrom(self, this_chr, out_text, this_chr_entry_bp, this_chr_bp, class_counts, chr_signal=None):
+        self.entry_out.write(out_text)
+        columns = [s for bp in this_chr_bp for s in (str(bp), str(bp/this_chr_entry_bp))]
+        if chr_signal is not None:
+            this_chr_entry_signal, this_chr_signal = chr_signal
+            columns += [s for signal in this_chr_signal for s in (str(signal), str(signal/this_chr_entry_signal if this_chr_entry_signal else 0.0))]
+            self.total_entry_signal += this_chr_entry_signal
+            for i in range(len(self.labels)):
+                self.total_signal[i] += this_chr_signal[i]
+        self.summary_out.write('\t'.join([this_chr] + columns)+'\n')
+        self.total_entry_bp += this_chr_entry_bp
+        for i in range(len(self.labels)):
+            self.total_bp[i] += this_chr_bp[i]
+        for i in range(len(class_counts)):
+            self.total_class_counts[i] += class_counts[i]
+
+    ## write the genomewide summary and close the output files
+    def close(self):
+        columns = [s for bp in self.total_bp for s in (str(bp), str(bp/self.total_entry_bp if self.total_entry_bp else 0.0))]
+        if self.total_signal is not None:
+            columns += [s for signal in self.total_signal for s in (str(signal), str(signal/self.total_entry_signal if self.total_entry_signal else 0.0))]
+        self.summary_out.write('\t'.join(['genomewide'] + columns)+'\n')
+        self.entry_out.close()
+        self.summary_out.close()
+        if self.hierarchy_out_f:
+            write_hierarchy_summary(self.labels, self.total_class_counts, self.entrywise_out_f, self.hierarchy_out_f)
+
+def write_hierarchy_summary(labels, class_counts, entrywise_out_f, hierarchy_out_f):
+    """
+    writes the number and proportion of entries in each class of the hierarchy, in the same
+    format as the parse_*_hierarchy.sh scripts
+    """
+    total = sum(class_counts)
+    names = [CLASS_NAMES.get(l, l) for l in labels] + ['Intergenic']
+    with open(hierarchy_out_f, 'w') as hierarchy_out:
+        hierarchy_out.write("Summary of file %s:\n" % entrywise_out_f)
+        hierarchy_out.write("Type\tNumber\tProportion\n")
+        for name, count in zip(names, class_counts):
+            hierarchy_out.write("%s\t%d\t%.5f\n" % (name, count, float(count)/total if total else 0))
+        hierarchy_out.write("Total\t%d\t%.5f\n" % (total, 1.0))
+
+def compute_partitions(partitions, input_f, batch=False, jobs=1, unstranded=False, regions=None, signal_f=None):
+    """
+    computes the coverage of the entries in the bed file over one or more PartitionOutputs (for
+    example, one for each strand) in a single pass over the input. if batch is True, the
+    overlaps are computed with batch_chrom instead of sweep_chrom. if jobs is more than 1, the
+    chromosomes are computed in parallel, which gives exactly the same output. if unstranded is
+    True, every entry goes to every partition regardless of its strand. if regions is given (see
+    region_chrom_results), only the entries overlapping them are computed. if signal_f is given
+    (see SignalTrack), the signal over each overlap is computed as well
+    """
+    start = time.clock()
+    for partition in partitions:
+        if partition.index_f and not index_is_current(partition.categories, partition.index_f):
+            print 'Compiling element index '+partition.index_f
+            compile_partition_index(partition.categories, partition.index_f)
+    signal = SignalTrack(signal_f) if signal_f else None
+    if regions is not None:
+        chrom_results = region_chrom_results(partitions, input_f, batch, jobs, regions, unstranded, signal)
+    elif jobs > 1:
+        chrom_results = parallel_chrom_results(partitions, input_f, batch, jobs, unstranded, signal)
+    else:
+        chrom_results = serial_chrom_results(partitions, input_f, batch, unstranded, signal)
+
+    for partition in partitions:
+        partition.open(signal is not None)
+    for this_chr, results in chrom_results:
+        if not is_nonref_chr(this_chr):
+            print 'Parsing chromosome '+this_chr
+        for partition, result in zip(partitions, results):
+            if result is not None:
+                partition.add_chrom(this_chr, *result)
+    for partition in partitions:
+        partition.close()
 
-    input_beds.close()
-        
     end = time.clock()
     length = end - start
     print "Analysis complete, time: ", length
 
-## another function to calculate coverage over the UTRs
-## takes two files for each UTR, exons and introns:
+def compute_partition_coverage(categories, input_f, entrywise_out_f, summary_out_f, batch=False, jobs=1, index_f=None, hierarchy_out_f=None, regions=None, signal_f=None):
+    """
+    the main function to compute the coverage of the entries in the bed file. categories is an
+    ordered list of (label, bed file) pairs, one for each type of element. the other options
+    are described in PartitionOutput and compute_partitions
+    """
+    compute_partitions([PartitionOutput(categories, entrywise_out_f, summary_out_f, hierarchy_out_f, index_f)], input_f, batch, jobs, regions=regions, signal_f=signal_f)
+
+def compute_coverage(promoter_f, exon_f, intron_f, repeat_f, input_f, entrywise_out_f, summary_out_f):
+    compute_partition_coverage(zip(BASIC_LABELS, [promoter_f, exon_f, intron_f, repeat_f]), input_f, entrywise_out_f, summary_out_f)
+
+## another function to calculate coverage over the UTRs (given one file for each UTR):
+def compute_full_utr_coverage(fp_utr_f, tp_utr_f, promoter_f, exon_f, intron_f, repeat_f, input_f, entrywise_out_f, summary_out_f):
+    compute_partition_coverage(zip(FULL_UTR_LABELS, [fp_utr_f, tp_utr_f, promoter_f, exon_f, intron_f, repeat_f]), input_f, entrywise_out_f, summary_out_f)
+
+## and one for the UTRs split into exons and introns
 def compute_split_utr_coverage(fp_utr_exons_f, fp_utr_introns_f, tp_utr_exons_f, tp_utr_introns_f, promoter_f, exon_f, intron_f, repeat_f, input_f, entrywise_out_f, summary_out_f):
-    start = time.clock()
+    compute_partition_coverage(zip(SPLIT_UTR_LABELS, [fp_utr_exons_f, fp_utr_introns_f, tp_utr_exons_f, tp_utr_introns_f, promoter_f, exon_f, intron_f, repeat_f]), input_f, entrywise_out_f, summary_out_f)
+
+def add_element_arguments(parser):
     """
-    the main function to compute the coverage of the entries in the bed file.
+    adds the options for the UTR and extra element files to an argument parser. the promoter,
+    exon, intron and repeat files are positional arguments, added by the caller as promoter_bed,
+    exon_bed, intron_bed and repeat_bed
     """
-    # define a convenience dictionary to make subsetting clearer
-    bed_coords = {} 
-    bed_coords["chrom"] = 0
-    bed_coords["start"] = 1
-    bed_coords["end"] = 2    
-    bed_coords["strand"] = 5
+    parser.add_argument("--fp_utr", help="The optional .bed file containing the full 5' UTR loci", default=None)
+    parser.add_argument("--tp_utr", help="The optional .bed file containing the full 3' UTR loci", default=None)
+    parser.add_argument("--full_utrs", nargs=4, help="4 .bed files containing the 5' UTR exons, 5' UTR introns, 3' UTR exons, and 3' UTR introns, in that order.", default=None, metavar=('FP_EXONS', 'FP_INTRONS', 'TP_EXONS', 'TP_INTRONS'))
+    parser.add_argument("--category", nargs=2, action="append", help="An additional type of element to compute coverage for, given as a label and a .bed file. Can be given multiple times; these are reported after the repeats, in the order given", default=[], metavar=('LABEL', 'BED'))
 
-    if input_f[-2:]=='gz':
-        input_beds = gzip.open(input_f, 'rb')
+def element_categories(pargs):
+    """
+    gets the ordered list of (label, bed file) pairs of the element files given on the command
+    line (see add_element_arguments)
+    """
+    basic_files = [pargs.promoter_bed, pargs.exon_bed, pargs.intron_bed, pargs.repeat_bed]
+    if pargs.fp_utr or pargs.tp_utr:
+        if not (pargs.fp_utr and pargs.tp_utr):
+            print "Need both 5' and 3' UTR files for UTR analysis; performing promoter/exon/intron/repeat/intergenic coverage only"
+            categories = zip(BASIC_LABELS, basic_files)
+        else:
+            categories = zip(FULL_UTR_LABELS, [pargs.fp_utr, pargs.tp_utr] + basic_files)
+    elif pargs.full_utrs:
+        categories = zip(SPLIT_UTR_LABELS, pargs.full_utrs + basic_files)
     else:
-        input_beds = open(input_f, 'r')
-    
-    with open(fp_utr_exons_f, 'r') as fp_exons, open(fp_utr_introns_f, 'r') as fp_introns, open(tp_utr_exons_f, 'r') as tp_exons, open(tp_utr_introns_f, 'r') as tp_introns, open(promoter_f, 'r') as promoters, open(exon_f, 'r') as exons, open(intron_f, 'r') as introns, open(repeat_f, 'r') as repeats, open(entrywise_out_f, 'w') as entry_out, open(summary_out_f, 'w') as summary_out:
-        # loop through input bed file, and store lists of potential peaks from other file types
-        # (we don't want to stop considering a peak until the start site that we are looking at is
-        # past its end site)
-
-        ## write the output file headers
-        # for the individual entries, write the original entry along with its amount and percent of
-        # overlap with each element
-        entry_out.write("\t".join(['chr', 'start', 'end', 'fp_utr_exon_bp', 'fp_utr_exon_pct', 'fp_utr_intron_bp', 'fp_utr_intron_pct', 'tp_utr_exon_bp', 'tp_utr_exon_pct', 'tp_utr_intron_bp', 'tp_utr_intron_pct', 'promoter_bp', 'promoter_pct', 'exon_bp', 'exon_pct', 'intron_bp', 'intron_pct', 'repeat_bp', 'repeat_pct'])+'\n')
-        # for the summary, we write each chromosomes entry as well as genomewide
-        summary_out.write('\t'.join(['partition', 'fp_utr_exon_bp', 'fp_utr_exon_pct', 'fp_utr_intron_bp', 'fp_utr_intron_pct', 'tp_utr_exon_bp', 'tp_utr_exon_pct', 'tp_utr_intron_bp', 'tp_utr_intron_pct', 'promoter_bp', 'promoter_pct', 'exon_bp', 'exon_pct', 'intron_bp', 'intron_pct', 'repeat_bp', 'repeat_pct'])+'\n')
-
-        ## we store lists of each type of element
-        cur_fp_exons = []
-        cur_fp_introns = []
-        cur_tp_exons = []
-        cur_tp_introns = []        
-        cur_promoters = []
-        cur_exons = []
-        cur_introns = []
-        cur_repeats = []
-
-        ## start reading in these genomic elements
-        cur_fp_exon = fp_exons.readline().strip().split('\t')
-        cur_fp_intron = fp_introns.readline().strip().split('\t')        
-        cur_tp_exon = tp_exons.readline().strip().split('\t')
-        cur_tp_intron = tp_introns.readline().strip().split('\t')        
-        cur_promoter = promoters.readline().strip().split('\t')
-        cur_exon = exons.readline().strip().split('\t')
-        cur_intron = introns.readline().strip().split('\t')
-        cur_repeat = repeats.readline().strip().split('\t')
-
-        ## also initialize our tracking variables for the summary statistics:
-        total_entry_bp = 0.0 # the total number of base pairs covered by the input bed
-        total_fp_exon_bp = 0.0 # total number of 5' UTR exon bps
-        total_fp_intron_bp = 0.0 # total number of 5' UTR intron bps        
-        total_tp_exon_bp = 0.0 # total number of 3' UTR exon bps
-        total_tp_intron_bp = 0.0 # total number of 3' UTR intron bps        
-        total_promoter_bp = 0.0 # the total number of promoter BPs overlapped
-        total_exon_bp = 0.0 # total number of exon BPs overlapped
-        total_intron_bp = 0.0 # total number of intron BPs overlapped
-        total_repeat_bp = 0.0 # total number of repeat BPs overlapped
-
-        # for each chromosome, also store similar info
-        this_chr_entry_bp = 0.0
-        this_chr_fp_exon_bp = 0.0
-        this_chr_fp_intron_bp = 0.0
-        this_chr_tp_exon_bp = 0.0
-        this_chr_tp_intron_bp = 0.0
-        this_chr_promoter_bp = 0.0 
-        this_chr_exon_bp = 0.0 
-        this_chr_intron_bp = 0.0 
-        this_chr_repeat_bp = 0.0 
-
-        # to track which chromosome we're on
-        this_chr = ''
-
-        ## need to make sure that if the entry's chromosome is not in our reference file,
-        ## we just wait..do this by checking if this_chr is in the form of
-        ## chr[0-9]_* (i.e. it's got some random crap after it)
-        ## i am assuming that the reference files only contain canonical chromosomes
-        ## i also manually check against chrM later
-        nonref_chr_pattern = re.compile("^chr.*\_.*$")                        
-        
-        entry_ctr = 0        
-        for entry in input_beds:
-            entry_ctr += 1
-            # if entry_ctr % 1000==0:
-            #     print entry_ctr
-            entry_data = entry.strip().split('\t')
-            entry_start = int(entry_data[bed_coords['start']])
-            entry_end = int(entry_data[bed_coords['end']])
-            this_length = int(entry_data[bed_coords['end']]) - entry_start
-            total_entry_bp += this_length
-            if entry_data[bed_coords['chrom']] == this_chr:
-                this_chr_entry_bp += this_length
-            else:
-                if this_chr: # if we've read anything in yet:
-                    summary_out.write('\t'.join([this_chr, str(this_chr_fp_exon_bp), str(this_chr_fp_exon_bp/this_chr_entry_bp), str(this_chr_fp_intron_bp), str(this_chr_fp_intron_bp/this_chr_entry_bp), str(this_chr_tp_exon_bp), str(this_chr_tp_exon_bp/this_chr_entry_bp), str(this_chr_tp_intron_bp), str(this_chr_tp_intron_bp/this_chr_entry_bp), str(this_chr_promoter_bp), str(this_chr_promoter_bp/this_chr_entry_bp), str(this_chr_exon_bp), str(this_chr_exon_bp/this_chr_entry_bp), str(this_chr_intron_bp), str(this_chr_intron_bp/this_chr_entry_bp), str(this_chr_repeat_bp), str(this_chr_repeat_bp/this_chr_entry_bp)])+'\n')
-                ## reset the genomic element lists and read through their files until they're
-                ## on the right chromosome again
-                this_chr = entry_data[bed_coords['chrom']]
-                cur_fp_exons = []
-                cur_fp_introns = []
-                cur_tp_exons = []
-                cur_tp_introns = []                                
-                cur_promoters = []
-                cur_exons = []
-                cur_introns = []
-                cur_repeats = []
-
-                ## reset the chromosome tracking variables
-                this_chr_entry_bp = float(this_length)
-                this_chr_fp_exon_bp = 0.0
-                this_chr_fp_intron_bp = 0.0
-                this_chr_tp_exon_bp = 0.0
-                this_chr_tp_intron_bp = 0.0                
-                this_chr_promoter_bp = 0.0 
-                this_chr_exon_bp = 0.0 
-                this_chr_intron_bp = 0.0 
-                this_chr_repeat_bp = 0.0                                 
-
-                ## if we have a match to one of the weird chromosomes, just skip to the next entry
-                if nonref_chr_pattern.match(this_chr) or this_chr=='chrM':
-                    continue
-                
-                while len(cur_fp_exon) > 1 and cur_fp_exon[bed_coords['chrom']] != this_chr:
-                    cur_fp_exon = fp_exons.readline().strip().split('\t')
-                while len(cur_fp_intron) > 1 and cur_fp_intron[bed_coords['chrom']] != this_chr:
-                    cur_fp_intron = fp_introns.readline().strip().split('\t')
-                while len(cur_tp_exon) > 1 and cur_tp_exon[bed_coords['chrom']] != this_chr:
-                    cur_tp_exon = tp_exons.readline().strip().split('\t')
-                while len(cur_tp_intron) > 1 and cur_tp_intron[bed_coords['chrom']] != this_chr:
-                    cur_tp_intron = tp_introns.readline().strip().split('\t')
-                while len(cur_promoter) > 1 and cur_promoter[bed_coords['chrom']] != this_chr:
-                    cur_promoter = promoters.readline().strip().split('\t')
-                while len(cur_exon) > 1 and cur_exon[bed_coords['chrom']] != this_chr:
-                    cur_exon = exons.readline().strip().split('\t')
-                while len(cur_intron) > 1 and cur_intron[bed_coords['chrom']] != this_chr:
-                    cur_intron = introns.readline().strip().split('\t')
-                while len(cur_repeat) > 1 and cur_repeat[bed_coords['chrom']] != this_chr:
-                    cur_repeat = repeats.readline().strip().split('\t')
-                print 'Parsing chromosome '+this_chr
-                
-            ## add all possibly overlapping entries for each type of element
-            ## must have same chromosome and start before the end of the entry
-            fp_exonbool = len(cur_fp_exon) > 1 and cur_fp_exon[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_fp_exon[bed_coords['start']]) <= entry_end
-            while fp_exonbool:
-                cur_fp_exons.append(cur_fp_exon)
-                cur_fp_exon = fp_exons.readline().strip().split('\t')
-                fp_exonbool = len(cur_fp_exon) > 1 and cur_fp_exon[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_fp_exon[bed_coords['start']]) <= entry_end
-                
-            fp_intronbool = len(cur_fp_intron) > 1 and cur_fp_intron[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_fp_intron[bed_coords['start']]) <= entry_end            
-            while fp_intronbool:
-                cur_fp_introns.append(cur_fp_intron)
-                cur_fp_intron = fp_introns.readline().strip().split('\t')
-                fp_intronbool = len(cur_fp_intron) > 1 and cur_fp_intron[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_fp_intron[bed_coords['start']]) <= entry_end
-                
-            tp_exonbool = len(cur_tp_exon) > 1 and cur_tp_exon[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_tp_exon[bed_coords['start']]) <= entry_end            
-            while tp_exonbool:
-                cur_tp_exons.append(cur_tp_exon)
-                cur_tp_exon = tp_exons.readline().strip().split('\t')
-                tp_exonbool = len(cur_tp_exon) > 1 and cur_tp_exon[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_tp_exon[bed_coords['start']]) <= entry_end
-                
-            tp_intronbool = len(cur_tp_intron) > 1 and cur_tp_intron[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_tp_intron[bed_coords['start']]) <= entry_end            
-            while tp_intronbool:
-                cur_tp_introns.append(cur_tp_intron)
-                cur_tp_intron = tp_introns.readline().strip().split('\t')
-                tp_intronbool = len(cur_tp_intron) > 1 and cur_tp_intron[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_tp_intron[bed_coords['start']]) <= entry_end
-                        
-            promoterbool = len(cur_promoter) > 1 and cur_promoter[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_promoter[bed_coords['start']]) <= entry_end
-            while promoterbool:
-                cur_promoters.append(cur_promoter)
-                cur_promoter = promoters.readline().strip().split('\t')
-                promoterbool = len(cur_promoter) > 1 and cur_promoter[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_promoter[bed_coords['start']]) <= entry_end
-                
-            exonbool = len(cur_exon) > 1 and cur_exon[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_exon[bed_coords['start']]) <= entry_end
-            while exonbool:
-                cur_exons.append(cur_exon)
-                cur_exon = exons.readline().strip().split('\t')
-                exonbool = len(cur_exon) > 1 and cur_exon[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_exon[bed_coords['start']]) <= entry_end 
-
-            intronbool = len(cur_intron) > 1 and cur_intron[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_intron[bed_coords['start']]) <= entry_end 
-            while intronbool:
-                cur_introns.append(cur_intron)
-                cur_intron = introns.readline().strip().split('\t')
-                intronbool = len(cur_intron) > 1 and cur_intron[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_intron[bed_coords['start']]) <= entry_end 
-
-            repeatbool = len(cur_repeat) > 1 and cur_repeat[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_repeat[bed_coords['start']]) <= entry_end 
-            while repeatbool:
-                cur_repeats.append(cur_repeat)
-                cur_repeat = repeats.readline().strip().split('\t')
-                repeatbool = len(cur_repeat) > 1 and cur_repeat[bed_coords['chrom']]==entry_data[bed_coords['chrom']] and int(cur_repeat[bed_coords['start']]) <= entry_end 
-
-            ## remove entries that are before the current entry here:
-            for i in range(len(cur_fp_exons)-1, -1, -1):
-                if cur_fp_exons[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_fp_exons[i][bed_coords['end']]) < entry_start:
-                    cur_fp_exons.pop(i)
-                    
-            for i in range(len(cur_fp_introns)-1, -1, -1):
-                if cur_fp_introns[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_fp_introns[i][bed_coords['end']]) < entry_start:
-                    cur_fp_introns.pop(i)
-
-            for i in range(len(cur_tp_exons)-1, -1, -1):
-                if cur_tp_exons[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_tp_exons[i][bed_coords['end']]) < entry_start:
-                    cur_tp_exons.pop(i)
-                    
-            for i in range(len(cur_tp_introns)-1, -1, -1):
-                if cur_tp_introns[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_tp_introns[i][bed_coords['end']]) < entry_start:
-                    cur_tp_introns.pop(i)
-            
-            for i in range(len(cur_promoters)-1, -1, -1):
-                if cur_promoters[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_promoters[i][bed_coords['end']]) < entry_start:
-                    cur_promoters.pop(i)
-
-            for i in range(len(cur_exons)-1, -1, -1):
-                if cur_exons[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_exons[i][bed_coords['end']]) < entry_start:
-                    cur_exons.pop(i)
-
-            for i in range(len(cur_introns)-1, -1, -1):
-                if cur_introns[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_introns[i][bed_coords['end']]) < entry_start:
-                    cur_introns.pop(i)
-
-            for i in range(len(cur_repeats)-1, -1, -1):
-                if cur_repeats[i][bed_coords['chrom']] != entry_data[bed_coords['chrom']] or int(cur_repeats[i][bed_coords['end']]) < entry_start:
-                    cur_repeats.pop(i)                                        
-                                    
-            ## now compare the current entry to all these peaks
-            ## here i am relying on the correct merging of the bed entries from the element files
-            ## because i dont ever re-merge anything
-            this_fp_exon_bp = 0.0
-            this_fp_intron_bp = 0.0
-            this_tp_exon_bp = 0.0
-            this_tp_intron_bp = 0.0            
-            this_promoter_bp = 0.0
-            this_exon_bp = 0.0
-            this_intron_bp = 0.0
-            this_repeat_bp = 0.0
-            
-            for cfe in cur_fp_exons:
-                this_fp_exon_bp += max(0, min(int(cfe[bed_coords['end']]), entry_end) - max(int(cfe[bed_coords['start']]), entry_start))
-            for cfi in cur_fp_introns:
-                this_fp_intron_bp += max(0, min(int(cfi[bed_coords['end']]), entry_end) - max(int(cfi[bed_coords['start']]), entry_start))
-            for cte in cur_tp_exons:
-                this_tp_exon_bp += max(0, min(int(cte[bed_coords['end']]), entry_end) - max(int(cte[bed_coords['start']]), entry_start))
-            for cti in cur_tp_introns:
-                this_tp_intron_bp += max(0, min(int(cti[bed_coords['end']]), entry_end) - max(int(cti[bed_coords['start']]), entry_start))
-            for cp in cur_promoters:
-                this_promoter_bp += max(0, min(int(cp[bed_coords['end']]), entry_end) - max(int(cp[bed_coords['start']]), entry_start))
-            for ce in cur_exons:
-                this_exon_bp += max(0, min(int(ce[bed_coords['end']]), entry_end) - max(int(ce[bed_coords['start']]), entry_start))
-            for ci in cur_introns:
-                this_intron_bp += max(0, min(int(ci[bed_coords['end']]), entry_end) - max(int(ci[bed_coords['start']]), entry_start))
-            for cr in cur_repeats:
-                this_repeat_bp += max(0, min(int(cr[bed_coords['end']]), entry_end) - max(int(cr[bed_coords['start']]), entry_start))
-            ## add these overlaps to the summary trackers
-            this_chr_fp_exon_bp += this_fp_exon_bp
-            this_chr_fp_intron_bp += this_fp_intron_bp
-            this_chr_tp_exon_bp += this_tp_exon_bp
-            this_chr_tp_intron_bp += this_tp_intron_bp                                    
-            this_chr_promoter_bp += this_promoter_bp
-            this_chr_exon_bp += this_exon_bp
-            this_chr_intron_bp += this_intron_bp
-            this_chr_repeat_bp += this_repeat_bp
-            
-            total_fp_exon_bp += this_fp_exon_bp
-            total_fp_intron_bp += this_fp_intron_bp
-            total_tp_exon_bp += this_tp_exon_bp
-            total_tp_intron_bp += this_tp_intron_bp            
-            total_promoter_bp += this_promoter_bp
-            total_exon_bp += this_exon_bp
-            total_intron_bp += this_intron_bp
-            total_repeat_bp += this_repeat_bp
-            
-            entry_out.write('\t'.join([entry_data[bed_coords['chrom']], entry_data[bed_coords['start']], entry_data[bed_coords['end']], str(this_fp_exon_bp), str(this_fp_exon_bp / this_length), str(this_fp_intron_bp), str(this_fp_intron_bp / this_length), str(this_tp_exon_bp), str(this_tp_exon_bp / this_length), str(this_tp_intron_bp), str(this_tp_intron_bp / this_length), str(this_promoter_bp), str(this_promoter_bp / this_length), str(this_exon_bp), str(this_exon_bp / this_length), str(this_intron_bp), str(this_intron_bp / this_length), str(this_repeat_bp), str(this_repeat_bp / this_length)])+'\n')
-
-        summary_out.write('\t'.join(['genomewide', str(total_fp_exon_bp), str(total_fp_exon_bp / total_entry_bp), str(total_fp_intron_bp), str(total_fp_intron_bp / total_entry_bp), str(total_tp_exon_bp), str(total_tp_exon_bp / total_entry_bp), str(total_tp_intron_bp), str(total_tp_intron_bp / total_entry_bp), str(total_promoter_bp), str(total_promoter_bp/total_entry_bp), str(total_exon_bp), str(total_exon_bp/total_entry_bp), str(total_intron_bp), str(total_intron_bp/total_entry_bp), str(total_repeat_bp), str(total_repeat_bp/total_entry_bp)])+'\n')
+        categories = zip(BASIC_LABELS, basic_files)
+    categories += [tuple(c) for c in pargs.category]
+    return categories
 
-    input_beds.close()
-        
-    end = time.clock()
-    length = end - start
-    print "Analysis complete, time: ", length        
-        
 if __name__=="__main__":
     # create the argument parser
     parser = argparse.ArgumentParser(description="Compute coverage statistics for each entry of a bed file. All input files should be sorted according to chromosome, strand (if applicable) and start position.")
-    parser.add_argument("--fp_utr", help="The optional .bed file containing the full 5' UTR loci", default=None)
-    parser.add_argument("--tp_utr", help="The optional .bed file containing the full 3' UTR loci", default=None)
-    parser.add_argument("--full_utrs", nargs=4, help="4 .bed files containing the 5' UTR exons, 5' UTR introns, 3' UTR exons, and 3' UTR introns, in that order.", default=None, metavar=('FP_EXONS', 'FP_INTRONS', 'TP_EXONS', 'TP_INTRONS'))
+    add_element_arguments(parser)
+    parser.add_argument("--batch", action="store_true", help="Compute the overlaps of each chromosome with numpy arrays instead of sweeping through the entries one by one. Requires numpy")
+    parser.add_argument("--jobs", type=int, help="The number of processes to use. Each chromosome is computed separately, and the output is the same as a serial run", default=1)
+    parser.add_argument("--index", help="A binary index of the element files. It is compiled from the element files on the first run (or whenever they change) and memory-mapped by later runs instead of reading the element files. Requires numpy", default=None)
+    parser.add_argument("--hierarchy_output", help="Also write the number and proportion of entries in each exclusive class to this file, where each entry is assigned to the first type of element it overlaps (in the order the files are given) or to intergenic. This is the same summary that parse_entrywise_class_hierarchy.sh and parse_split_utr_hierarchy.sh compute", default=None)
+    parser.add_argument("--neg_elements", nargs='+', help="The - strand versions of all the element files, in the same order as the other element files (UTR files first). When these are given, the positional element files and outputs are used for the entries on the + strand and these are used for the - strand, in one pass over the input", default=None, metavar='BED')
+    parser.add_argument("--neg_output", nargs=2, help="The entrywise and summary output files for the - strand entries. Required with --neg_elements", default=None, metavar=('ENTRYWISE', 'SUMMARY'))
+    parser.add_argument("--neg_hierarchy_output", help="The hierarchy summary for the - strand entries", default=None)
+    parser.add_argument("--neg_index", help="The binary index of the - strand element files", default=None)
+    parser.add_argument("--unstranded", action="store_true", help="With --neg_elements, compute every entry against both strands' elements instead of splitting them by the strand in column 6")
+    parser.add_argument("--chrom", action="append", help="Only compute the entries on this chromosome. Can be given multiple times", default=[])
+    parser.add_argument("--region", action="append", help="Only compute the entries overlapping this region, given as chr:start-end (1-based and inclusive, like samtools). Can be given multiple times", default=[])
+    parser.add_argument("--regions-bed", dest="regions_bed", help="Only compute the entries overlapping the loci in this .bed file. The chromosomes are found through an index of their byte offsets in each file, which is saved next to the file (as .chroms) the first time", default=None)
+    parser.add_argument("--signal", help="A bedGraph file (or a track saved with chipseq.BedGraphTrack.save, or a local bigWig file, which requires pyBigWig). The summed signal over each entry's overlap with each type of element, and its proportion of the entry's signal, are added to the outputs. Requires numpy", default=None)
     parser.add_argument("promoter_bed", help="The .bed file containing promoter loci")
     parser.add_argument("exon_bed", help="The .bed file containing exons")
     parser.add_argument("intron_bed", help="The .bed file containing introns")
@@ -740,14 +789,33 @@ if __name__=="__main__":
     parser.add_argument("entrywise_output", help="The path to the desired output file containing each entry of the input bed file with the amount of overlap of each element")
     parser.add_argument("summary_output", help="The path to the desired output file containing summary statistics of the coverage of each type of element")
     pargs = parser.parse_args()
-    
-    if pargs.fp_utr and pargs.tp_utr:
-        if (pargs.fp_utr and not pargs.tp_utr) or (pargs.tp_utr and not pargs.fp_utr):
-            print "Need both 5' and 3' UTR files for UTR analysis; performing promoter/exon/intron/repeat/intergenic coverage only"
-        else:
-            compute_full_utr_coverage(pargs.fp_utr, pargs.tp_utr, pargs.promoter_bed, pargs.exon_bed, pargs.intron_bed, pargs.repeat_bed, pargs.input_bed, pargs.entrywise_output, pargs.summary_output)
-    elif pargs.full_utrs:
-        fp_exons, fp_introns, tp_exons, tp_introns = pargs.full_utrs
-        compute_split_utr_coverage(fp_exons, fp_introns, tp_exons, tp_introns, pargs.promoter_bed, pargs.exon_bed, pargs.intron_bed, pargs.repeat_bed, pargs.input_bed, pargs.entrywise_output, pargs.summary_output)
+    if pargs.batch and numpy is None:
+        parser.error("--batch requires numpy")
+    if (pargs.index or pargs.neg_index) and numpy is None:
+        parser.error("--index requires numpy")
+    if pargs.signal and numpy is None:
+        parser.error("--signal requires numpy")
+    if pargs.signal and pargs.signal.lower().endswith(('.bw', '.bigwig')) and pyBigWig is None:
+        parser.error("reading a bigWig file with --signal requires pyBigWig")
+
+    categories = element_categories(pargs)
+
+    if pargs.neg_elements:
+        if len(pargs.neg_elements) != len(categories):
+            parser.error("--neg_elements needs one file for each of the %d element files" % len(categories))
+        if not pargs.neg_output:
+            parser.error("--neg_elements requires --neg_output")
+        neg_categories = zip([label for label, bed_f in categories], pargs.neg_elements)
+        partitions = [PartitionOutput(categories, pargs.entrywise_output, pargs.summary_output, pargs.hierarchy_output, pargs.index, '+'),
+                      PartitionOutput(neg_categories, pargs.neg_output[0], pargs.neg_output[1], pargs.neg_hierarchy_output, pargs.neg_index, '-')]
     else:
-        compute_coverage(pargs.promoter_bed, pargs.exon_bed, pargs.intron_bed, pargs.repeat_bed, pargs.input_bed, pargs.entrywise_output, pargs.summary_output)
+        partitions = [PartitionOutput(categories, pargs.entrywise_output, pargs.summary_output, pargs.hierarchy_output, pargs.index)]
+
+    regions = None
+    if pargs.chrom or pargs.region or pargs.regions_bed:
+        try:
+            regions = chipseq.collectRegions(pargs.chrom, pargs.region, pargs.regions_bed)
+        except ValueError, e:
+            parser.error(str(e))
+
+    compute_partitions(partitions, pargs.input_bed, batch=pargs.batch, jobs=pargs.jobs, unstranded=pargs.unstranded, regions=regions, signal_f=pargs.signal)
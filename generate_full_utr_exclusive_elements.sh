@@ -4,7 +4,7 @@
 ## alex amlie-wolf 12-04-2015
 ## a script to get exclusive elements including 5' and 3' UTRs
 
-## requires bedtools
+## requires the chipseq.py scripts (build_exclusive_partitions.py)
 
 ## currently using the hierarchy:
 ## 5' UTR exon > 5' UTR intron > 3' UTR exon > 3' UTR intron > promoter > exon > intron > repeat
@@ -22,66 +22,17 @@ if [ $# == 3 ]; then
 	
 	cd ${OUTFOLDER}/${STRAND}_files/
 
-	## generate all the complements:	
-	bedtools complement -i ${INFOLDER}/parsed_UTR5_exon.${STRAND}.merged.bed -g ${CHROM_SIZES} > ${STRAND}_non_5utr_exons.bed
-	bedtools complement -i ${INFOLDER}/parsed_UTR5_intron.${STRAND}.merged.bed -g ${CHROM_SIZES} > ${STRAND}_non_5utr_introns.bed
-	bedtools complement -i ${INFOLDER}/parsed_UTR3_exon.${STRAND}.merged.bed -g ${CHROM_SIZES} > ${STRAND}_non_3utr_exons.bed
-	bedtools complement -i ${INFOLDER}/parsed_UTR3_intron.${STRAND}.merged.bed -g ${CHROM_SIZES} > ${STRAND}_non_3utr_introns.bed
-	bedtools complement -i ${INFOLDER}/parsed_mRNA_promoters.${STRAND}.merged.bed -g ${CHROM_SIZES} > ${STRAND}_non_promoters.bed
-	bedtools complement -i ${INFOLDER}/parsed_mRNA_exon.${STRAND}.merged.bed -g ${CHROM_SIZES} > ${STRAND}_non_exons.bed
-	bedtools complement -i ${INFOLDER}/parsed_mRNA_intron.${STRAND}.merged.bed -g ${CHROM_SIZES} > ${STRAND}_non_introns.bed
-
-	## 5' UTR exon > 5' UTR intron
-	## first copy the input 5' UTR exon file into the final output folder, to be consistent
-	cp ${INFOLDER}/parsed_UTR5_exon.${STRAND}.merged.bed final_files/parsed_${STRAND}_5utr_exons.merged.bed	
-	bedtools intersect -a ${INFOLDER}/parsed_UTR5_intron.${STRAND}.merged.bed -b ${STRAND}_non_5utr_exons.bed > final_files/${STRAND}_n5e_5utr_introns.bed
-
-	## 5' UTR intron > 3' UTR exon
-	bedtools intersect -a ${INFOLDER}/parsed_UTR3_exon.${STRAND}.merged.bed -b ${STRAND}_non_5utr_exons.bed > ${STRAND}_n5e_3utr_exons.bed
-	bedtools intersect -a ${STRAND}_n5e_3utr_exons.bed -b ${STRAND}_non_5utr_introns.bed > final_files/${STRAND}_n5e5i_3utr_exons.bed
-
-	## 3' UTR exon > 3' UTR intron
-	bedtools intersect -a ${INFOLDER}/parsed_UTR3_intron.${STRAND}.merged.bed -b ${STRAND}_non_5utr_exons.bed > ${STRAND}_n5e_3utr_introns.bed
-	bedtools intersect -a ${STRAND}_n5e_3utr_introns.bed -b ${STRAND}_non_5utr_introns.bed > ${STRAND}_n5e5i_3utr_introns.bed
-	bedtools intersect -a ${STRAND}_n5e5i_3utr_introns.bed -b ${STRAND}_non_3utr_exons.bed > final_files/${STRAND}_n5e5i3e_3utr_introns.bed
-
-	## 3' UTR intron > promoter
-	bedtools intersect -a ${INFOLDER}/parsed_mRNA_promoters.${STRAND}.merged.bed -b ${STRAND}_non_5utr_exons.bed > ${STRAND}_n5e_promoters.bed
-	bedtools intersect -a ${STRAND}_n5e_promoters.bed -b ${STRAND}_non_5utr_introns.bed > ${STRAND}_n5e5i_promoters.bed
-	bedtools intersect -a ${STRAND}_n5e5i_promoters.bed -b ${STRAND}_non_3utr_exons.bed > ${STRAND}_n5e5i3e_promoters.bed
-	bedtools intersect -a ${STRAND}_n5e5i3e_promoters.bed -b ${STRAND}_non_3utr_introns.bed > final_files/${STRAND}_n5e5i3e3i_promoters.bed
-
-	## promoter > exon
-	bedtools intersect -a ${INFOLDER}/parsed_mRNA_exon.${STRAND}.merged.bed -b ${STRAND}_non_5utr_exons.bed > ${STRAND}_n5e_exons.bed
-	bedtools intersect -a ${STRAND}_n5e_exons.bed -b ${STRAND}_non_5utr_introns.bed > ${STRAND}_n5e5i_exons.bed
-	bedtools intersect -a ${STRAND}_n5e5i_exons.bed -b ${STRAND}_non_3utr_exons.bed > ${STRAND}_n5e5i3e_exons.bed
-	bedtools intersect -a ${STRAND}_n5e5i3e_exons.bed -b ${STRAND}_non_3utr_introns.bed > ${STRAND}_n5e5i3e3i_exons.bed
-	bedtools intersect -a ${STRAND}_n5e5i3e3i_exons.bed -b ${STRAND}_non_promoters.bed > final_files/${STRAND}_n5e5i3e3ip_exons.bed
-
-	## exon > intron
-	bedtools intersect -a ${INFOLDER}/parsed_mRNA_intron.${STRAND}.merged.bed -b ${STRAND}_non_5utr_exons.bed > ${STRAND}_n5e_introns.bed
-	bedtools intersect -a ${STRAND}_n5e_introns.bed -b ${STRAND}_non_5utr_introns.bed > ${STRAND}_n5e5i_introns.bed
-	bedtools intersect -a ${STRAND}_n5e5i_introns.bed -b ${STRAND}_non_3utr_exons.bed > ${STRAND}_n5e5i3e_introns.bed
-	bedtools intersect -a ${STRAND}_n5e5i3e_introns.bed -b ${STRAND}_non_3utr_introns.bed > ${STRAND}_n5e5i3e3i_introns.bed
-	bedtools intersect -a ${STRAND}_n5e5i3e3i_introns.bed -b ${STRAND}_non_promoters.bed > ${STRAND}_n5e5i3e3ip_introns.bed
-	bedtools intersect -a ${STRAND}_n5e5i3e3ip_introns.bed -b ${STRAND}_non_exons.bed > final_files/${STRAND}_n5e5i3e3ipe_introns.bed
-
-	## intron > repeat
-	bedtools intersect -a ${INFOLDER}/parsed_repeats.${STRAND}.merged.bed -b ${STRAND}_non_5utr_exons.bed > ${STRAND}_n5e_repeats.bed
-	bedtools intersect -a ${STRAND}_n5e_repeats.bed -b ${STRAND}_non_5utr_introns.bed > ${STRAND}_n5e5i_repeats.bed
-	bedtools intersect -a ${STRAND}_n5e5i_repeats.bed -b ${STRAND}_non_3utr_exons.bed > ${STRAND}_n5e5i3e_repeats.bed
-	bedtools intersect -a ${STRAND}_n5e5i3e_repeats.bed -b ${STRAND}_non_3utr_introns.bed > ${STRAND}_n5e5i3e3i_repeats.bed
-	bedtools intersect -a ${STRAND}_n5e5i3e3i_repeats.bed -b ${STRAND}_non_promoters.bed > ${STRAND}_n5e5i3e3ip_repeats.bed
-	bedtools intersect -a ${STRAND}_n5e5i3e3ip_repeats.bed -b ${STRAND}_non_exons.bed > ${STRAND}_n5e5i3e3ipe_repeats.bed
-	bedtools intersect -a ${STRAND}_n5e5i3e3ipe_repeats.bed -b ${STRAND}_non_introns.bed > final_files/${STRAND}_n5e5i3e3ipei_repeats.bed
-
-	echo "Sorting output files"
-
-	for F in final_files/*.bed; do
-	    echo $F
-	    sort -k1,1V -k2,2n $F > $F.sorted
-	    mv $F.sorted $F
-	done
+	## the exclusive partitions are built in one pass over each chromosome, and come out sorted
+	## (the 5' UTR exons are written as they are, since nothing comes before them)
+	python ~/code/bed_statistics/build_exclusive_partitions.py ${CHROM_SIZES} \
+	    --level ${INFOLDER}/parsed_UTR5_exon.${STRAND}.merged.bed final_files/parsed_${STRAND}_5utr_exons.merged.bed \
+	    --level ${INFOLDER}/parsed_UTR5_intron.${STRAND}.merged.bed final_files/${STRAND}_n5e_5utr_introns.bed \
+	    --level ${INFOLDER}/parsed_UTR3_exon.${STRAND}.merged.bed final_files/${STRAND}_n5e5i_3utr_exons.bed \
+	    --level ${INFOLDER}/parsed_UTR3_intron.${STRAND}.merged.bed final_files/${STRAND}_n5e5i3e_3utr_introns.bed \
+	    --level ${INFOLDER}/parsed_mRNA_promoters.${STRAND}.merged.bed final_files/${STRAND}_n5e5i3e3i_promoters.bed \
+	    --level ${INFOLDER}/parsed_mRNA_exon.${STRAND}.merged.bed final_files/${STRAND}_n5e5i3e3ip_exons.bed \
+	    --level ${INFOLDER}/parsed_mRNA_intron.${STRAND}.merged.bed final_files/${STRAND}_n5e5i3e3ipe_introns.bed \
+	    --level ${INFOLDER}/parsed_repeats.${STRAND}.merged.bed final_files/${STRAND}_n5e5i3e3ipei_repeats.bed
 	
 	cd -
 	
@@ -9,21 +9,101 @@ Both the .bed and the reference file must be sorted by chromosome and strand, th
 position. This is to ensure that we don't skip any peaks that we should look at
 """
 
-import argparse, sys, os
+import argparse, sys, os, multiprocessing
+import chipseq
+from array import array
+from bisect import bisect_left, bisect_right
+
+# define convenience dicts to access the bedfile
+bed_coords = {"chrom":0, "start":1, "end":2, "strand":5}
+
+"""
+Holds the peaks of one (chromosome, strand), split into classes of similar length (by powers
+of 2), each with start and end arrays sorted by start. A query only has to look back as far
+as the longest peak of each class from the feature start, so one very long peak only makes
+the lookback of its own class long, instead of every query scanning all the peaks near it
+"""
+class PeakBlock:
+    def __init__(self, peaks=()):
+        # sort by start, keeping the file order of peaks with the same start. each peak keeps
+        # its rank in that order, so the hits of all the classes can be put back in it
+        peaks = sorted(peaks, key=lambda pk: pk[0])
+        classes = {}
+        for rank, (start, end) in enumerate(peaks):
+            classes.setdefault(max(end-start, 1).bit_length(), []).append((start, end, rank))
+        self.classes = []
+        for length_class in sorted(classes):
+            members = classes[length_class]
+            self.classes.append((array('l', [pk[0] for pk in members]), array('l', [pk[1] for pk in members]),
+                                 array('l', [pk[2] for pk in members]), max([end-start for (start, end, rank) in members])))
+
+    # returns the (start, end) of each peak overlapping [start, end], in order of peak start.
+    # like the old linear scan, a peak that only touches the feature counts as overlapping
+    def overlapping(self, start, end):
+        hits = []
+        for starts, ends, ranks, maxlen in self.classes:
+            first = bisect_left(starts, start - maxlen)
+            last = bisect_right(starts, end)
+            hits.extend([(ranks[i], starts[i], ends[i]) for i in xrange(first, last) if ends[i] >= start])
+        if len(self.classes) > 1:
+            hits.sort()
+        return [(pkstart, pkend) for (rank, pkstart, pkend) in hits]
 
 """
-Takes in the reference file, the dict telling us how to refer to that reference file,
-the input .bed file, the output file, and the log file
+Reads the sorted .bed file one (chromosome, strand) block at a time. Blocks that we read
+past on the way to the one we want are cached until they're asked for, so peaks on a
+chromosome or strand with no genes don't stop us from reading the rest of the file
 """
-def compute_statistics(reffile, ref_dict, bedfile, output, log):
-    # define convenience dicts to access the refseq file and the bedfile
-    bed_coords = {} 
-    bed_coords["chrom"] = 0
-    bed_coords["start"] = 1
-    bed_coords["end"] = 2
-    bed_coords["strand"] = 5
+class PeakIndex:
+    def __init__(self, bedfile):
+        self.bedpeaks = chipseq.openFile(bedfile)
+        self.cached = {}
+        self.nextpk = self.read_peak()
+
+    def read_peak(self):
+        curpk = self.bedpeaks.readline().strip()
+        return curpk.split("\t") if curpk else None
+
+    # reads the next block from the file, returning its key and its (start, end) peaks
+    def read_block(self):
+        key = (self.nextpk[bed_coords['chrom']], self.nextpk[bed_coords['strand']])
+        peaks = []
+        while self.nextpk and (self.nextpk[bed_coords['chrom']], self.nextpk[bed_coords['strand']]) == key:
+            peaks.append((int(self.nextpk[bed_coords['start']]), int(self.nextpk[bed_coords['end']])))
+            self.nextpk = self.read_peak()
+        return key, peaks
+
+    # returns the block for this chromosome and strand, which is then dropped from the
+    # index (the reference is sorted, so we won't come back to it)
+    def get_block(self, chrom, strand):
+        key = (chrom, strand)
+        while key not in self.cached and self.nextpk:
+            blockkey, blockpeaks = self.read_block()
+            self.cached.setdefault(blockkey, []).extend(blockpeaks)
+        return PeakBlock(self.cached.pop(key, []))
+
+    def close(self):
+        self.bedpeaks.close()
 
-    # standardize the reference dict (refseq and common name, transcription start, etc)
+"""
+Reads the peaks on one chromosome and strand of the .bed file (overlapping [start, end) if
+those are given) into a PeakBlock, reading only the part of the file that its tabix index or
+chromosome offsets point to (see chipseq.iterRegion)
+"""
+def read_peak_region(bedfile, chrom, strand, start=0, end=None):
+    peaks = []
+    for curpk in chipseq.iterRegion(bedfile, chrom, start, end):
+        curpkdata = curpk.rstrip("\r\n").split("\t")
+        if curpkdata[bed_coords['strand']] == strand:
+            peaks.append((int(curpkdata[bed_coords['start']]), int(curpkdata[bed_coords['end']])))
+    return PeakBlock(peaks)
+
+"""
+Standardizes the reference dict (refseq and common name, transcription start, etc) so that
+the same names work for any of the UCSC tables
+"""
+def standardize_ref_dict(ref_dict):
+    ref_dict = dict(ref_dict)
     # we want refseq to be 'name' and the gene symbol to be 'name2'
     if 'refseq' in ref_dict.keys():
         ref_dict['name'] = ref_dict.pop('refseq')
@@ -34,10 +114,487 @@ def compute_statistics(reffile, ref_dict, bedfile, output, log):
     if 'chromStart' in ref_dict.keys():
         ref_dict['txStart'] = ref_dict.pop('chromStart')
     if 'chromEnd' in ref_dict.keys():
-        ref_dict['txEnd'] = ref_dict.pop('chromEnd')    
-        
-        
-    with open(reffile, 'r') as reference, open(bedfile, 'r') as bedpeaks, open(output, 'w') as outfile, open(log, 'w') as logfile:
+        ref_dict['txEnd'] = ref_dict.pop('chromEnd')
+    return ref_dict
+
+"""
+The transcripts of a reference table, with the exons of each one already trimmed to its
+coding region. The coordinates are kept in flat arrays: the coding exons of transcript i are
+exon_starts[exon_offsets[i]:exon_offsets[i+1]] (and the same slice of exon_ends). Non-coding
+transcripts have no exons
+"""
+class TranscriptModels:
+    coord_arrays = ('tx_starts', 'tx_ends', 'cds_starts', 'cds_ends', 'exon_offsets', 'exon_starts', 'exon_ends')
+    name_lists = ('names', 'symbols', 'chroms', 'strands')
+
+    def __init__(self):
+        for name in self.coord_arrays:
+            setattr(self, name, array('l'))
+        self.exon_offsets.append(0)
+        for name in self.name_lists:
+            setattr(self, name, [])
+
+    def __len__(self):
+        return len(self.names)
+
+    # adds one line of the reference table
+    def add_transcript(self, genedata, ref_dict):
+        cds_start = int(genedata[ref_dict['cdsStart']])
+        cds_end = int(genedata[ref_dict['cdsEnd']])
+        # if the coding region start and end are the same, we have no coding exons
+        if cds_start != cds_end:
+            # start by using all the exons
+            # skips the last character because it's a comma
+            exonstarts = map(int, genedata[ref_dict['exonStarts']][:-1].split(','))
+            exonends = map(int, genedata[ref_dict['exonEnds']][:-1].split(','))
+            # however, these lists contain the UTRs, because of the way refseq works
+            # (the first exon starts at the beginning of the transcript and the last exon
+            # ends at the end of the transcript, always), so we have to trim them
+            for exonstart, exonend in zip(exonstarts, exonends):
+                # if an exon ends before the coding region begins, or starts after the
+                # coding region ends, skip it
+                if exonend < cds_start or exonstart > cds_end:
+                    continue
+                # otherwise, the first coding exon starts at the beginning of the coding
+                # region and the last one ends at its end
+                self.exon_starts.append(max(exonstart, cds_start))
+                self.exon_ends.append(min(exonend, cds_end))
+        self.exon_offsets.append(len(self.exon_starts))
+
+        self.names.append(genedata[ref_dict['name']])
+        self.symbols.append(genedata[ref_dict['name2']])
+        self.chroms.append(genedata[ref_dict['chrom']])
+        self.strands.append(genedata[ref_dict['strand']])
+        self.tx_starts.append(int(genedata[ref_dict['txStart']]))
+        self.tx_ends.append(int(genedata[ref_dict['txEnd']]))
+        self.cds_starts.append(cds_start)
+        self.cds_ends.append(cds_end)
+
+    # returns the name, symbol, chromosome, strand, transcript and coding bounds, and the
+    # coding exon starts and ends of transcript i
+    def transcript(self, i):
+        first, last = self.exon_offsets[i], self.exon_offsets[i+1]
+        return (self.names[i], self.symbols[i], self.chroms[i], self.strands[i],
+                self.tx_starts[i], self.tx_ends[i], self.cds_starts[i], self.cds_ends[i],
+                self.exon_starts[first:last].tolist(), self.exon_ends[first:last].tolist())
+
+    # writes the models to a cache file, recording which reference table they came from
+    def save(self, model_cache, reffile, ref_dict):
+        chipseq.requireNumpy("The transcript model cache")
+        arrays = dict((name, chipseq.numpy.array(getattr(self, name), dtype=chipseq.numpy.int64)) for name in self.coord_arrays)
+        meta = {'source': os.path.abspath(reffile), 'ref_dict': ref_dict}
+        for name in self.name_lists:
+            meta[name] = getattr(self, name)
+        chipseq.saveArrayStore(model_cache, arrays, meta)
+
+"""
+Reads a sorted reference table into TranscriptModels
+"""
+def build_transcript_models(reffile, ref_dict):
+    models = TranscriptModels()
+    reference = chipseq.openFile(reffile)
+    for gene in reference:
+        models.add_transcript(gene.strip().split("\t"), ref_dict)
+    reference.close()
+    return models
+
+"""
+Loads a model cache written by TranscriptModels.save. The coordinate arrays stay
+memory-mapped, except for the per-transcript ones, which are small and used for every gene.
+Returns None if the cache is missing, isn't a cache, or is older than the reference table or
+was built from a different one
+"""
+def load_transcript_models(model_cache, reffile, ref_dict):
+    if not os.path.exists(model_cache) or os.path.getmtime(model_cache) < os.path.getmtime(reffile):
+        return None
+    try:
+        arrays, meta = chipseq.loadArrayStore(model_cache)
+    except ValueError:
+        return None
+    if meta['source'] != os.path.abspath(reffile) or meta['ref_dict'] != ref_dict:
+        return None
+    models = TranscriptModels()
+    for name in models.coord_arrays:
+        if name in ('exon_starts', 'exon_ends'):
+            setattr(models, name, arrays[name])
+        else:
+            setattr(models, name, arrays[name].tolist())
+    for name in models.name_lists:
+        setattr(models, name, [value.encode('utf-8') for value in meta[name]])
+    return models
+
+"""
+Returns the models for a reference table, from model_cache if it's current. Otherwise they're
+built from the table, and written to model_cache if one was given
+"""
+def get_transcript_models(reffile, ref_dict, model_cache=None):
+    ref_dict = standardize_ref_dict(ref_dict)
+    if model_cache:
+        models = load_transcript_models(model_cache, reffile, ref_dict)
+        if models is not None:
+            return models
+    models = build_transcript_models(reffile, ref_dict)
+    if model_cache:
+        models.save(model_cache, reffile, ref_dict)
+    return models
+
+"""
+A log of tab-separated records. Records are only written if the log level is at least the
+level they're given at, and they're collected in memory and written out in chunks. The
+hot path should check the info or debug flag before building a record, so that nothing is
+formatted for a level that's turned off
+"""
+log_levels = ('none', 'info', 'debug')
+class RecordLog:
+    def __init__(self, log=None, level='info', chunk=10000):
+        # without a file, the records are kept until they're taken with take_records
+        self.logfile = open(log, 'w') if log else None
+        self.level = level
+        self.info = log_levels.index(level) >= log_levels.index('info')
+        self.debug = log_levels.index(level) >= log_levels.index('debug')
+        self.chunk = chunk
+        self.records = []
+
+    def record(self, *fields):
+        self.records.append("\t".join(map(str, fields))+"\n")
+        if self.logfile and len(self.records) >= self.chunk:
+            self.flush()
+
+    # adds records taken from another log
+    def add_records(self, records):
+        self.records.extend(records)
+        if self.logfile and len(self.records) >= self.chunk:
+            self.flush()
+
+    def take_records(self):
+        records, self.records = self.records, []
+        return records
+
+    def flush(self):
+        self.logfile.writelines(self.records)
+        self.records = []
+
+    def close(self):
+        self.flush()
+        self.logfile.close()
+
+"""
+Computes the statistics of one transcript (as returned by TranscriptModels.transcript) from
+the block of peaks on its chromosome and strand, and returns its output line (without the
+newline)
+"""
+def gene_statistics(transcript, curblock, logfile):
+    (name, symbol, chrom, strand, tx_start, tx_end, cds_start, cds_end,
+     exonstarts, exonends) = transcript
+    # initialize the output string for this gene            
+    outstring = "\t".join([name, symbol])
+    if logfile.info:
+        logfile.record("gene", name, symbol, chrom, tx_start, tx_end, strand)
+                
+    # now we can get all the overlapping peaks from curblock
+
+    # we have 4 categories of gene section:
+    # 5' UTR (first exon start, which is the same as txStart -> cdsStart)
+    # coding exons (cdsStart->first exon end, second exon start->second exon end, ..., last exon start -> cdsEnd)
+    # introns (second exon start-first exon end, third exon start-second exon end, ...)
+    # 3' UTR (cdsEnd -> last exon end, which is the same as txEnd)
+    
+    exons_covered = 0 # track the number of exons covered
+    exonbases = 0 # track the number of exonic bases covered
+    exonhits = 0 # track the number of peaks overlapping exons
+    introns_covered = 0 # track the number of introns covered
+    intronbases = 0 # track the number of intronic bases covered
+    intronhits = 0 # track the number of peaks overlapping introns
+
+    # define the 4 categories
+    # start with the UTRs, which depend on strand
+    if strand == '+':
+        # in the plus direction, 5' starts at the beginning of the
+        # transcript, 3' ends at the end
+        fp_utr_start = tx_start
+        fp_utr_end = cds_start
+        tp_utr_start = cds_end
+        tp_utr_end = tx_end
+    else:
+        # in the minus direction, 5' starts at the end, 3' ends
+        # at the beginning
+        # this is a bit confusing, because the 'starts' of the UTRs as defined by
+        # these variables go in the 'plus' direction. this is so that we can make the
+        # same index-based comparisons regardless of whether we're on the + or - strand
+        # i.e. the 5' UTR will actually go from the end of the transcript to the end
+        # of the coding region on the minus strand ( cdsEnd <-------- txEnd ), but
+        # we define it the other way so we still ask if a peak ends before it starts
+        # (functionally, cdsEnd ---------> txEnd )
+        fp_utr_start = cds_end
+        fp_utr_end = tx_end
+        tp_utr_start = tx_start
+        tp_utr_end = cds_start
+
+    # the coding exons come already trimmed to the coding region
+    # if the coding region start and end are the same, we have no coding exons
+    if cds_start == cds_end:
+        if logfile.info:
+            logfile.record("noncoding", name)
+        outstring = "\t".join([outstring, "0", "0", "0", "0", "0", "0", "0", "0", "0", "0", "0", "0"])
+    else:
+        # build up the lists of introns
+        intronstarts = []
+        intronends = []
+        # loop through exons (this assumes the two exon lists are the same length,
+        # which they always should be)
+        for i in range(len(exonstarts)-1):
+            intronstarts.append(exonends[i]) # intron starts where exon ends
+            intronends.append(exonstarts[i+1]) # intron ends where exon starts
+
+        # now we have our information on where the exons and introns are, so we do
+        # analysis. the introns follow from the exons, so only the exons are logged
+        if logfile.debug:
+            logfile.record("features", name, fp_utr_start, fp_utr_end, ",".join(map(str, exonstarts)), ",".join(map(str, exonends)), tp_utr_start, tp_utr_end)
+
+        # -------------------------------------------------
+        # loop through exons
+        # -------------------------------------------------
+        for i in range(len(exonstarts)):
+            start = exonstarts[i]
+            end = exonends[i]
+            exonpks = curblock.overlapping(start, end)
+            if logfile.debug:
+                for pkstart, pkend in exonpks:
+                    logfile.record("hit", name, "exon", pkstart, pkend, start, end)
+            if exonpks:
+                exons_covered += 1
+                exonhits += len(exonpks) # add the exonic peaks
+                exonbases += covered_bases(start, end, exonpks)
+
+        # done looping through exons
+        # calculate the number of exonic bases
+        exon_base_total = float(sum([end-start for (end, start) in zip(exonends, exonstarts)]))
+        # calculate the proportion of exonic bases covered
+        exon_prop = (float(exonbases) / exon_base_total) if exonbases > 0 else 0
+        # add the info to the output string: number of exons covered, total exons
+        # proportion of exonic bases, number of exonic bases covered, and number of exonic
+        # peaks
+        outstring = "\t".join([outstring, str(exons_covered), str(len(exonstarts)), str(exon_prop), str(exonbases), str(exon_base_total), str(exonhits)])
+
+        # -------------------------------------------------            
+        # loop through introns now
+        # -------------------------------------------------            
+        for i in range(len(intronstarts)):
+            start = intronstarts[i]
+            end = intronends[i]
+            intronpks = curblock.overlapping(start, end)
+            if intronpks:
+                introns_covered += 1
+                intronhits += len(intronpks) # add the intronic peaks
+                intronbases += covered_bases(start, end, intronpks)
+
+        # done looping through introns
+        # calculate the number of intronic bases
+        intron_base_total = float(sum([end-start for (end, start) in zip(intronends, intronstarts)]))
+
+        # calculate the proportion of intronic bases covered
+        intron_prop = (float(intronbases) / intron_base_total) if intronbases > 0 else 0
+        # add the info to the output string: number of introns covered, total introns
+        # proportion of intronic bases, number of intronic bases covered, # of intronic peaks
+        outstring = "\t".join([outstring, str(introns_covered), str(len(intronstarts)), str(intron_prop), str(intronbases), str(intron_base_total), str(intronhits)])
+
+    # this ends the indentation block for whether there is a coding region or not
+    # -------------------------------------------------            
+    # now do 3' UTRs
+    # -------------------------------------------------            
+    tp_utrpks = curblock.overlapping(tp_utr_start, tp_utr_end)
+    if logfile.debug:
+        for pkstart, pkend in tp_utrpks:
+            logfile.record("hit", name, "3utr", pkstart, pkend, tp_utr_start, tp_utr_end)
+    tp_utrhits = len(tp_utrpks)
+    tp_utrbases = covered_bases(tp_utr_start, tp_utr_end, tp_utrpks)
+
+    tp_utr_base_total = tp_utr_end - tp_utr_start
+    
+    # add the 3' UTR information
+    tp_prop = (float(tp_utrbases)/float(tp_utr_base_total)) if tp_utr_base_total > 0 else 0
+    outstring = "\t".join([outstring, str(tp_utr_base_total), str(tp_utrbases), str(tp_utrhits), str(tp_prop)])
+
+    # -------------------------------------------------                        
+    # now do 5' UTRs
+    # -------------------------------------------------            
+    fp_utrpks = curblock.overlapping(fp_utr_start, fp_utr_end)
+    if logfile.debug:
+        for pkstart, pkend in fp_utrpks:
+            logfile.record("hit", name, "5utr", pkstart, pkend, fp_utr_start, fp_utr_end)
+    fp_utrhits = len(fp_utrpks)
+    fp_utrbases = covered_bases(fp_utr_start, fp_utr_end, fp_utrpks)
+
+    fp_utr_base_total = fp_utr_end - fp_utr_start
+    
+    # add the 5' UTR information
+    fp_prop = (float(fp_utrbases)/float(fp_utr_base_total)) if fp_utr_base_total > 0 else 0
+    outstring = "\t".join([outstring, str(fp_utr_base_total), str(fp_utrbases), str(fp_utrhits), str(fp_prop)])
+                
+    # finally, add the remaining statistics to the output string and write it
+    # calculate the total proportion of bases covered
+    total_prop = (float(intronbases+exonbases+tp_utrbases+fp_utrbases) / (float(tx_end) - float(tx_start))) if intronbases+exonbases+tp_utrbases+fp_utrbases > 0 else 0
+    outstring = "\t".join([outstring, str(intronbases+exonbases+tp_utrbases+fp_utrbases), str(total_prop), str(float(tx_end) - float(tx_start)), str(exonhits+intronhits+tp_utrhits+fp_utrhits)])
+    return outstring
+
+"""
+Goes through the genes in reference order while reading through the .bed file, yielding the
+output line of each one
+"""
+def serial_gene_rows(models, bedfile, logfile):
+    # the peaks are indexed by chromosome and strand, and curblock holds the peaks
+    # on the chromosome and strand of the current gene. each feature then only looks
+    # at the peaks that overlap it
+    peaks = PeakIndex(bedfile)
+    curkey = None
+    curblock = PeakBlock()
+    for i in xrange(len(models)):
+        transcript = models.transcript(i)
+        # when we get to a new chromosome or strand, get its block of peaks
+        if (transcript[2], transcript[3]) != curkey:
+            curkey = (transcript[2], transcript[3])
+            curblock = peaks.get_block(*curkey)
+        yield gene_statistics(transcript, curblock, logfile)
+    peaks.close()
+
+# the models are handed to each worker process when the pool starts, so they aren't
+# sent along with every shard
+shard_models = None
+def init_shard_worker(models):
+    global shard_models
+    shard_models = models
+
+"""
+Computes one (chromosome, strand) shard in a worker process. The shard's peaks are given as
+('region', the read_peak_region arguments) or ('peaks', already read peaks). Returns the index, output line and log records of
+each of its genes
+"""
+def shard_statistics(job):
+    indices, bedfile, (kind, location), log_level = job
+    if kind == 'region':
+        curblock = read_peak_region(bedfile, *location)
+    else:
+        curblock = PeakBlock(location)
+    logfile = RecordLog(None, log_level)
+    rows = []
+    for i in indices:
+        outstring = gene_statistics(shard_models.transcript(i), curblock, logfile)
+        rows.append((i, outstring, logfile.take_records()))
+    return rows
+
+"""
+Splits the genes and the .bed file into (chromosome, strand) shards and computes them in a
+pool of worker processes. Yields the same output lines as serial_gene_rows, in reference
+order, and adds the log records to logfile in the same order
+"""
+def parallel_gene_rows(models, bedfile, logfile, workers):
+    shards = {}
+    shard_keys = []
+    for i in xrange(len(models)):
+        key = (models.chroms[i], models.strands[i])
+        if key not in shards:
+            shards[key] = []
+            shard_keys.append(key)
+        shards[key].append(i)
+
+    # each shard reads its chromosome through the chromosome offsets that chipseq caches next
+    # to a plain file (built here, so the workers don't all write them at once) or through a
+    # tabix index. we can't seek in other compressed files, so those get read here
+    if not chipseq.isCompressed(bedfile) or chipseq.findRegionIndex(bedfile):
+        if not chipseq.isCompressed(bedfile):
+            chipseq.loadChromOffsets(bedfile)
+        sources = dict((key, ('region', key)) for key in shard_keys)
+    else:
+        peaks = PeakIndex(bedfile)
+        blocks = {}
+        while peaks.nextpk:
+            key, blockpeaks = peaks.read_block()
+            blocks.setdefault(key, []).extend(blockpeaks)
+        peaks.close()
+        sources = dict((key, ('peaks', blocks.get(key, []))) for key in shard_keys)
+    shard_jobs = [(shards[key], bedfile, sources[key], logfile.level) for key in shard_keys]
+    for outstring in ordered_shard_rows(models, shard_jobs, xrange(len(models)), logfile, workers):
+        yield outstring
+
+"""
+Computes the shard jobs (see shard_statistics) in a pool of worker processes, or in this
+process if workers is 1. Yields the output lines of the genes in the given order, and adds
+their log records to logfile in the same order
+"""
+def ordered_shard_rows(models, shard_jobs, order, logfile, workers):
+    # shards can finish out of reference order (if the reference isn't sorted), so rows are
+    # held until all the genes before them are written
+    pending = {}
+    order = iter(order)
+    next_i = next(order, None)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, init_shard_worker, (models,))
+        shard_rows = pool.imap(shard_statistics, shard_jobs)
+    else:
+        pool = None
+        init_shard_worker(models)
+        shard_rows = (shard_statistics(job) for job in shard_jobs)
+    try:
+        for rows in shard_rows:
+            for i, outstring, records in rows:
+                pending[i] = (outstring, records)
+            while next_i in pending:
+                outstring, records = pending.pop(next_i)
+                logfile.add_records(records)
+                yield outstring
+                next_i = next(order, None)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+"""
+Computes only the genes whose transcripts overlap the given regions, a list of (chromosome,
+[(start, end), ...]) as returned by chipseq.collectRegions. Each chromosome and strand's
+peaks are read with read_peak_region, so the rest of the .bed file is never read. Yields the
+output lines of those genes in reference order
+"""
+def region_gene_rows(models, bedfile, logfile, workers, regions):
+    regions = dict(regions)
+    shards = {}
+    shard_keys = []
+    selected = []
+    for i in xrange(len(models)):
+        chrom = models.chroms[i]
+        if chrom in regions and chipseq.overlapsRegions(regions[chrom], models.tx_starts[i], models.tx_ends[i]):
+            key = (chrom, models.strands[i])
+            if key not in shards:
+                shards[key] = []
+                shard_keys.append(key)
+            shards[key].append(i)
+            selected.append(i)
+
+    if not chipseq.isCompressed(bedfile):
+        chipseq.loadChromOffsets(bedfile)
+    # the peaks only need to be read as far as the genes reach. peaks that just touch a
+    # feature still count as hits, so the bounds are widened by a base
+    shard_jobs = []
+    for key in shard_keys:
+        start = min(models.tx_starts[i] for i in shards[key])-1
+        end = max(models.tx_ends[i] for i in shards[key])+1
+        shard_jobs.append((shards[key], bedfile, ('region', key+(max(start, 0), end)), logfile.level))
+    for outstring in ordered_shard_rows(models, shard_jobs, selected, logfile, workers):
+        yield outstring
+
+"""
+Takes in the transcript models of the reference, the input .bed file, the output file, and
+the log file. At the info log level, there is a record for each gene (and for each non-coding
+transcript), and at the debug level, also for each transcript's features and each peak
+overlapping an exon or UTR:
+gene    name  symbol  chrom  txStart  txEnd  strand
+noncoding  name
+features  name  5utr_start  5utr_end  exon_starts  exon_ends  3utr_start  3utr_end
+hit  name  exon|3utr|5utr  peak_start  peak_end  feature_start  feature_end
+where exon_starts and exon_ends are comma-separated like in the UCSC tables. If regions are
+given (see region_gene_rows), only the genes overlapping them are computed
+"""
+def compute_statistics(models, bedfile, output, log, log_level='info', workers=1, regions=None):
+    logfile = RecordLog(log, log_level)
+    with open(output, 'w') as outfile:
         # list of statistcs to compute refseq name, normal name, number of exons hit, total
         # number of exons, proportion of exonic bases hit, number of exonic bases covered, same
         # 4 for introns, same 4 for 3' and 5' UTRs, total bases covered, proportion of total
@@ -52,381 +609,43 @@ def compute_statistics(reffile, ref_dict, bedfile, output, log):
 
         # we don't have to pre-parse any of the reference or bed file lines because we assume
         # that pre-processing has been done to sort them and remove the headers
-        
-        # this data structure will hold all the peaks we are currently considering
-        # it gets updated as we go through the genes to get rid of peaks that can no
-        # longer possibly match. it stores them as arrays for ease
-        curpks = []
-
-        # initialize the peak tracking variables
-        # what i'm doing here is making sure that the first iteration of the loop
-        # goes through. These all get reset as soon as the script starts
-        curpk = bedpeaks.readline().strip()
-        curpkdata = curpk.split("\t") # don't append this data yet
-        
-        # now iterate through the reference genes
-        for gene in reference:            
-            # make this gene into an array so we can use our ref_coords dict
-            genedata = gene.strip().split("\t")
-            # initialize the output string for this gene            
-            outstring = "\t".join([genedata[ref_dict["name"]], genedata[ref_dict["name2"]]])
-            logfile.write("Computing statistics on "+"\t".join([genedata[ref_dict["name"]], genedata[ref_dict["name2"]], genedata[ref_dict["chrom"]], genedata[ref_dict["txStart"]], genedata[ref_dict["txEnd"]], genedata[ref_dict['strand']]])+"\n")
-                        
-            # we now must get rid of each peak that cannot overlap with this gene
-            # this is to reduce memory use
-            for i in range(len(curpks)-1, -1, -1): # loop backwards to remove
-                pk = curpks[i]
-                # if we are on the wrong chromosome or the wrong strand, we no longer consider
-                # the peak
-                # ( int(pk[bed_coords['end']]) < int(genedata[ref_dict['txStart']]) ) or
-                if (pk[bed_coords['chrom']] != genedata[ref_dict['chrom']]) or (pk[bed_coords['strand']] != genedata[ref_dict['strand']]):
-                    curpks.pop(i) # remove this peak
-
-            # now, we need to add all the possible next peaks that might match
-            # we add peaks until we violate one of the conditions seen above
-            # also, make sure that we haven't finished reading through the file
-            # lengthbool = int(curpkdata[bed_coords['end']]) >= int(genedata[ref_dict['txStart']]) and int(curpkdata[bed_coords['start']]) <= int(genedata[ref_dict['txEnd']])
-            # here, we check curpk first so that if it's false, we don't try to evaluate
-            # curpkdata and get an index out of bounds error
-            chrombool = curpk and curpkdata[bed_coords['chrom']] == genedata[ref_dict['chrom']]
-            strandbool = curpk and curpkdata[bed_coords['strand']] == genedata[ref_dict['strand']]
-       
-            while chrombool and strandbool:
-                curpks.append(curpkdata) # append the current peak
-                curpk = bedpeaks.readline().strip() # get the next peak to check
-                if curpk: # only if we're not done reading the file
-                    curpkdata = curpk.split("\t") # split it to get its juicy data
-                    # lengthbool = int(curpkdata[bed_coords['end']]) >= int(genedata[ref_dict['txStart']]) and int(curpkdata[bed_coords['start']]) <= int(genedata[ref_dict['txEnd']])
-                    chrombool = curpkdata[bed_coords['chrom']] == genedata[ref_dict['chrom']]
-                    strandbool = curpkdata[bed_coords['strand']] == genedata[ref_dict['strand']]
-                else: 
-                    break
-                                                    
-            # now we have all the possible overlapping peaks in the curpks list
-
-            # we have 4 categories of gene section:
-            # 5' UTR (first exon start, which is the same as txStart -> cdsStart)
-            # coding exons (cdsStart->first exon end, second exon start->second exon end, ..., last exon start -> cdsEnd)
-            # introns (second exon start-first exon end, third exon start-second exon end, ...)
-            # 3' UTR (cdsEnd -> last exon end, which is the same as txEnd)
-            
-            exons_covered = 0 # track the number of exons covered
-            exonbases = 0 # track the number of exonic bases covered
-            exonhits = 0 # track the number of peaks overlapping exons
-            introns_covered = 0 # track the number of introns covered
-            intronbases = 0 # track the number of intronic bases covered
-            intronhits = 0 # track the number of peaks overlapping introns
-            tp_utrbases = 0 # track the 3' utr bases covered
-            tp_utrhits = 0 # track the number of 3' UTR hits
-            fp_utrbases = 0 # track the 5' UTR bases covered
-            fp_utrhits = 0 # track the number of 5' UTR hits
-
-            # define the 4 categories
-            # start with the UTRs, which depend on strand
-            if genedata[ref_dict['strand']] == '+':
-                # in the plus direction, 5' starts at the beginning of the
-                # transcript, 3' ends at the end
-                fp_utr_start = int(genedata[ref_dict['txStart']])
-                fp_utr_end = int(genedata[ref_dict['cdsStart']])
-                tp_utr_start = int(genedata[ref_dict['cdsEnd']])
-                tp_utr_end = int(genedata[ref_dict['txEnd']])
-            else:
-                # in the minus direction, 5' starts at the end, 3' ends
-                # at the beginning
-                # this is a bit confusing, because the 'starts' of the UTRs as defined by
-                # these variables go in the 'plus' direction. this is so that we can make the
-                # same index-based comparisons regardless of whether we're on the + or - strand
-                # i.e. the 5' UTR will actually go from the end of the transcript to the end
-                # of the coding region on the minus strand ( cdsEnd <-------- txEnd ), but
-                # we define it the other way so we still ask if a peak ends before it starts
-                # (functionally, cdsEnd ---------> txEnd )
-                fp_utr_start = int(genedata[ref_dict['cdsEnd']])
-                fp_utr_end = int(genedata[ref_dict['txEnd']])
-                tp_utr_start = int(genedata[ref_dict['txStart']])
-                tp_utr_end = int(genedata[ref_dict['cdsStart']])
-
-            # now define the coding exons
-            # if the coding region start and end are the same, we have no coding exons
-            if int(genedata[ref_dict['cdsStart']]) == int(genedata[ref_dict['cdsEnd']]):
-                logfile.write("Non-coding transcript\n")
-                outstring = "\t".join([outstring, "0", "0", "0", "0", "0", "0", "0", "0", "0", "0", "0", "0"])
-            else:
-                # start by using all the exons
-                # skips the last character because it's a comma
-                exonstarts = map(int, genedata[ref_dict['exonStarts']][:-1].split(','))
-                exonends = map(int, genedata[ref_dict['exonEnds']][:-1].split(','))
-                # however, these lists contain the UTRs, because of the way refseq works
-                # (the first exon starts at the beginning of the transcript and the last exon
-                # ends at the end of the transcript, always), so we have to change them
-
-                # first coding exon starts at the beginning of the coding region            
-                # remove exons that are in the wrong place
-                # loop backwards so that we can remove
-                for i in range(len(exonends)-1, -1, -1):
-                    # if an exon ends before the coding region begins, or starts after the
-                    # coding region ends, remove it and go to the next one
-                    if exonends[i] < int(genedata[ref_dict['cdsStart']]) or exonstarts[i] > int(genedata[ref_dict['cdsEnd']]):
-                        exonends.pop(i)
-                        exonstarts.pop(i)
-                        continue
-
-                    # check for whether we need to set this start to the cdsStart
-                    # this is when the exon starts before the cdsEnd and ends after cdsStart
-                    # (which we already know, from the test above)
-                    if exonstarts[i] < int(genedata[ref_dict['cdsStart']]):
-                        exonstarts[i] = int(genedata[ref_dict['cdsStart']])
-                    # check for whether the end needs to be set to cdsEnd
-                    # this is when the start is before cdsEnd (which we already know it is),
-                    # and the end is after it
-                    if exonends[i] > int(genedata[ref_dict['cdsEnd']]):
-                        exonends[i] = int(genedata[ref_dict['cdsEnd']])
-                
-                # build up the lists of introns
-                intronstarts = []
-                intronends = []
-                # loop through exons (this assumes the two exon lists are the same length,
-                # which they always should be)
-                for i in range(len(exonstarts)-1):
-                    intronstarts.append(exonends[i]) # intron starts where exon ends
-                    intronends.append(exonstarts[i+1]) # intron ends where exon starts
-
-                # now we have our information on where the exons and introns are, so we do
-                # analysis print out the lists to the log file
-                logfile.write("\t".join(["5' UTR:", str(fp_utr_start), str(fp_utr_end), "exons:", str([[exonst, exonend] for (exonst, exonend) in zip(exonstarts, exonends)]), "introns:", str([[intronst, intronend] for (intronst, intronend) in zip(intronstarts, intronends)]), "3' UTR:", str(tp_utr_start), str(tp_utr_end)])+"\n")
-
-                # -------------------------------------------------
-                # loop through exons
-                # -------------------------------------------------
-                for i in range(len(exonstarts)):
-                    covered = False
-                    start = exonstarts[i]
-                    end = exonends[i]
-                    intervalsCovered = [] # this tracks which bases have been covered
-                    for pk in curpks:                                        
-                        # first figure out if we've gone too far past this exon, to avoid
-                        # unecessary looping
-                        if int(pk[bed_coords['start']]) > end:
-                            break # we're too far, so stop checking
-                        # then check if this peak can possibly overlap 
-                        # (we only remove peaks from curpks at each gene iteration)
-                        if int(pk[bed_coords['end']]) < start:
-                            continue # skip this peak
-                        # if we reach this point, then our peak covers at least part of this
-                        # exon
-                        logfile.write("Peak overlap: peak "+"\t".join([pk[bed_coords['start']], pk[bed_coords['end']]])+" exon "+"\t".join([str(start), str(end)])+"\n")
-                        covered = True
-                        exonhits += 1 # add another exonic peak
-
-                        # now compute the coverage
-                        interval = [max(start, int(pk[bed_coords["start"]])), min(end, int(pk[bed_coords["end"]]))]
-                        # check if this interval overlaps with any in the list we have so far
-                        overlap = False
-                        for i in range(len(intervalsCovered)):
-                            curint = intervalsCovered[i]
-                            # check if our end is after their start and our start is before
-                            # their end. this will catch both partial and full overlaps
-                            if interval[1] >= curint[0] and interval[0] <= curint[1]:
-                                overlap = True
-                                # expand the interval
-                                intervalsCovered[i] = [min(interval[0], curint[0]), max(interval[1], curint[1])]
-
-                        # if we didn't overlap, add it to the list
-                        if not overlap:
-                            intervalsCovered.append(interval)
-
-                    if covered:
-                        exons_covered += 1
-                        # we first need to process our intervals list to merge overlaps
-                        # mergedIntervals = mergeOverlaps(intervalsCovered)
-                        # now we get all the bases covered
-                        for interval in intervalsCovered:
-                            exonbases += interval[1] - interval[0]
-
-                # done looping through exons
-                # calculate the number of exonic bases
-                exon_base_total = float(sum([end-start for (end, start) in zip(exonends, exonstarts)]))
-                # calculate the proportion of exonic bases covered
-                exon_prop = (float(exonbases) / exon_base_total) if exonbases > 0 else 0
-                # add the info to the output string: number of exons covered, total exons
-                # proportion of exonic bases, number of exonic bases covered, and number of exonic
-                # peaks
-                outstring = "\t".join([outstring, str(exons_covered), str(len(exonstarts)), str(exon_prop), str(exonbases), str(exon_base_total), str(exonhits)])
-
-                # -------------------------------------------------            
-                # loop through introns now
-                # -------------------------------------------------            
-                for i in range(len(intronstarts)):
-                    covered = False
-                    start = intronstarts[i]
-                    end = intronends[i]
-                    intervalsCovered = [] # this tracks which bases have been covered
-                    for pk in curpks:
-                        # first figure out if we've gone too far past this intron, to avoid
-                        # unecessary looping
-                        if int(pk[bed_coords['start']]) > end:
-                            break
-                        # then check if this peak can even overlap (we have to do this to try
-                        # to optimize because we only remove peaks from curpks at each gene)
-                        if int(pk[bed_coords['end']]) < start:
-                            continue # skip this peak
-                        # if we reach this point, then our peak covers at least part of this intron
-                        covered = True
-                        intronhits += 1 # add another intronic peak
-
-                        # now compute the coverage
-                        interval = [max(start, int(pk[bed_coords["start"]])), min(end, int(pk[bed_coords["end"]]))]
-                        # check if this interval overlaps with any in the list we have so far
-                        overlap = False
-                        for i in range(len(intervalsCovered)):
-                            curint = intervalsCovered[i]
-                            # check if our end is after their start and our start is before
-                            # their end. this will catch both partial and full overlaps
-                            # note that this just expands each interval individually
-                            # the merging step is done later
-                            if interval[1] >= curint[0] and interval[0] <= curint[1]:
-                                overlap = True
-                                # expand the interval
-                                intervalsCovered[i] = [min(interval[0], curint[0]), max(interval[1], curint[1])]
-
-                        # if we didn't overlap, add it to the list
-                        if not overlap:
-                            intervalsCovered.append(interval)
-
-                    if covered:
-                        introns_covered += 1
-                        # we first need to process our intervals list to merge overlaps
-                        ## mergedIntervals = mergeOverlaps(intervalsCovered)
-                        # now we get all the bases covered
-                        for interval in intervalsCovered:
-                            intronbases += interval[1] - interval[0]
-
-                # done looping through introns
-                # calculate the number of intronic bases
-                intron_base_total = float(sum([end-start for (end, start) in zip(intronends, intronstarts)]))
-
-                # calculate the proportion of intronic bases covered
-                intron_prop = (float(intronbases) / intron_base_total) if intronbases > 0 else 0
-                # add the info to the output string: number of introns covered, total introns
-                # proportion of intronic bases, number of intronic bases covered, # of intronic peaks
-                outstring = "\t".join([outstring, str(introns_covered), str(len(intronstarts)), str(intron_prop), str(intronbases), str(intron_base_total), str(intronhits)])
-
-            # this ends the indentation block for whether there is a coding region or not
-            # -------------------------------------------------            
-            # now do 3' UTRs
-            # -------------------------------------------------            
-            intervalsCovered = [] 
-            covered = False
-            for pk in curpks:
-                # if this peak starts after the UTR ends, we stop looking
-                if int(pk[bed_coords['start']]) > tp_utr_end:
-                    break
-                # if it ends before this UTR begins, we skip it
-                if int(pk[bed_coords['end']]) < tp_utr_start:
-                    continue
-                # now our peak overlaps
-                logfile.write("Peak overlap of 3' UTR: "+"\t".join([pk[bed_coords['start']], pk[bed_coords['end']]])+" UTR region "+"\t".join([str(tp_utr_start), str(tp_utr_end)])+"\n")
-                covered = True
-                tp_utrhits += 1 # add a 3' UTR hit
-                interval = [max(tp_utr_start, int(pk[bed_coords['start']])), min(tp_utr_end, int(pk[bed_coords['end']]))]
-                
-                # check if this interval overlaps with any in the list we have so far
-                overlap = False
-                for i in range(len(intervalsCovered)):
-                    curint = intervalsCovered[i]
-                    # check if our end is after their start and our start is before
-                    # their end. this will catch both partial and full overlaps
-                    if interval[1] >= curint[0] and interval[0] <= curint[1]:
-                        overlap = True
-                        # expand the interval
-                        intervalsCovered[i] = [min(interval[0], curint[0]), max(interval[1], curint[1])]
-
-                # if we didn't overlap, add it to the list
-                if not overlap:
-                    intervalsCovered.append(interval)
-
-            # done looping through, compute the bases covered
-            if covered:
-                # mergedIntervals = mergeOverlaps(intervalsCovered)
-                for interval in intervalsCovered:
-                    tp_utrbases += interval[1] - interval[0]
-
-            tp_utr_base_total = tp_utr_end - tp_utr_start
-            
-            # add the 3' UTR information
-            tp_prop = (float(tp_utrbases)/float(tp_utr_base_total)) if tp_utr_base_total > 0 else 0
-            outstring = "\t".join([outstring, str(tp_utr_base_total), str(tp_utrbases), str(tp_utrhits), str(tp_prop)])
-
-            # -------------------------------------------------                        
-            # now do 5' UTRs
-            # -------------------------------------------------            
-            intervalsCovered = [] 
-            covered = False
-            for pk in curpks:
-                # if this peak starts after the UTR ends, we stop looking
-                if int(pk[bed_coords['start']]) > fp_utr_end:
-                    break
-                # if it ends before this UTR begins, we skip it
-                if int(pk[bed_coords['end']]) < fp_utr_start:
-                    continue
-                # now our peak overlaps
-                logfile.write("Peak overlap of 5' UTR: "+"\t".join([pk[bed_coords['start']], pk[bed_coords['end']]])+" UTR region "+"\t".join([str(fp_utr_start), str(fp_utr_end)])+"\n")
-                covered = True
-                fp_utrhits += 1 # add a 5' UTR hit
-                interval = [max(fp_utr_start, int(pk[bed_coords['start']])), min(fp_utr_end, int(pk[bed_coords['end']]))]
-                
-                # check if this interval overlaps with any in the list we have so far
-                overlap = False
-                for i in range(len(intervalsCovered)):
-                    curint = intervalsCovered[i]
-                    # check if our end is after their start and our start is before
-                    # their end. this will catch both partial and full overlaps
-                    if interval[1] >= curint[0] and interval[0] <= curint[1]:
-                        overlap = True
-                        # expand the interval
-                        intervalsCovered[i] = [min(interval[0], curint[0]), max(interval[1], curint[1])]
-
-                # if we didn't overlap, add it to the list
-                if not overlap:
-                    intervalsCovered.append(interval)
-
-            # done looping through, compute the bases covered
-            if covered:
-                ## mergedIntervals = mergeOverlaps(intervalsCovered)
-                for interval in intervalsCovered:
-                    fp_utrbases += interval[1] - interval[0]
-
-            fp_utr_base_total = fp_utr_end - fp_utr_start
-            
-            # add the 5' UTR information
-            fp_prop = (float(fp_utrbases)/float(fp_utr_base_total)) if fp_utr_base_total > 0 else 0
-            outstring = "\t".join([outstring, str(fp_utr_base_total), str(fp_utrbases), str(fp_utrhits), str(fp_prop)])
-                        
-            # finally, add the remaining statistics to the output string and write it
-            # calculate the total proportion of bases covered
-            total_prop = (float(intronbases+exonbases+tp_utrbases+fp_utrbases) / (float(genedata[ref_dict['txEnd']]) - float(genedata[ref_dict['txStart']]))) if intronbases+exonbases+tp_utrbases+fp_utrbases > 0 else 0
-            outstring = "\t".join([outstring, str(intronbases+exonbases+tp_utrbases+fp_utrbases), str(total_prop), str(float(genedata[ref_dict['txEnd']]) - float(genedata[ref_dict['txStart']])), str(exonhits+intronhits+tp_utrhits+fp_utrhits)])
-            
+        if regions is not None:
+            gene_rows = region_gene_rows(models, bedfile, logfile, workers, regions)
+        elif workers > 1:
+            gene_rows = parallel_gene_rows(models, bedfile, logfile, workers)
+        else:
+            gene_rows = serial_gene_rows(models, bedfile, logfile)
+        for outstring in gene_rows:
             outfile.write(outstring+"\n")
 
+        logfile.close()
         print "Analysis complete!"
 
-'''
-This method takes a list of intervals and merges any overlapping ones together.
-I'm leaving it in for completeness, but I found that this is actually superfluous,
-since the intervals are all merged before it ever gets called. 
-'''
-def mergeOverlaps(intervalsCovered):
-    retints = [intervalsCovered[0]] # start with the first interval
-    for start, end in intervalsCovered:
-        # if the current end is after the last intervals start and the current start
-        # is before the end, we have either partial or full overlap
-        if end >= retints[-1][0] and start <= retints[-1][1]:
+"""
+Takes a list of [start, end] intervals sorted by start and merges any overlapping (or
+touching) ones together in a single pass, returning the merged list
+"""
+def mergeOverlaps(intervals):
+    retints = []
+    for start, end in intervals:
+        # since the intervals are sorted by start, this one can only overlap the last
+        # merged interval
+        if retints and start <= retints[-1][1]:
             retints[-1][1] = max(end, retints[-1][1]) # expand the end of the interval
-            retints[-1][0] = min(start, retints[-1][0]) # expand the beginning too
         else: # no overlap
             retints.append([start, end])
     return retints
 
+"""
+Returns the number of bases of [start, end] covered by the union of the given (start, end)
+peaks, which must be sorted by start (as PeakBlock.overlapping returns them). This is used
+for all four kinds of feature
+"""
+def covered_bases(start, end, peaks):
+    # clipping each peak to the feature keeps them sorted by start
+    merged = mergeOverlaps([[max(start, pkstart), min(end, pkend)] for (pkstart, pkend) in peaks])
+    return sum([intend - intstart for (intstart, intend) in merged])
+
 if __name__=="__main__":
     # create the argument parser
     parser = argparse.ArgumentParser(description="Compute coverage statistics of a .bed file over refseq")
@@ -435,8 +654,17 @@ if __name__=="__main__":
     parser.add_argument("bedfile", help="The .bed file that you want to compute overlap statistics for. Must be sorted according to chromosome, strand, then transcript start.")
     parser.add_argument("output", help="The name of the file you want to write the statistics to.")
     parser.add_argument("logfile", help="The name of the file you want to send the log to.")
+    parser.add_argument("--log_level", help="How much to log: none, a record per gene (info), or also each transcript's features and every peak overlapping an exon or UTR (debug)", choices=log_levels, default='info')
+    parser.add_argument("--workers", type=int, help="The number of processes to use. The genes and peaks are split by chromosome and strand, and the output is the same as a serial run", default=1)
+    parser.add_argument("--model_cache", help="A file to cache the transcript models of the reference in. If it's missing or older than the reference file, the models are built from the reference and written to it, otherwise they're loaded from it. Requires numpy", default=None)
+    parser.add_argument("--chrom", action="append", help="Only compute the genes on this chromosome. Can be given multiple times", default=[])
+    parser.add_argument("--region", action="append", help="Only compute the genes overlapping this region, given as chr:start-end (1-based and inclusive, like samtools). Can be given multiple times", default=[])
+    parser.add_argument("--regions-bed", dest="regions_bed", help="Only compute the genes overlapping the loci in this .bed file. The peaks on each chromosome are found through an index of their byte offsets in the .bed file, which is saved next to it (as .chroms) the first time", default=None)
     pargs = parser.parse_args()
 
+    if pargs.model_cache and chipseq.numpy is None:
+        parser.error("--model_cache requires numpy")
+
     ## create the reference dict
     with open(pargs.ref_format, 'r') as formatfile:
         headerline = formatfile.readline().strip()
@@ -448,5 +676,12 @@ if __name__=="__main__":
         for i in range(len(headerdata)):
             ref_dict[headerdata[i].split(".")[-1]] = i
                     
-    compute_statistics(pargs.reffile, ref_dict, pargs.bedfile, pargs.output, pargs.logfile)
+    models = get_transcript_models(pargs.reffile, ref_dict, pargs.model_cache)
+    regions = None
+    if pargs.chrom or pargs.region or pargs.regions_bed:
+        try:
+            regions = chipseq.collectRegions(pargs.chrom, pargs.region, pargs.regions_bed)
+        except ValueError, e:
+            parser.error(str(e))
+    compute_statistics(models, pargs.bedfile, pargs.output, pargs.logfile, pargs.log_level, pargs.workers, regions)
 
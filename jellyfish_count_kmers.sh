@@ -2,22 +2,19 @@
 
 ## jellyfish_count_kmers.sh
 ## alex amlie-wolf 06-23-15
-## uses the jellyfish program to count kmers
+## counts canonical kmers the way jellyfish count -C does, with count_kmers.py (which doesn't
+## need a temporary hash or a dump step)
 ## takes in the input fasta file, the desired value of k, and the output file
-
-TMPDIR=~/data/tmp/
+## to count the kmers in the entries of a bed file without writing a fasta of them first, use
+## python count_kmers.py --bed <bed file> <genome fasta> <k> <output> instead
 
 if [ $# == 3 ]; then
     INFILE=$1
     KVAL=$2
     OUTFILE=$3
 
-    ## write to a temporary file and then extract
-    jellyfish count -m $KVAL -s 100M -t 1 -C -o $TMPDIR/${$}.tmp $INFILE
-    ## get the counts
-    jellyfish dump -c -t -o $OUTFILE $TMPDIR/${$}.tmp
-    jellyfish info $TMPDIR/${$}.tmp > $OUTFILE.info
-    rm $TMPDIR/${$}.tmp
+    ## write the kmers and their counts, tab-separated, like jellyfish dump -c -t
+    python ~/code/bed_statistics/count_kmers.py $INFILE $KVAL $OUTFILE
 else
     echo "Usage: $0 INFILE KVALUE OUTFILE"
 fi
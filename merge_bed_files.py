@@ -7,12 +7,17 @@
 ## merges all of them (does not check whether they are valid or anything)
 ## should be in the same directory as the chipseq.py file
 
-import chipseq, sys
+import chipseq, sys, argparse
 
 if __name__=="__main__":
-    if len(sys.argv) > 2:
-        for i in range(1, len(sys.argv)):
-            chipseq.mergeBed(sys.argv[i])
-    else:
-        print "Usage: "+sys.argv[0]+" <bed file 1> <bed file 2> ...."
-        print "(Takes an arbitrary number of files)"        
+    parser = argparse.ArgumentParser(description="Merge the overlapping entries within each of an arbitrary number of bed files")
+    parser.add_argument("bed_files", nargs='+', help="The bed files to merge. Each one is written to a .merged.bed file next to it")
+    parser.add_argument("--jobs", type=int, help="The number of files to merge at once", default=1)
+    pargs = parser.parse_args()
+
+    try:
+        for bed_f, seconds, maxrss in chipseq.mergeBedFiles(pargs.bed_files, pargs.jobs):
+            print "Merged %s in %.1f seconds (peak memory %d KB)" % (bed_f, seconds, maxrss)
+    except RuntimeError, e:
+        sys.stderr.write(str(e)+"\n")
+        sys.exit(1)
@@ -7,18 +7,20 @@
 ## easily extended (and the order doesn't actually matter)
 ## should be in the same directory as the chipseq.py file
 
-import chipseq, sys
+import chipseq, sys, argparse
 
 if __name__=="__main__":
-    if len(sys.argv)==5:
-        promoter_f = sys.argv[1]
-        exon_f = sys.argv[2]
-        intron_f = sys.argv[3]
-        intergenic_f = sys.argv[4]
-        
-        chipseq.mergeBed(promoter_f)
-        chipseq.mergeBed(exon_f)
-        chipseq.mergeBed(intron_f)
-        chipseq.mergeBed(intergenic_f)
-    else:
-        print "Usage: "+sys.argv[0]+" PROMOTER_FILE EXON_FILE INTRON_FILE INTERGENIC_FILE"
+    parser = argparse.ArgumentParser(description="Merge the overlapping entries within each of the reference bed files")
+    parser.add_argument("promoter_file")
+    parser.add_argument("exon_file")
+    parser.add_argument("intron_file")
+    parser.add_argument("intergenic_file")
+    parser.add_argument("--jobs", type=int, help="The number of files to merge at once", default=1)
+    pargs = parser.parse_args()
+
+    try:
+        for bed_f, seconds, maxrss in chipseq.mergeBedFiles([pargs.promoter_file, pargs.exon_file, pargs.intron_file, pargs.intergenic_file], pargs.jobs):
+            print "Merged %s in %.1f seconds (peak memory %d KB)" % (bed_f, seconds, maxrss)
+    except RuntimeError, e:
+        sys.stderr.write(str(e)+"\n")
+        sys.exit(1)
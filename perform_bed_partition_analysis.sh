@@ -3,7 +3,9 @@
 ## perform_bed_partition_analysis.sh
 ## alex amlie-wolf 12-09-2015
 ## a script that takes in a bed file and performs genomic partition analysis
-## split if it's stranded or not
+## split if it's stranded or not. both strands are computed in one call to the
+## coverage script, which also writes the hierarchy summaries (same format as
+## parse_split_utr_hierarchy.sh)
 
 if [ $# == 3 ]; then
     INBED=$1
@@ -19,81 +21,39 @@ if [ $# == 3 ]; then
     sort -k1,1V -k2,2n ${INBED} > ${OUTDIR}/${BED_NAME}_sorted.bed
     
     if [ ${NCOL} -ge 6 ]; then
-	awk '{if ($6=="+") print $0}' ${OUTDIR}/${BED_NAME}_sorted.bed | sort -k1,1V -k2,2n \
-	    > ${OUTDIR}/pos_${BED_NAME}.bed
-	awk '{if ($6=="-") print $0}' ${OUTDIR}/${BED_NAME}_sorted.bed | sort -k1,1V -k2,2n \
-	    > ${OUTDIR}/neg_${BED_NAME}.bed
-	
-	## hard coded code dir
-	python ~/code/bed_statistics/entrywise_bed_coverage.py \
-	    --full_utrs \
-	    ${PARTITION_DIR}/pos_files/final_files/parsed_pos_5utr_exons.merged.bed \
-	    ${PARTITION_DIR}/pos_files/final_files/pos_n5e_5utr_introns.bed \
-	    ${PARTITION_DIR}/pos_files/final_files/pos_n5e5i_3utr_exons.bed \
-	    ${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e_3utr_introns.bed \
-	    ${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e3i_promoters.bed \
-	    ${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e3ip_exons.bed \
-	    ${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e3ipe_introns.bed \
-	    ${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e3ipei_repeats.bed \
-	    ${OUTDIR}/pos_${BED_NAME}.bed \
-	    ${OUTDIR}/pos_${BED_NAME}_entry.txt ${OUTDIR}/pos_${BED_NAME}_summary.txt
-	
-	python ~/code/bed_statistics/entrywise_bed_coverage.py \
-	    --full_utrs \
-	    ${PARTITION_DIR}/neg_files/final_files/parsed_neg_5utr_exons.merged.bed \
-	    ${PARTITION_DIR}/neg_files/final_files/neg_n5e_5utr_introns.bed \
-	    ${PARTITION_DIR}/neg_files/final_files/neg_n5e5i_3utr_exons.bed \
-	    ${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e_3utr_introns.bed \
-	    ${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e3i_promoters.bed \
-	    ${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e3ip_exons.bed \
-	    ${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e3ipe_introns.bed \
-	    ${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e3ipei_repeats.bed \
-	    ${OUTDIR}/neg_${BED_NAME}.bed \
-	    ${OUTDIR}/neg_${BED_NAME}_entry.txt ${OUTDIR}/neg_${BED_NAME}_summary.txt
-
-	## write the summary to file
-	~/code/bed_statistics/parse_split_utr_hierarchy.sh ${OUTDIR}/pos_${BED_NAME}_entry.txt \
-	    > ${OUTDIR}/pos_${BED_NAME}_parsed_hierarchy.txt
-
-	~/code/bed_statistics/parse_split_utr_hierarchy.sh ${OUTDIR}/neg_${BED_NAME}_entry.txt \
-	    > ${OUTDIR}/neg_${BED_NAME}_parsed_hierarchy.txt
+	## the coverage script splits the entries by strand itself
+	STRAND_OPT=""
     ## if we aren't stranded
     else
 	echo "Performing non-stranded analysis"
-	## hard coded code dir
-	python ~/code/bed_statistics/entrywise_bed_coverage.py \
-	    --full_utrs \
-	    ${PARTITION_DIR}/pos_files/final_files/parsed_pos_5utr_exons.merged.bed \
-	    ${PARTITION_DIR}/pos_files/final_files/pos_n5e_5utr_introns.bed \
-	    ${PARTITION_DIR}/pos_files/final_files/pos_n5e5i_3utr_exons.bed \
-	    ${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e_3utr_introns.bed \
-	    ${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e3i_promoters.bed \
-	    ${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e3ip_exons.bed \
-	    ${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e3ipe_introns.bed \
-	    ${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e3ipei_repeats.bed \
-	    ${OUTDIR}/${BED_NAME}_sorted.bed \
-	    ${OUTDIR}/pos_${BED_NAME}_entry.txt ${OUTDIR}/pos_${BED_NAME}_summary.txt
-	
-	python ~/code/bed_statistics/entrywise_bed_coverage.py \
-	    --full_utrs \
-	    ${PARTITION_DIR}/neg_files/final_files/parsed_neg_5utr_exons.merged.bed \
-	    ${PARTITION_DIR}/neg_files/final_files/neg_n5e_5utr_introns.bed \
-	    ${PARTITION_DIR}/neg_files/final_files/neg_n5e5i_3utr_exons.bed \
-	    ${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e_3utr_introns.bed \
-	    ${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e3i_promoters.bed \
-	    ${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e3ip_exons.bed \
-	    ${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e3ipe_introns.bed \
-	    ${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e3ipei_repeats.bed \
-	    ${OUTDIR}/${BED_NAME}_sorted.bed \
-	    ${OUTDIR}/neg_${BED_NAME}_entry.txt ${OUTDIR}/neg_${BED_NAME}_summary.txt
-
-	## write the summary to file
-	~/code/bed_statistics/parse_split_utr_hierarchy.sh ${OUTDIR}/pos_${BED_NAME}_entry.txt \
-	    > ${OUTDIR}/pos_${BED_NAME}_parsed_hierarchy.txt
-
-	~/code/bed_statistics/parse_split_utr_hierarchy.sh ${OUTDIR}/neg_${BED_NAME}_entry.txt \
-	    > ${OUTDIR}/neg_${BED_NAME}_parsed_hierarchy.txt
+	STRAND_OPT="--unstranded"
     fi
+
+    ## hard coded code dir
+    python ~/code/bed_statistics/entrywise_bed_coverage.py ${STRAND_OPT} \
+	--hierarchy_output ${OUTDIR}/pos_${BED_NAME}_parsed_hierarchy.txt \
+	--full_utrs \
+	${PARTITION_DIR}/pos_files/final_files/parsed_pos_5utr_exons.merged.bed \
+	${PARTITION_DIR}/pos_files/final_files/pos_n5e_5utr_introns.bed \
+	${PARTITION_DIR}/pos_files/final_files/pos_n5e5i_3utr_exons.bed \
+	${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e_3utr_introns.bed \
+	--neg_elements \
+	${PARTITION_DIR}/neg_files/final_files/parsed_neg_5utr_exons.merged.bed \
+	${PARTITION_DIR}/neg_files/final_files/neg_n5e_5utr_introns.bed \
+	${PARTITION_DIR}/neg_files/final_files/neg_n5e5i_3utr_exons.bed \
+	${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e_3utr_introns.bed \
+	${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e3i_promoters.bed \
+	${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e3ip_exons.bed \
+	${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e3ipe_introns.bed \
+	${PARTITION_DIR}/neg_files/final_files/neg_n5e5i3e3ipei_repeats.bed \
+	--neg_output ${OUTDIR}/neg_${BED_NAME}_entry.txt ${OUTDIR}/neg_${BED_NAME}_summary.txt \
+	--neg_hierarchy_output ${OUTDIR}/neg_${BED_NAME}_parsed_hierarchy.txt \
+	${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e3i_promoters.bed \
+	${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e3ip_exons.bed \
+	${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e3ipe_introns.bed \
+	${PARTITION_DIR}/pos_files/final_files/pos_n5e5i3e3ipei_repeats.bed \
+	${OUTDIR}/${BED_NAME}_sorted.bed \
+	${OUTDIR}/pos_${BED_NAME}_entry.txt ${OUTDIR}/pos_${BED_NAME}_summary.txt
 else
     echo "Usage: $0 <input bed file> <output directory>"
 fi
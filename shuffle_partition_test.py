@@ -0,0 +1,208 @@
+"""
+shuffle_partition_test.py
+
+Tests whether the entries of a .bed file overlap each type of element (promoters, exons,
+introns, repeats and optionally UTRs or other categories, as in entrywise_bed_coverage.py) more
+or less than expected by chance. The entries are shuffled many times, each one staying on its
+own chromosome like bedtools shuffle -chrom (and optionally avoiding excluded regions), and the
+coverage of each shuffle is computed the same way as entrywise_bed_coverage.py --batch. For
+each type of element, the output has the observed number of overlapping base pairs and the
+number of entries in its class of the hierarchy, the mean and standard deviation of the same
+statistics over the shuffles, and the empirical p-values of seeing a value at least as high
+(or as low) as the observed one.
+
+The shuffles are drawn as numpy arrays of start positions for many permutations of a chromosome
+at once, and their overlaps are computed in memory, so no shuffled .bed file is ever written.
+This is unstranded: every entry is compared to the one set of element files.
+
+Requires Python >= 2.7 and numpy
+"""
+
+import argparse, sys, time
+import chipseq
+import entrywise_bed_coverage as entrywise
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+## the number of shuffled entries whose overlaps are computed at once
+BATCH_ENTRIES = 1 << 20
+
+## how many times an entry that lands on an excluded region is drawn again before giving up,
+## like bedtools shuffle -maxTries
+MAX_TRIES = 1000
+
+def load_exclusions(exclude_f):
+    """
+    loads the regions that shuffled entries can't overlap, as a dictionary of chromosome ->
+    (starts, ends) arrays of the sorted, merged regions
+    """
+    bed = chipseq.loadBedColumns(exclude_f)
+    loci = sorted((bed["chromosomes"][c], s, e) for c, s, e in zip(bed["chrom"], bed["start"], bed["end"]))
+    excluded = {}
+    for chrom, start, end in chipseq.mergeSortedLoci(loci):
+        excluded.setdefault(chrom, ([], []))
+        excluded[chrom][0].append(start)
+        excluded[chrom][1].append(end)
+    return dict((chrom, (numpy.array(s, dtype=numpy.int64), numpy.array(e, dtype=numpy.int64))) for chrom, (s, e) in excluded.items())
+
+def overlaps_excluded(starts, ends, excluded):
+    """
+    checks which of the (start, end) intervals overlap one of the sorted, merged excluded
+    regions
+    """
+    excl_starts, excl_ends = excluded
+    i = numpy.searchsorted(excl_ends, starts, side='right')
+    return (i < len(excl_starts)) & (excl_starts[numpy.minimum(i, len(excl_starts) - 1)] < ends)
+
+def shuffle_starts(rng, lengths, chrom_size, num_shuffles, excluded=None):
+    """
+    draws new start positions for entries of the given lengths on a chromosome, for several
+    shuffles at once. returns a (num_shuffles, entries) array. each start is uniform over the
+    positions where the entry fits on the chromosome, and entries that land on an excluded
+    region are drawn again
+    """
+    room = chrom_size - lengths + 1
+    starts = (rng.random_sample((num_shuffles, len(lengths))) * room).astype(numpy.int64)
+    if excluded is None:
+        return starts
+    ends = starts + lengths
+    redraw = overlaps_excluded(starts, ends, excluded)
+    tries = 0
+    while redraw.any():
+        tries += 1
+        if tries > MAX_TRIES:
+            raise ValueError("Couldn't place %d shuffled entries outside of the excluded regions" % redraw.sum())
+        rows, cols = numpy.nonzero(redraw)
+        starts[rows, cols] = (rng.random_sample(len(rows)) * room[cols]).astype(numpy.int64)
+        ends[rows, cols] = starts[rows, cols] + lengths[cols]
+        redraw[rows, cols] = overlaps_excluded(starts[rows, cols], ends[rows, cols], excluded)
+    return starts
+
+def read_blocks(categories, chrom):
+    """
+    reads the (starts, ends) arrays of each type of element on a chromosome
+    """
+    if entrywise.is_nonref_chr(chrom):
+        return [(numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)) for c in categories]
+    return [entrywise.parse_block(chipseq.iterRegion(bed_f, chrom)) for label, bed_f in categories]
+
+def coverage_statistics(starts, ends, blocks):
+    """
+    computes the statistics of one or more sets of entries on a chromosome. starts and ends are
+    (sets, entries) arrays. returns the number of base pairs overlapping each type of element
+    and the number of entries in each class of the hierarchy (see
+    entrywise_bed_coverage.chrom_coverage), as (sets, types) and (sets, types + 1) arrays
+    """
+    num_sets, num_entries = starts.shape
+    overlaps = entrywise.batch_overlaps(starts.ravel(), ends.ravel(), blocks).reshape(num_sets, num_entries, len(blocks))
+    bp = overlaps.sum(axis=1)
+    hit = overlaps > 0
+    entry_class = numpy.where(hit.any(axis=2), hit.argmax(axis=2), len(blocks))
+    keys = entry_class + numpy.arange(num_sets)[:,numpy.newaxis] * (len(blocks) + 1)
+    class_counts = numpy.bincount(keys.ravel(), minlength=num_sets * (len(blocks) + 1)).reshape(num_sets, len(blocks) + 1)
+    return bp, class_counts
+
+def shuffle_test(categories, input_f, size_f, num_shuffles, exclude_f=None, seed=None):
+    """
+    the main function. computes the observed statistics of the entries of the input file and
+    the same statistics for each of num_shuffles shuffles of them. returns the observed base
+    pairs and class counts and the (num_shuffles, types) and (num_shuffles, types + 1) arrays
+    of the shuffles
+    """
+    sizes = chipseq.loadSizes(size_f)
+    excluded = load_exclusions(exclude_f) if exclude_f else {}
+    rng = numpy.random.RandomState(seed)
+    bed = chipseq.loadBedColumns(input_f)
+    chroms = numpy.asarray(bed["chrom"])
+    entry_starts = numpy.asarray(bed["start"], dtype=numpy.int64)
+    entry_ends = numpy.asarray(bed["end"], dtype=numpy.int64)
+
+    for code, chrom in enumerate(bed["chromosomes"]):
+        if chrom not in sizes:
+            raise ValueError("The chromosome %s isn't in the sizes file" % chrom)
+        if (entry_ends - entry_starts)[chroms == code].max() > sizes[chrom]:
+            raise ValueError("An entry on %s is longer than the chromosome" % chrom)
+
+    num_types = len(categories)
+    observed_bp = numpy.zeros(num_types, dtype=numpy.int64)
+    observed_counts = numpy.zeros(num_types + 1, dtype=numpy.int64)
+    null_bp = numpy.zeros((num_shuffles, num_types), dtype=numpy.int64)
+    null_counts = numpy.zeros((num_shuffles, num_types + 1), dtype=numpy.int64)
+    for code, chrom in enumerate(bed["chromosomes"]):
+        this_chr = chroms == code
+        starts = entry_starts[this_chr]
+        ends = entry_ends[this_chr]
+        lengths = ends - starts
+        if not entrywise.is_nonref_chr(chrom):
+            print 'Shuffling chromosome '+chrom
+        blocks = read_blocks(categories, chrom)
+
+        bp, class_counts = coverage_statistics(starts[numpy.newaxis,:], ends[numpy.newaxis,:], blocks)
+        observed_bp += bp[0]
+        observed_counts += class_counts[0]
+
+        ## draw as many shuffles at once as fit in a batch of entries
+        batch = max(1, BATCH_ENTRIES // max(len(lengths), 1))
+        for first in xrange(0, num_shuffles, batch):
+            num_sets = min(batch, num_shuffles - first)
+            shuffled = shuffle_starts(rng, lengths, sizes[chrom], num_sets, excluded.get(chrom))
+            bp, class_counts = coverage_statistics(shuffled, shuffled + lengths, blocks)
+            null_bp[first:first+num_sets] += bp
+            null_counts[first:first+num_sets] += class_counts
+    return observed_bp, observed_counts, null_bp, null_counts
+
+def empirical_p_values(observed, null):
+    """
+    computes the empirical p-values of values at least as high and at least as low as each
+    observed value, counting the observed value as one of the shuffles
+    """
+    num_shuffles = null.shape[0]
+    p_high = (1.0 + (null >= observed).sum(axis=0)) / (num_shuffles + 1)
+    p_low = (1.0 + (null <= observed).sum(axis=0)) / (num_shuffles + 1)
+    return p_high, p_low
+
+def write_test_results(labels, observed_bp, observed_counts, null_bp, null_counts, out_f):
+    """
+    writes the observed and shuffled statistics and p-values of each type of element and each
+    class of the hierarchy
+    """
+    names = [entrywise.CLASS_NAMES.get(l, l) for l in labels] + ['Intergenic']
+    with open(out_f, 'w') as out:
+        out.write('\t'.join(['class', 'statistic', 'observed', 'shuffled_mean', 'shuffled_sd', 'p_higher', 'p_lower'])+'\n')
+        for statistic, class_names, observed, null in [('bp', labels, observed_bp, null_bp), ('entries', names, observed_counts, null_counts)]:
+            p_high, p_low = empirical_p_values(observed, null)
+            for i, name in enumerate(class_names):
+                out.write('\t'.join([name, statistic, str(observed[i]), str(null[:,i].mean()), str(null[:,i].std()), str(p_high[i]), str(p_low[i])])+'\n')
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Test the coverage of each type of element by the entries of a bed file against shuffles of the entries within their chromosomes")
+    entrywise.add_element_arguments(parser)
+    parser.add_argument("--shuffles", type=int, help="The number of shuffles to draw", default=1000)
+    parser.add_argument("--exclude", help="A .bed file of regions that shuffled entries can't overlap, like bedtools shuffle -excl", default=None)
+    parser.add_argument("--seed", type=int, help="The seed of the random number generator, to get the same shuffles again", default=None)
+    parser.add_argument("promoter_bed", help="The .bed file containing promoter loci")
+    parser.add_argument("exon_bed", help="The .bed file containing exons")
+    parser.add_argument("intron_bed", help="The .bed file containing introns")
+    parser.add_argument("repeat_bed", help="The .bed file containing the repeat regions")
+    parser.add_argument("input_bed", help="The input .bed file that you want to test")
+    parser.add_argument("chrom_sizes", help="The chromosome sizes file. Every chromosome of the input file must be in it")
+    parser.add_argument("output", help="The file to write the statistics and p-values to")
+    pargs = parser.parse_args()
+
+    if numpy is None:
+        parser.error("shuffling requires numpy")
+    if pargs.shuffles < 1:
+        parser.error("--shuffles must be at least 1")
+
+    categories = entrywise.element_categories(pargs)
+    start = time.time()
+    try:
+        results = shuffle_test(categories, pargs.input_bed, pargs.chrom_sizes, pargs.shuffles, pargs.exclude, pargs.seed)
+    except ValueError, e:
+        sys.stderr.write(str(e)+"\n")
+        sys.exit(1)
+    write_test_results([label for label, bed_f in categories], *(results + (pargs.output,)))
+    print "Shuffle test complete, time: ", time.time() - start